@@ -0,0 +1,308 @@
+import multiprocessing
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from enum import Enum
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterator
+from urllib.parse import parse_qs, urlsplit
+
+import orjson as json
+import typer
+
+from kappa.metrics import peak_rss_mb, reset_peak_rss
+from kappa.paths import OUTPUT_PATH, KappazunderPath
+
+if TYPE_CHECKING:
+    from kappa.metadata import ImageGroups
+
+bench_cli = typer.Typer()
+
+
+class Stage(str, Enum):
+    image_metadata = "extract_image_metadata"
+    stac_items = "create_stac_image_items"
+    images_gdf = "images_gdf"
+    wfs_fetch = "wfs_fetch"
+    prepare_lidar = "prepare_lidar"
+
+
+def wfs_features(groups: "ImageGroups") -> list[bytes]:
+    """Encoded image layer features, in OBJECTID order like the WFS serves them."""
+    first = groups.first
+    return [
+        json.dumps(
+            {
+                "type": "Feature",
+                "id": f"KAPPAZUNDERIMAGEPOGD.{object_id}",
+                "geometry": {"type": "Point", "coordinates": [x, y, z]},
+                "properties": {
+                    "OBJECTID": object_id,
+                    "TRAJECTORYID": trajectory_id,
+                    "IMAGE_NAME": name,
+                    "GPS_TIME": epoch,
+                },
+            }
+        )
+        for object_id, trajectory_id, name, epoch, x, y, z in zip(
+            range(1, len(first) + 1),
+            first["trajectory_id"].tolist(),
+            first["name"].tolist(),
+            first["gps_epoch_s"].tolist(),
+            first["x_m"].tolist(),
+            first["y_m"].tolist(),
+            first["z_m"].tolist(),
+        )
+    ]
+
+
+def stub_wfs_handler(features: list[bytes]) -> type[BaseHTTPRequestHandler]:
+    """Answers GetFeature requests as `kappa.wfs` sends them, paged by startIndex."""
+
+    class StubWfsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = {key: values[-1] for key, values in parse_qs(urlsplit(self.path).query).items()}
+            start = int(query.get("startIndex", 0))
+            page = features[start : start + int(query.get("maxFeatures", len(features)))]
+            body = b"".join(
+                [
+                    b'{"type":"FeatureCollection","totalFeatures":',
+                    str(len(features)).encode(),
+                    b',"features":[',
+                    b",".join(page),
+                    b"]}",
+                ]
+            )
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubWfsHandler
+
+
+@contextmanager
+def stub_wfs(features: list[bytes]) -> Iterator[str]:
+    """Serve ``features`` on a free local port, yields the WFS URL."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), stub_wfs_handler(features))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}/geo?service=WFS"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def run_stage(stage: Stage, base_dir: Path, workers: int, wfs_url: str | None) -> dict:
+    """Time one stage in this process, meant to run in a fresh worker process.
+
+    Inputs a stage needs but does not produce are prepared before the clock starts.
+    """
+    from kappa.metadata import extract_image_metadata, extract_trajectory_metadata
+
+    kappa_path = KappazunderPath(base_dir)
+    match stage:
+        case Stage.image_metadata:
+            def run():
+                extract_image_metadata(kappa_path)
+        case Stage.stac_items:
+            from kappa.stac import Validation, create_stac_image_items
+
+            groups = extract_image_metadata(kappa_path)
+            trajectories = extract_trajectory_metadata(kappa_path)
+
+            def run():
+                create_stac_image_items(
+                    groups, trajectories, validation=Validation.schema_once, workers=workers
+                )
+        case Stage.images_gdf:
+            from kappa.stac import images_gdf
+
+            def run():
+                images_gdf(kappa_path)
+        case Stage.wfs_fetch:
+            from kappa.wfs import IMAGE_META_LAYER, get_all_features
+
+            def run():
+                get_all_features(wfs_url, IMAGE_META_LAYER, concurrency=workers)
+        case Stage.prepare_lidar:
+            from kappa.lidar import convert_scans
+
+            output_dir = Path(tempfile.mkdtemp(prefix="kappa-bench-"))
+
+            def run():
+                convert_scans([kappa_path], output_dir, workers, force=True)
+    reset_peak_rss()
+    start = time.perf_counter()
+    run()
+    return {
+        "seconds": time.perf_counter() - start,
+        "peak_rss_mb": peak_rss_mb(),
+        # Largest worker process of the stage, if it had any.
+        "worker_peak_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+def benchmark(
+    base_dir: Path, stages: list[Stage], workers: int, wfs_url: str | None
+) -> Iterator[dict]:
+    """Run every stage in its own process, so memory of one does not leak into the next."""
+    for stage in stages:
+        with ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            try:
+                result = executor.submit(run_stage, stage, base_dir, workers, wfs_url).result()
+            except Exception as e:
+                result = {"error": f"{type(e).__name__}: {e}"}
+        yield {"stage": stage.value, **result}
+
+
+@bench_cli.command()
+def generate(
+    output_dir: Path,
+    images: int = typer.Option(10_000, help="Image groups, six faces each."),
+    trajectories: int = 4,
+    scans_per_trajectory: int = 2,
+    points_per_scan: int = 100_000,
+    face_size: int = typer.Option(64, help="JPEG face edge in pixels, 0 to skip faces."),
+    seed: int = 0,
+):
+    """Write a synthetic extract in the Kappazunder layout."""
+    from kappa.synthetic import SyntheticOptions, generate_extract
+
+    generate_extract(
+        output_dir,
+        SyntheticOptions(
+            images=images,
+            trajectories=trajectories,
+            scans_per_trajectory=scans_per_trajectory,
+            points_per_scan=points_per_scan,
+            face_size=face_size,
+            seed=seed,
+        ),
+    )
+
+
+@bench_cli.command()
+def run(
+    size: list[int] = typer.Option([10_000, 100_000, 1_000_000], help="Image groups to test."),
+    stage: list[Stage] = typer.Option(list(Stage), help="Stages to run, all by default."),
+    data_dir: Path = typer.Option(
+        OUTPUT_PATH / "bench", help="Synthetic extracts are kept and reused here."
+    ),
+    output: Path = OUTPUT_PATH / "bench" / "results.jsonl",
+    workers: int = typer.Option(4, help="Workers of stages that have them."),
+    trajectories: int = 4,
+    points_per_scan: int = 100_000,
+    face_size: int = typer.Option(0, help="JPEG face edge in pixels, no stage reads faces."),
+):
+    """Time every stage and its peak memory on synthetic extracts of each size.
+
+    Results are appended to the output as JSON lines and printed as a table.
+    """
+    import pandas as pd
+
+    from kappa.metadata import extract_image_metadata
+    from kappa.synthetic import SyntheticOptions, ensure_extract
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    results = []
+    for images in size:
+        base_dir = data_dir / f"extract-{images}"
+        kappa_path = ensure_extract(
+            base_dir,
+            SyntheticOptions(
+                images=images,
+                trajectories=trajectories,
+                points_per_scan=points_per_scan,
+                face_size=face_size,
+            ),
+        )
+        features = wfs_features(extract_image_metadata(kappa_path)) if Stage.wfs_fetch in stage else []
+        with stub_wfs(features) as wfs_url:
+            for result in benchmark(base_dir, stage, workers, wfs_url):
+                result = {"images": images, "workers": workers, **result}
+                print(json.dumps(result).decode())
+                with output.open("ab") as f:
+                    f.write(json.dumps(result) + b"\n")
+                results.append(result)
+        del features
+    print(pd.DataFrame(results).to_string(index=False))
+
+
+# Seconds `kappa ... --help` may take, commands are resolved lazily by kappa.cli.
+STARTUP_BUDGETS = {
+    "": 0.5,
+    "bench": 0.5,
+    "extract": 0.5,
+    "panoramas": 1.5,
+    "stac": 2.0,
+    "tiles": 1.5,
+    "wfs": 1.5,
+}
+
+
+def startup_seconds(args: list[str], runs: int) -> tuple[float, str]:
+    """Fastest of ``runs`` fresh interpreters running ``kappa <args> --help``.
+
+    Also returns the ``-X importtime`` report of the last run.
+    """
+    best = float("inf")
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-m", "kappa.cli", *args, "--help"],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        best = min(best, time.perf_counter() - start)
+    return best, result.stderr
+
+
+def slowest_imports(importtime: str, count: int = 5) -> list[tuple[str, float]]:
+    """Imports of the entry point with the largest cumulative time, in seconds."""
+    imports = []
+    for line in importtime.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \| (\s*)(\S+)", line)
+        # Nested imports are indented.
+        if match and not match[2]:
+            imports.append((match[3], int(match[1]) / 1e6))
+    return sorted(imports, key=lambda item: -item[1])[:count]
+
+
+@bench_cli.command()
+def startup(
+    runs: int = typer.Option(5, help="Interpreters started per command, the fastest counts."),
+    scale: float = typer.Option(1.0, help="Multiply every budget, e.g. for slow CI machines."),
+):
+    """Check `kappa --help` and every subcommand's help against startup budgets.
+
+    Exits with status 1 when any command is over its budget, listing its
+    slowest imports.
+    """
+    over_budget = []
+    for command, budget in STARTUP_BUDGETS.items():
+        args = command.split()
+        seconds, importtime = startup_seconds(args, runs)
+        status = "ok" if seconds <= budget * scale else "OVER"
+        print(f"{status:4}  kappa {command + ' ' if command else ''}--help  {seconds:.2f}s of {budget * scale:.2f}s")
+        if status == "OVER":
+            over_budget.append(command)
+            for name, import_seconds in slowest_imports(importtime):
+                print(f"        {import_seconds:.2f}s  {name}")
+    if over_budget:
+        raise typer.Exit(1)
@@ -1,14 +1,93 @@
+import importlib
+import sys
+from pathlib import Path
+
 import typer
+import typer.main
+from typer.core import TyperCommand, TyperGroup
+
+from kappa import metrics
+
+# Subcommand groups as "module:Typer app" and their help, which both
+# `kappa --help` and `kappa <group> --help` show. Modules are imported only
+# when their subcommand runs, so startup does not pay for geopandas, pyproj,
+# pystac, boto3 or py3dtiles.
+SUBCOMMANDS = {
+    "bench": ("kappa.bench:bench_cli", "Generate synthetic extracts and benchmark pipeline stages."),
+    "extract": (
+        "kappa.extract:extract_cli",
+        "Process data extract from https://www.wien.gv.at/geodatenviewer",
+    ),
+    "panoramas": ("kappa.panoramas:panoramas_cli", "Find panoramas near a location."),
+    "stac": ("kappa.stac:stac_cli", "Prepare STAC catalog [WIP]."),
+    "tiles": ("kappa.tiles:tiles_cli", "Build vector tiles."),
+    "wfs": (
+        "kappa.wfs:wfs_cli",
+        "Extract data from WFS server - https://data.wien.gv.at/daten/geo?version=1.1.0&service=WFS",
+    ),
+}
+
+
+class LazyGroup(TyperGroup):
+    """Typer group loading the modules of `SUBCOMMANDS` on first use."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.listing = False
+        self.loaded = {}
+
+    def list_commands(self, ctx) -> list[str]:
+        return sorted({*super().list_commands(ctx), *SUBCOMMANDS})
+
+    def get_command(self, ctx, cmd_name: str):
+        if cmd_name not in SUBCOMMANDS:
+            return super().get_command(ctx, cmd_name)
+        if self.listing:
+            return TyperCommand(name=cmd_name, help=SUBCOMMANDS[cmd_name][1])
+        if cmd_name not in self.loaded:
+            module, attribute = SUBCOMMANDS[cmd_name][0].split(":")
+            group = typer.main.get_group(getattr(importlib.import_module(module), attribute))
+            group.name = cmd_name
+            group.help = SUBCOMMANDS[cmd_name][1]
+            group.no_args_is_help = True
+            self.loaded[cmd_name] = group
+        return self.loaded[cmd_name]
+
+    def format_help(self, ctx, formatter) -> None:
+        # Listing subcommands only needs their help, not their modules.
+        self.listing = True
+        try:
+            super().format_help(ctx, formatter)
+        finally:
+            self.listing = False
+
+
+app = typer.Typer(
+    cls=LazyGroup, name='kappa', no_args_is_help=True, help="Process Kappazunder 2020 data."
+)
 
-from kappa.stac import stac_cli
-from kappa.extract import extract_cli
-from kappa.wfs import wfs_cli
 
-app = typer.Typer(name='kappa', no_args_is_help=True, help="Process Kappazunder 2020 data.")
+@app.callback()
+def main(
+    ctx: typer.Context,
+    metrics_out: Path = typer.Option(
+        None, help="Append wall/CPU time, peak memory, IO and HTTP requests of every stage as JSON lines."
+    ),
+    profile: str = typer.Option(
+        None, help="Profile one stage, e.g. 'extract merge-images' or 'read_image_meta'."
+    ),
+    profiler: metrics.Profiler = typer.Option(
+        metrics.Profiler.cprofile, help="cProfile stats, or sampled folded stacks for flame graphs."
+    ),
+    profile_out: Path = typer.Option(None, help="Defaults to a file next to --metrics-out."),
+):
+    if metrics_out is None and profile is None:
+        return
+    recorder = metrics.MetricsRecorder(metrics_out, profile, profiler, profile_out)
+    metrics.enable(recorder)
+    ctx.call_on_close(metrics.disable)
+    ctx.with_resource(recorder.stage(metrics.command_path(ctx, sys.argv[1:])))
 
-app.add_typer(extract_cli, name='extract', no_args_is_help=True)
-app.add_typer(stac_cli, name='stac', no_args_is_help=True)
-app.add_typer(wfs_cli, name='wfs', no_args_is_help=True)
 
 if __name__ == "__main__":
     app()
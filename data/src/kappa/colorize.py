@@ -0,0 +1,301 @@
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+
+import laspy
+import numpy as np
+import pandas as pd
+from PIL import Image
+from tqdm import tqdm
+
+from kappa import metrics
+from kappa.lidar import (
+    COPC_MANIFEST,
+    SCAN_PATH,
+    CopcManifest,
+    convert_to_copc,
+    copc_scan,
+    is_up_to_date,
+    load_manifests,
+    scan_targets,
+)
+from kappa.metadata import ImageGroups, read_interior_orientation
+from kappa.paths import KappazunderPath
+from kappa.trajectory import euler_to_matrix
+
+# Point formats with the same dimensions plus RGB.
+RGB_POINT_FORMATS = {0: 2, 1: 3, 2: 2, 3: 3, 4: 5, 5: 5, 6: 7, 7: 7, 8: 8, 9: 10, 10: 10}
+
+
+@dataclass
+class ColorizeOptions:
+    chunk_size: int = 1_000_000
+    # Decoded images kept by every worker.
+    cache_bytes: int = 2**30
+    # Points further from the nearest image in time keep their color.
+    max_time_gap_s: float = 1.0
+
+
+@dataclass
+class CubemapFaces:
+    """Orientation of every face of one trajectory, in groups sorted by epoch.
+
+    The faces of the ``i``-th group are the rows ``offsets[i]:offsets[i + 1]``.
+    """
+
+    epochs: np.ndarray
+    offsets: np.ndarray
+    # Projection centers, (n, 3).
+    positions: np.ndarray
+    # Sensor to global rotations, (n, 3, 3).
+    rotations: np.ndarray
+    # Focal length in pixels along u and v, image width and height, (n, 4).
+    cameras: np.ndarray
+    paths: np.ndarray
+
+    @classmethod
+    def from_groups(cls, groups: ImageGroups, interior: pd.DataFrame) -> dict[int, "CubemapFaces"]:
+        """Faces of every trajectory, by trajectory id."""
+        faces = groups.faces.assign(
+            group_epoch_s=np.repeat(groups.first["gps_epoch_s"].to_numpy(), groups.sizes)
+        )
+        unknown = set(faces["sensor_id"].unique()) - set(interior.index)
+        if unknown:
+            raise ValueError(f"No interior orientation for sensors {sorted(unknown)}")
+        not_perspective = interior.index[interior["projection"] != "p"]
+        if faces["sensor_id"].isin(not_perspective).any():
+            raise ValueError("Only perspective cubemap faces can be projected into")
+        cameras = interior.loc[faces["sensor_id"]]
+        faces = faces.assign(
+            focal_u_px=(cameras["c_mm"] / cameras["psu_mm"]).to_numpy(),
+            focal_v_px=(cameras["c_mm"] / cameras["psv_mm"]).to_numpy(),
+            pixu=cameras["pixu"].to_numpy(),
+            pixv=cameras["pixv"].to_numpy(),
+        )
+        by_trajectory = {}
+        for trajectory_id, trajectory in faces.groupby("trajectory_id", sort=False):
+            trajectory = trajectory.sort_values(["group_epoch_s", "id"], kind="stable")
+            ids = trajectory["id"].to_numpy()
+            boundaries = np.flatnonzero(ids[1:] != ids[:-1]) + 1
+            offsets = np.concatenate([[0], boundaries, [len(ids)]]).astype(np.int64)
+            by_trajectory[int(trajectory_id)] = cls(
+                epochs=trajectory["group_epoch_s"].to_numpy()[offsets[:-1]],
+                offsets=offsets,
+                positions=trajectory[["x_m", "y_m", "z_m"]].to_numpy(),
+                rotations=euler_to_matrix(
+                    trajectory["rx_rad"], trajectory["ry_rad"], trajectory["rz_rad"]
+                ),
+                cameras=trajectory[["focal_u_px", "focal_v_px", "pixu", "pixv"]].to_numpy(
+                    dtype=np.float64
+                ),
+                paths=trajectory["path"].to_numpy(dtype=object),
+            )
+        return by_trajectory
+
+    def nearest_groups(self, epochs: np.ndarray) -> np.ndarray:
+        right = np.clip(np.searchsorted(self.epochs, epochs), 1, len(self.epochs) - 1)
+        left = right - 1
+        closer_left = np.abs(epochs - self.epochs[left]) <= np.abs(self.epochs[right] - epochs)
+        return np.where(closer_left, left, right)
+
+
+class ImageCache:
+    """Decoded images, least recently used ones dropped beyond ``max_bytes``."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.images: OrderedDict[str, np.ndarray | None] = OrderedDict()
+        self.size = 0
+
+    def get(self, path: str) -> np.ndarray | None:
+        """RGB pixels of an image, None if it is not part of the extract."""
+        if path in self.images:
+            self.images.move_to_end(path)
+            return self.images[path]
+        try:
+            with Image.open(path) as image:
+                pixels = np.asarray(image.convert("RGB"))
+        except FileNotFoundError:
+            pixels = None
+        self.images[path] = pixels
+        self.size += 0 if pixels is None else pixels.nbytes
+        while self.size > self.max_bytes and len(self.images) > 1:
+            _, dropped = self.images.popitem(last=False)
+            self.size -= 0 if dropped is None else dropped.nbytes
+        return pixels
+
+
+def project(
+    points: np.ndarray, positions: np.ndarray, rotations: np.ndarray, cameras: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Pixel columns, rows and visibility of points in faces, each (faces, points).
+
+    Assumes the photogrammetric camera frame, the camera looks along its
+    negative z axis with x to the right and y up in the image.
+    """
+    # Global to sensor is the transposed rotation.
+    local = np.einsum("fji,fnj->fni", rotations, points[None] - positions[:, None])
+    depth = -local[..., 2]
+    safe = np.where(depth > 0, depth, 1.0)
+    focal_u, focal_v, width, height = (cameras[:, i, None] for i in range(4))
+    cols = width / 2 + focal_u * local[..., 0] / safe
+    rows = height / 2 - focal_v * local[..., 1] / safe
+    visible = (depth > 0) & (cols >= 0) & (cols < width) & (rows >= 0) & (rows < height)
+    return cols, rows, visible
+
+
+def sample_colors(
+    points: np.ndarray,
+    epochs: np.ndarray,
+    faces: CubemapFaces,
+    cache: ImageCache,
+    max_time_gap_s: float,
+) -> tuple[np.ndarray, np.ndarray]:
+    """8 bit RGB of points from the faces nearest in time, and which points got one."""
+    colors = np.zeros((len(points), 3), dtype=np.uint8)
+    colored = np.zeros(len(points), dtype=bool)
+    groups = faces.nearest_groups(epochs)
+    candidates = np.flatnonzero(np.abs(faces.epochs[groups] - epochs) <= max_time_gap_s)
+    # Project the points of one group at a time, into all its faces at once.
+    candidates = candidates[np.argsort(groups[candidates], kind="stable")]
+    boundaries = np.flatnonzero(np.diff(groups[candidates])) + 1
+    for indices in np.split(candidates, boundaries):
+        if not len(indices):
+            continue
+        group = groups[indices[0]]
+        rows = slice(faces.offsets[group], faces.offsets[group + 1])
+        cols, pixel_rows, visible = project(
+            points[indices], faces.positions[rows], faces.rotations[rows], faces.cameras[rows]
+        )
+        face = np.argmax(visible, axis=0)
+        hit = visible[face, np.arange(len(indices))]
+        for f, path in enumerate(faces.paths[rows]):
+            selected = np.flatnonzero(hit & (face == f))
+            if not len(selected):
+                continue
+            pixels = cache.get(path)
+            if pixels is None:
+                continue
+            # Image sizes in interior_orientation.txt may differ from the
+            # delivered files, scale into the actual pixels.
+            scale_u = pixels.shape[1] / faces.cameras[rows][f, 2]
+            scale_v = pixels.shape[0] / faces.cameras[rows][f, 3]
+            u = np.minimum((cols[f, selected] * scale_u).astype(np.int64), pixels.shape[1] - 1)
+            v = np.minimum(
+                (pixel_rows[f, selected] * scale_v).astype(np.int64), pixels.shape[0] - 1
+            )
+            colors[indices[selected]] = pixels[v, u]
+            colored[indices[selected]] = True
+    return colors, colored
+
+
+_faces: dict[int, CubemapFaces] = {}
+_cache: ImageCache | None = None
+
+
+def init_worker(faces: dict[int, CubemapFaces], cache_bytes: int) -> None:
+    """Process pool initializer, faces are sent to every worker once."""
+    global _faces, _cache
+    _faces = faces
+    _cache = ImageCache(cache_bytes)
+
+
+def colorize_scan(source: Path, target: Path, options: ColorizeOptions) -> int:
+    """Write ``source`` with colors from the cubemaps as COPC, returns colored points."""
+    trajectory_id = int(SCAN_PATH.search(source.as_posix())["trajectory_id"])
+    faces = _faces.get(trajectory_id)
+    with laspy.open(source) as reader:
+        if "gps_time" not in reader.header.point_format.dimension_names:
+            raise ValueError(f"{source} has no GPS time to match images with")
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = target.with_name(target.name.removesuffix(".copc.laz") + ".colorized.laz")
+    colored_count = 0
+    with laspy.open(source) as reader:
+        header = reader.header.copy()
+        header.set_version_and_point_format(
+            header.version, laspy.PointFormat(RGB_POINT_FORMATS[header.point_format.id])
+        )
+        with laspy.open(tmp_path, mode="w", header=header) as writer:
+            for points in reader.chunk_iterator(options.chunk_size):
+                if header.point_format.id != reader.header.point_format.id:
+                    record = laspy.ScaleAwarePointRecord.zeros(len(points), header=header)
+                    record.copy_fields_from(points)
+                    points = record
+                if faces is not None:
+                    colors, colored = sample_colors(
+                        np.stack([points.x, points.y, points.z], axis=-1),
+                        np.asarray(points.gps_time),
+                        faces,
+                        _cache,
+                        options.max_time_gap_s,
+                    )
+                    # LAS colors are 16 bit.
+                    colors = colors[colored].astype(np.uint16) * 257
+                    for channel, name in enumerate(["red", "green", "blue"]):
+                        values = np.asarray(points[name])
+                        values[colored] = colors[:, channel]
+                        points[name] = values
+                    colored_count += int(colored.sum())
+                writer.write_points(points)
+    try:
+        convert_to_copc(tmp_path, target)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return colored_count
+
+
+@metrics.timed("colorize_scans", items=lambda manifest: len(manifest.scans))
+def colorize_scans(
+    kappa_paths: list[KappazunderPath],
+    groups: ImageGroups,
+    output_dir: Path,
+    options: ColorizeOptions,
+    workers: int = 4,
+    force: bool = False,
+) -> CopcManifest:
+    """Colorize every scan of the extracts into COPC files below ``output_dir``.
+
+    ``groups`` are the image groups of all extracts. Scans are streamed in
+    chunks of ``options.chunk_size`` points, one file per worker process.
+    Points keep their color when no face sees them.
+    """
+    interior = pd.concat([read_interior_orientation(kappa_path) for kappa_path in kappa_paths])
+    faces = CubemapFaces.from_groups(groups, interior[~interior.index.duplicated()])
+    targets = scan_targets(kappa_paths, output_dir)
+    manifest_path = output_dir / COPC_MANIFEST
+    manifests, _ = load_manifests(targets, output_dir)
+    manifest = manifests.get(manifest_path, CopcManifest())
+    jobs = [
+        (source, target)
+        for _, source, target in targets
+        if force or not is_up_to_date(source, target)
+    ]
+    print(f"{len(jobs)} of {len(targets)} scans to colorize")
+
+    failed = []
+    colored = 0
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=init_worker, initargs=(faces, options.cache_bytes)
+    ) as executor:
+        futures = {
+            executor.submit(colorize_scan, source, target, options): (source, target)
+            for source, target in jobs
+        }
+        for future in tqdm(
+            as_completed(futures), desc="Colorizing scans...", total=len(jobs), unit="file"
+        ):
+            source, target = futures[future]
+            try:
+                colored += future.result()
+            except Exception as e:
+                print(f"Failed to colorize {source}: {e}")
+                failed.append(source)
+                continue
+            manifest.scans[str(source)] = copc_scan(source, target)
+            manifest.save(manifest_path)
+    manifest.save(manifest_path)
+    print(f"{colored} points colorized")
+    if failed:
+        raise RuntimeError(f"{len(failed)} scans failed to colorize")
+    return manifest
@@ -0,0 +1,89 @@
+from functools import lru_cache
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+import pyproj
+import shapely
+
+from kappa import metrics
+from kappa.models import TrajectoryMeta
+
+if TYPE_CHECKING:
+    import geopandas as gpd
+
+WGS84 = 4326
+
+
+@lru_cache
+def get_transformer(from_epsg: int, to_epsg: int = WGS84) -> pyproj.Transformer:
+    return pyproj.Transformer.from_crs(from_epsg, to_epsg, always_xy=True)
+
+
+def transform(
+    x: np.ndarray,
+    y: np.ndarray,
+    z: np.ndarray,
+    from_epsg: int,
+    to_epsg: int = WGS84,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    return get_transformer(from_epsg, to_epsg).transform(
+        np.asarray(x, dtype=np.float64),
+        np.asarray(y, dtype=np.float64),
+        np.asarray(z, dtype=np.float64),
+    )
+
+
+def trajectory_epsg(
+    trajectory_ids: pd.Series, trajectories: dict[int, TrajectoryMeta]
+) -> np.ndarray:
+    epsg = trajectory_ids.map(
+        {trajectory.id: trajectory.epsg for trajectory in trajectories.values()}
+    )
+    if epsg.isna().any():
+        missing = trajectory_ids[epsg.isna()].unique().tolist()
+        raise ValueError(f"No trajectory files for trajectories: {missing}")
+    return epsg.to_numpy(dtype=np.int64)
+
+
+@metrics.timed("reproject_positions", items=len)
+def reproject_positions(
+    df: pd.DataFrame,
+    trajectories: dict[int, TrajectoryMeta],
+    to_epsg: int = WGS84,
+) -> pd.DataFrame:
+    """Reproject ``x_m/y_m/z_m`` of every row, one transform call per EPSG code.
+
+    Returns ``lon/lat/z`` columns aligned with ``df``.
+    """
+    epsg = trajectory_epsg(df["trajectory_id"], trajectories)
+    lon = np.empty(len(df))
+    lat = np.empty(len(df))
+    z = np.empty(len(df))
+    for code in np.unique(epsg):
+        mask = epsg == code
+        lon[mask], lat[mask], z[mask] = transform(
+            df["x_m"].to_numpy()[mask],
+            df["y_m"].to_numpy()[mask],
+            df["z_m"].to_numpy()[mask],
+            int(code),
+            to_epsg,
+        )
+    return pd.DataFrame({"lon": lon, "lat": lat, "z": z}, index=df.index)
+
+
+@metrics.timed("reproject_gdf", items=len)
+def reproject_gdf(gdf: "gpd.GeoDataFrame", to_epsg: int = WGS84) -> "gpd.GeoDataFrame":
+    """Same as `GeoDataFrame.to_crs`, but through the shared transformer cache."""
+    import geopandas as gpd
+
+    transformer = get_transformer(gdf.crs.to_epsg(), to_epsg)
+    include_z = bool(len(gdf)) and bool(gdf.has_z.all())
+    geometry = shapely.transform(
+        gdf.geometry.array,
+        lambda coords: np.column_stack(transformer.transform(*coords.T)),
+        include_z=include_z,
+    )
+    result = gdf.copy()
+    result.geometry = gpd.GeoSeries(geometry, index=gdf.index, crs=to_epsg)
+    return result
@@ -1,46 +1,259 @@
+from enum import Enum
 from pathlib import Path
+from typing import TYPE_CHECKING, Iterable
 
-from kappa.paths import OUTPUT_PATH, KappazunderPath
+from kappa.paths import COPC_SUFFIX, OUTPUT_PATH, OnDuplicate, extract_paths
 import typer
-from py3dtiles.convert import convert
 
+if TYPE_CHECKING:
+    from kappa.upload import UploadOptions
 
-extract_cli = typer.Typer(
-    help="Process data extract from https://www.wien.gv.at/geodatenviewer"
-)
+# Commands import what they need when they run, `kappa extract --help` and
+# each command only pay for their own dependencies.
+
+
+extract_cli = typer.Typer()
+
+
+@extract_cli.command(name="index")
+def index_extract_files(
+    data_dir: list[Path],
+    workers: int = typer.Option(16, help="Directories listed at the same time."),
+    full: bool = typer.Option(
+        False, help="List every directory, not only those changed since the last run."
+    ),
+):
+    """Build or refresh the index of extract files other commands read listings from.
+
+    The index is stored in every extract as .kappa-files.sqlite.
+    """
+    from kappa.fileindex import FileIndex
+
+    for kappa_path in extract_paths(data_dir):
+        index = FileIndex(kappa_path.base_dir, kappa_path.file_index_path)
+        stats = index.refresh(workers, full)
+        print(
+            f"{kappa_path.base_dir}: {stats.files} files indexed, {stats.listed_dirs} directories "
+            f"listed, {stats.unchanged_dirs} unchanged and {stats.removed_dirs} removed"
+        )
 
 
 @extract_cli.command(name="merge-images")
-def merge_image_metadata_into_wfs(wfs_geojson: Path, extract_path: list[Path]):
+def merge_image_metadata_into_wfs(
+    wfs_dump: Path,
+    extract_path: list[Path],
+    output: Path = OUTPUT_PATH / "parquet" / "images_merged.geoparquet",
+    workers: int = typer.Option(4, help="Extracts read at the same time."),
+    on_duplicate: OnDuplicate = typer.Option(
+        OnDuplicate.first, help="Keep the first of image groups found in several extracts, or fail."
+    ),
+):
     """Merge images from data extract into WFS dump."""
-    pass
+    from kappa.merge import merge_images, read_wfs_dump
+
+    merged = merge_images(
+        read_wfs_dump(wfs_dump), extract_paths(extract_path), workers, on_duplicate
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    merged.to_parquet(output)
+    print(f"{merged['has_images'].sum()} of {len(merged)} images found in extracts")
 
 
 @extract_cli.command(name="merge-lidar")
-def merge_lidar_metadata_into_wfs(wfs_geojson: Path, extract_path: list[Path]):
+def merge_lidar_metadata_into_wfs(
+    wfs_dump: Path,
+    extract_path: list[Path],
+    output: Path = OUTPUT_PATH / "parquet" / "lidar_merged.geoparquet",
+    workers: int = typer.Option(16, help="Scan headers read at the same time."),
+):
     """Merge lidar from data extract into WFS dump."""
-    pass
+    from kappa.merge import merge_lidar, read_wfs_dump
+
+    merged = merge_lidar(read_wfs_dump(wfs_dump), extract_paths(extract_path), workers)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    merged.to_parquet(output)
+    print(f"{merged['has_scans'].sum()} of {len(merged)} footprints found in extracts")
+
+
+class LidarFormat(str, Enum):
+    copc = "copc"
+    tiles3d = "3dtiles"
 
 
 @extract_cli.command(name="prepare-lidar")
-def prepare_lidar_files(data_dir: Path):
-    """Rearrange and convert to COPC lidar files."""
-    kappa_path = KappazunderPath(data_dir)
-    convert(files=kappa_path.get_all_scans(), outfolder=OUTPUT_PATH / '3dtiles', overwrite=True)
+def prepare_lidar_files(
+    data_dir: list[Path],
+    format: LidarFormat = LidarFormat.copc,
+    output_dir: Path = typer.Option(
+        None, help="Mirror the scan layout here instead of writing next to the scans."
+    ),
+    workers: int = typer.Option(4, help="Files converted at the same time, over all extracts."),
+    max_memory_gb: float = typer.Option(None, help="Memory cap of every worker."),
+    force: bool = typer.Option(False, help="Convert files that are up to date too."),
+):
+    """Convert lidar files of one or more extracts to COPC, one file per scan, or to 3D Tiles.
+
+    With --output-dir, all extracts share one scan layout and manifest there.
+    """
+    from kappa.lidar import convert_scans
+
+    kappa_paths = extract_paths(data_dir)
+    match format:
+        case LidarFormat.copc:
+            convert_scans(
+                kappa_paths,
+                output_dir=output_dir,
+                workers=workers,
+                max_memory=int(max_memory_gb * 2**30) if max_memory_gb else None,
+                force=force,
+            )
+        case LidarFormat.tiles3d:
+            from py3dtiles.convert import convert
+
+            convert(
+                files=[path for kappa_path in kappa_paths for path in kappa_path.get_all_scans()],
+                outfolder=output_dir or OUTPUT_PATH / "3dtiles",
+                overwrite=True,
+            )
+
+
+@extract_cli.command(name="colorize-lidar")
+def colorize_lidar_files(
+    data_dir: list[Path],
+    output_dir: Path = OUTPUT_PATH / "colorized",
+    workers: int = typer.Option(4, help="Files colorized at the same time, over all extracts."),
+    chunk_size: int = typer.Option(1_000_000, help="Points read at a time."),
+    cache_gb: float = typer.Option(1.0, help="Decoded images kept by every worker."),
+    max_time_gap: float = typer.Option(1.0, help="Seconds between a point and its image."),
+    force: bool = typer.Option(False, help="Colorize files that are up to date too."),
+    on_duplicate: OnDuplicate = typer.Option(
+        OnDuplicate.first, help="Keep the first of image groups or trajectories found in several extracts, or fail."
+    ),
+):
+    """Color lidar points from the cubemap faces nearest in time, as COPC.
+
+    Writes the scan layout below output_dir with a manifest like prepare-lidar,
+    so the result can be uploaded with upload-lidar.
+    """
+    from kappa.colorize import ColorizeOptions, colorize_scans
+    from kappa.metadata import extract_metadata
+
+    kappa_paths = extract_paths(data_dir)
+    groups, _ = extract_metadata(kappa_paths, workers, on_duplicate=on_duplicate)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    colorize_scans(
+        kappa_paths,
+        groups,
+        output_dir,
+        ColorizeOptions(
+            chunk_size=chunk_size,
+            cache_bytes=int(cache_gb * 2**30),
+            max_time_gap_s=max_time_gap,
+        ),
+        workers=workers,
+        force=force,
+    )
+
 
 @extract_cli.command(name="prepare-images")
-def prepare_image_files(data_dir: Path):
-    """Rearrange image files for easier consumption."""
-    pass
+def prepare_image_files(
+    data_dir: list[Path],
+    output_dir: Path = OUTPUT_PATH / "images",
+    workers: int = typer.Option(4, help="Panoramas prepared at the same time, over all extracts."),
+    tile_size: int = typer.Option(512, help="Largest tile edge in pixels."),
+    preview_size: int = typer.Option(256, help="Preview face edge in pixels."),
+    quality: int = typer.Option(85, help="JPEG quality of tiles and previews."),
+    force: bool = typer.Option(False, help="Prepare panoramas that are done too."),
+    on_duplicate: OnDuplicate = typer.Option(
+        OnDuplicate.first, help="Keep the first of image groups or trajectories found in several extracts, or fail."
+    ),
+):
+    """Cut cubemap faces into tile pyramids with a low resolution preview.
+
+    Every panorama gets a Trajektorie_<id>/<image name>/ folder whose
+    panorama.json configures the Photo Sphere Viewer cubemap tiles adapter.
+    """
+    from kappa.images import PyramidOptions, prepare_panoramas
+    from kappa.metadata import extract_metadata
+
+    groups, _ = extract_metadata(extract_paths(data_dir), workers, on_duplicate=on_duplicate)
+    prepare_panoramas(
+        groups,
+        output_dir,
+        PyramidOptions(tile_size=tile_size, preview_size=preview_size, quality=quality),
+        workers=workers,
+        force=force,
+    )
+
+
+def upload_prepared_files(
+    prepared_dir: Path, paths: Iterable[Path], options: "UploadOptions", journal: Path | None
+) -> None:
+    from kappa.upload import upload_files
+
+    journal = journal or prepared_dir / f".upload-{options.bucket}.jsonl"
+    uploaded, skipped = upload_files(prepared_dir, paths, options, journal)
+    print(f"{uploaded} files uploaded, {skipped} already in the bucket")
 
 
 @extract_cli.command(name="upload-images")
-def upload_image_files(prepared_dir: Path):
-    """Upload prepared image files to S3/R2."""
-    pass
+def upload_image_files(
+    prepared_dir: Path,
+    bucket: str,
+    prefix: str = "images",
+    endpoint_url: str = typer.Option(None, help="S3 compatible endpoint, e.g. of R2."),
+    workers: int = typer.Option(32, help="Files uploaded at the same time."),
+    size_only: bool = typer.Option(False, help="Skip remote files of the same size."),
+    journal: Path = typer.Option(None, help="Defaults to <prepared_dir>/.upload-<bucket>.jsonl."),
+):
+    """Upload prepared image files to S3/R2.
+
+    Credentials are read from the usual AWS environment variables or config.
+    """
+    from kappa.upload import UploadOptions
+
+    paths = (
+        path
+        for path in prepared_dir.rglob("*")
+        if path.is_file() and not path.name.startswith(".upload-")
+    )
+    options = UploadOptions(
+        bucket=bucket,
+        prefix=prefix,
+        endpoint_url=endpoint_url,
+        workers=workers,
+        size_only=size_only,
+    )
+    upload_prepared_files(prepared_dir, paths, options, journal)
 
 
 @extract_cli.command(name="upload-lidar")
-def upload_lidar_files(prepared_dir: Path):
-    """Upload prepared lidar files to S3/R2."""
-    pass
+def upload_lidar_files(
+    prepared_dir: Path,
+    bucket: str,
+    prefix: str = "lidar",
+    endpoint_url: str = typer.Option(None, help="S3 compatible endpoint, e.g. of R2."),
+    workers: int = typer.Option(8, help="Files uploaded at the same time."),
+    part_concurrency: int = typer.Option(8, help="Parts of a large file uploaded at the same time."),
+    size_only: bool = typer.Option(False, help="Skip remote files of the same size."),
+    journal: Path = typer.Option(None, help="Defaults to <prepared_dir>/.upload-<bucket>.jsonl."),
+):
+    """Upload prepared lidar files to S3/R2.
+
+    Uploads the COPC files and manifest written by prepare-lidar.
+    """
+    from kappa.lidar import COPC_MANIFEST
+    from kappa.upload import UploadOptions
+
+    paths = [*prepared_dir.rglob(f"*{COPC_SUFFIX}"), prepared_dir / COPC_MANIFEST]
+    options = UploadOptions(
+        bucket=bucket,
+        prefix=prefix,
+        endpoint_url=endpoint_url,
+        workers=workers,
+        part_concurrency=part_concurrency,
+        size_only=size_only,
+    )
+    upload_prepared_files(
+        prepared_dir, [path for path in paths if path.exists()], options, journal
+    )
@@ -0,0 +1,242 @@
+import os
+import re
+import sqlite3
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import closing
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable
+
+import pandas as pd
+from tqdm import tqdm
+
+from kappa import metrics
+
+FILE_INDEX_VERSION = 1
+FILE_KINDS = ["image", "scan", "copc", "trajectory", "metadata", "other"]
+TRAJECTORY_SENSOR = re.compile(r"^[^/]+/Trajektorie_(\d+)/Sensor_(\d+)/[^/]+$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    trajectory_id INTEGER,
+    sensor_id INTEGER,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+CREATE INDEX IF NOT EXISTS files_kind ON files (kind, trajectory_id, sensor_id);
+"""
+
+
+def classify(path: str) -> tuple[str, int | None, int | None]:
+    """Kind, trajectory and sensor id of a path relative to the extract."""
+    top = path.split("/", 1)[0]
+    match = TRAJECTORY_SENSOR.match(path)
+    trajectory_id, sensor_id = (int(match[1]), int(match[2])) if match else (None, None)
+    name = path.rsplit("/", 1)[-1].lower()
+    if top == "Bild-Rohdaten" and match and name.endswith(".jpg"):
+        return "image", trajectory_id, sensor_id
+    if top == "Scan-Punktwolken" and match and name.endswith(".laz"):
+        # Same suffix as `kappa.paths.COPC_SUFFIX`.
+        kind = "copc" if name.endswith(".copc.laz") else "scan"
+        return kind, trajectory_id, sensor_id
+    if top == "Verortung":
+        return "trajectory", None, None
+    if top in ("Bild-Meta", "Scan-Meta"):
+        return "metadata", None, None
+    return "other", trajectory_id, sensor_id
+
+
+def _join(parent: str, name: str) -> str:
+    return f"{parent}/{name}" if parent else name
+
+
+def _subtree(path: str) -> tuple[str, str]:
+    """Bounds of the paths below ``path``, "0" sorts right after "/"."""
+    return (f"{path}/", f"{path}0") if path else ("", "\U0010ffff")
+
+
+@dataclass
+class DirListing:
+    path: str
+    mtime_ns: int | None
+    # None when the directory is gone or did not change since the last walk.
+    dirs: list[str] | None = None
+    files: list[tuple[str, int, int]] | None = None
+
+
+def scan_dir(base_dir: Path, path: str, known_mtime_ns: int | None, skip: str) -> DirListing:
+    """List one directory, unless its modification time is ``known_mtime_ns``.
+
+    Adding, removing or renaming entries changes the modification time of a
+    directory, so an unchanged directory still has the indexed entries.
+    """
+    directory = base_dir / path
+    try:
+        mtime_ns = os.stat(directory).st_mtime_ns
+    except FileNotFoundError:
+        return DirListing(path, None)
+    if mtime_ns == known_mtime_ns:
+        return DirListing(path, mtime_ns)
+    dirs, files = [], []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.startswith(skip):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                dirs.append(_join(path, entry.name))
+            elif entry.is_file():
+                stat = entry.stat()
+                files.append((_join(path, entry.name), stat.st_size, stat.st_mtime_ns))
+    return DirListing(path, mtime_ns, dirs, files)
+
+
+@dataclass
+class RefreshStats:
+    listed_dirs: int = 0
+    unchanged_dirs: int = 0
+    removed_dirs: int = 0
+    files: int = 0
+
+
+class FileIndex:
+    """Every file of an extract with its size and modification time, in SQLite.
+
+    Paths are stored relative to ``base_dir`` with forward slashes. The index
+    is only as fresh as its last `refresh`, which walks directories in
+    parallel and lists only those that changed since the walk before.
+    """
+
+    def __init__(self, base_dir: Path, path: Path):
+        self.base_dir = base_dir
+        self.path = path
+
+    def connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path)
+        if db.execute("PRAGMA user_version").fetchone()[0] != FILE_INDEX_VERSION:
+            db.executescript("DROP TABLE IF EXISTS dirs; DROP TABLE IF EXISTS files;")
+            db.execute(f"PRAGMA user_version = {FILE_INDEX_VERSION}")
+        db.executescript(SCHEMA)
+        return db
+
+    def _remove_subtree(self, db: sqlite3.Connection, path: str) -> None:
+        low, high = _subtree(path)
+        for table in ("dirs", "files"):
+            db.execute(f"DELETE FROM {table} WHERE path >= ? AND path < ?", (low, high))
+        db.execute("DELETE FROM dirs WHERE path = ?", (path,))
+
+    def _apply(self, db: sqlite3.Connection, listing: DirListing, stats: RefreshStats) -> list[str]:
+        """Store a listing, returns the directories to walk next."""
+        if listing.mtime_ns is None:
+            self._remove_subtree(db, listing.path)
+            stats.removed_dirs += 1
+            return []
+        if listing.dirs is None:
+            stats.unchanged_dirs += 1
+            return [path for (path,) in db.execute("SELECT path FROM dirs WHERE parent = ?", (listing.path,))]
+
+        stats.listed_dirs += 1
+        known = {path for (path,) in db.execute("SELECT path FROM dirs WHERE parent = ?", (listing.path,))}
+        for removed in known - set(listing.dirs):
+            self._remove_subtree(db, removed)
+            stats.removed_dirs += 1
+        parent = listing.path.rpartition("/")[0] if listing.path else None
+        db.execute(
+            "INSERT OR REPLACE INTO dirs (path, parent, mtime_ns) VALUES (?, ?, ?)",
+            (listing.path, parent, listing.mtime_ns),
+        )
+        db.execute("DELETE FROM files WHERE dir = ?", (listing.path,))
+        db.executemany(
+            "INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+            ((path, listing.path, *classify(path), size, mtime_ns) for path, size, mtime_ns in listing.files),
+        )
+        return listing.dirs
+
+    @metrics.timed("file_index_refresh")
+    def refresh(self, workers: int = 16, full: bool = False) -> RefreshStats:
+        """Bring the index up to date with the extract.
+
+        With ``full``, every directory is listed and every file stat-ed again,
+        which also catches files rewritten in place.
+        """
+        stats = RefreshStats()
+        skip = self.path.name
+        with closing(self.connect()) as db, db:
+            known = {} if full else dict(db.execute("SELECT path, mtime_ns FROM dirs"))
+            with (
+                ThreadPoolExecutor(max_workers=workers) as executor,
+                tqdm(desc="Indexing extract files...", unit="dirs") as progress,
+            ):
+
+                def submit(path: str):
+                    return executor.submit(scan_dir, self.base_dir, path, known.get(path), skip)
+
+                pending = {submit("")}
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        pending |= {submit(path) for path in self._apply(db, future.result(), stats)}
+                        progress.update()
+            stats.files = db.execute("SELECT count(*) FROM files").fetchone()[0]
+        return stats
+
+    def files(
+        self,
+        kind: str | None = None,
+        trajectory_id: int | None = None,
+        sensor_id: int | None = None,
+    ) -> pd.DataFrame:
+        """Indexed files, optionally of one kind, trajectory and sensor, sorted by path."""
+        filters = {"kind": kind, "trajectory_id": trajectory_id, "sensor_id": sensor_id}
+        filters = {column: value for column, value in filters.items() if value is not None}
+        where = " AND ".join(f"{column} = ?" for column in filters) or "1"
+        with closing(self.connect()) as db:
+            return pd.read_sql_query(
+                "SELECT path, kind, trajectory_id, sensor_id, size, mtime_ns "
+                f"FROM files WHERE {where} ORDER BY path",
+                db,
+                params=list(filters.values()),
+                dtype={
+                    "path": "string[pyarrow]",
+                    "kind": pd.CategoricalDtype(FILE_KINDS),
+                    "trajectory_id": "Int64",
+                    "sensor_id": "Int64",
+                    "size": "int64",
+                    "mtime_ns": "int64",
+                },
+            )
+
+    def paths(self, kind: str) -> list[Path]:
+        return [self.base_dir / path for path in self.files(kind)["path"]]
+
+    def relative(self, paths: Iterable[str | Path]) -> pd.Series:
+        """Paths as stored in the index, for paths built from ``base_dir``."""
+        prefix = "" if self.base_dir == Path(".") else f"{self.base_dir}/"
+        paths = pd.Series([str(path) for path in paths], dtype="string[pyarrow]")
+        return paths.str.removeprefix(prefix)
+
+    def sizes(self, paths: Iterable[str | Path]) -> pd.Series:
+        """Size of every path in bytes, in order, NA where the file is not indexed."""
+        relative = self.relative(paths)
+        with closing(self.connect()) as db:
+            db.execute("CREATE TEMP TABLE query (path TEXT)")
+            db.executemany("INSERT INTO query VALUES (?)", ((path,) for path in relative))
+            sizes = [
+                size
+                for (size,) in db.execute(
+                    "SELECT files.size FROM query LEFT JOIN files USING (path) ORDER BY query.rowid"
+                )
+            ]
+        return pd.Series(sizes, dtype="Int64")
+
+    def exists(self, paths: Iterable[str | Path]) -> pd.Series:
+        return self.sizes(paths).notna()
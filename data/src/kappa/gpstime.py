@@ -0,0 +1,67 @@
+from datetime import datetime, timezone
+
+import numpy as np
+
+SECONDS_IN_WEEK = 604800
+GPS_EPOCH = np.datetime64("1980-01-06T00:00:00", "us")
+
+# UTC instants at which a leap second took effect and GPS - UTC from then on.
+# Source: IERS Bulletin C, unchanged since 2017-01-01.
+LEAP_SECONDS = [
+    ("1981-07-01", 1),
+    ("1982-07-01", 2),
+    ("1983-07-01", 3),
+    ("1985-07-01", 4),
+    ("1988-01-01", 5),
+    ("1990-01-01", 6),
+    ("1991-01-01", 7),
+    ("1992-07-01", 8),
+    ("1993-07-01", 9),
+    ("1994-07-01", 10),
+    ("1996-01-01", 11),
+    ("1997-07-01", 12),
+    ("1999-01-01", 13),
+    ("2006-01-01", 14),
+    ("2009-01-01", 15),
+    ("2012-07-01", 16),
+    ("2015-07-01", 17),
+    ("2017-01-01", 18),
+]
+
+_LEAP_OFFSETS = np.array([0] + [offset for _, offset in LEAP_SECONDS], dtype=np.int64)
+# Same instants, expressed in GPS seconds since the GPS epoch.
+_LEAP_GPS_SECONDS = np.array(
+    [
+        (np.datetime64(date, "s") - GPS_EPOCH.astype("datetime64[s]")).astype(np.int64)
+        + offset
+        for date, offset in LEAP_SECONDS
+    ],
+    dtype=np.int64,
+)
+
+
+def gps_to_utc(gps_week: np.ndarray, gps_seconds: np.ndarray) -> np.ndarray:
+    """Convert GPS week and seconds of week to UTC ``datetime64[us]``."""
+    gps_total = np.asarray(
+        SECONDS_IN_WEEK * np.asarray(gps_week, dtype=np.int64) + np.asarray(gps_seconds),
+        dtype=np.float64,
+    )
+    whole_seconds = np.floor(gps_total)
+    microseconds = np.round((gps_total - whole_seconds) * 1e6).astype(np.int64)
+    whole_seconds = whole_seconds.astype(np.int64)
+    leap_seconds = _LEAP_OFFSETS[
+        np.searchsorted(_LEAP_GPS_SECONDS, whole_seconds, side="right")
+    ]
+    utc_microseconds = (whole_seconds - leap_seconds) * 1_000_000 + microseconds
+    return GPS_EPOCH + utc_microseconds.astype("timedelta64[us]")
+
+
+def to_datetimes(utc: np.ndarray) -> list[datetime]:
+    return [
+        value.replace(tzinfo=timezone.utc)
+        for value in np.asarray(utc, dtype="datetime64[us]").tolist()
+    ]
+
+
+def gps_time_to_datetime(gps_week: int, gps_seconds: float) -> datetime:
+    return to_datetimes(gps_to_utc([gps_week], [gps_seconds]))[0]
@@ -0,0 +1,179 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from email.utils import formatdate
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import orjson as json
+import requests
+
+from kappa import metrics
+
+
+class OfflineCacheMiss(requests.RequestException):
+    """Raised in offline mode for requests that are not cached."""
+
+
+@dataclass
+class CacheOptions:
+    cache_dir: Path | None = None
+    # Seconds a cached response is served without revalidation.
+    ttl: float = 24 * 3600
+    max_size: int | None = None
+    offline: bool = False
+
+
+def normalize_url(url: str) -> str:
+    """Same request, same URL: lowercase scheme, host and query keys, sorted query."""
+    parts = urlsplit(url)
+    query = sorted({(key.lower(), value) for key, value in parse_qsl(parts.query)})
+    return urlunsplit(
+        (parts.scheme.lower(), parts.netloc.lower(), parts.path, urlencode(query), "")
+    )
+
+
+class CachedSession:
+    """Disk cache in front of a `requests.Session` for GET requests.
+
+    Cached responses younger than ``ttl`` are served as is, older ones are
+    revalidated with ``If-None-Match``/``If-Modified-Since``. When the cache
+    grows beyond ``max_size`` bytes, least recently used responses are evicted.
+    Callers that find a response unusable drop it again with `discard`.
+    """
+
+    def __init__(self, session: requests.Session, options: CacheOptions):
+        self.session = session
+        self.cache_dir = options.cache_dir
+        self.ttl = options.ttl
+        self.max_size = options.max_size
+        self.offline = options.offline
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        # Sizes of the cached bodies in least recently used order, only
+        # tracked when the cache is bounded.
+        self.sizes = OrderedDict()
+        self.size = 0
+        if self.max_size is not None:
+            self._scan()
+
+    def _scan(self) -> None:
+        entries = []
+        for meta_path in self.cache_dir.glob("*/*.json"):
+            try:
+                meta = json.loads(meta_path.read_bytes())
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+            entries.append((meta["accessed_at"], meta_path.stem, meta["size"]))
+        for _, key, size in sorted(entries):
+            self.sizes[key] = size
+        self.size = sum(self.sizes.values())
+
+    @staticmethod
+    def _key(url: str, params: dict | None = None) -> tuple[str, str]:
+        url = requests.Request("GET", url, params=params).prepare().url
+        return url, hashlib.sha256(normalize_url(url).encode()).hexdigest()
+
+    def _paths(self, key: str) -> tuple[Path, Path]:
+        folder = self.cache_dir / key[:2]
+        return folder / f"{key}.json", folder / f"{key}.body"
+
+    def _load(self, key: str) -> tuple[dict, bytes] | None:
+        meta_path, body_path = self._paths(key)
+        try:
+            return json.loads(meta_path.read_bytes()), body_path.read_bytes()
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _touch(self, key: str, meta: dict) -> None:
+        meta["accessed_at"] = time.time()
+        with self.lock:
+            self._store_meta(key, meta)
+            if key in self.sizes:
+                self.sizes.move_to_end(key)
+
+    def _store_meta(self, key: str, meta: dict) -> None:
+        meta_path, _ = self._paths(key)
+        tmp_path = meta_path.with_suffix(f".{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(json.dumps(meta))
+        tmp_path.replace(meta_path)
+
+    def _store(self, key: str, url: str, resp: requests.Response) -> None:
+        meta_path, body_path = self._paths(key)
+        meta_path.parent.mkdir(exist_ok=True)
+        now = time.time()
+        tmp_path = body_path.with_suffix(f".{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(resp.content)
+        with self.lock:
+            tmp_path.replace(body_path)
+            self._store_meta(
+                key,
+                {
+                    "url": url,
+                    "etag": resp.headers.get("ETag"),
+                    "last_modified": resp.headers.get("Last-Modified"),
+                    "content_type": resp.headers.get("Content-Type"),
+                    "size": len(resp.content),
+                    "fetched_at": now,
+                    "accessed_at": now,
+                },
+            )
+            if self.max_size is not None:
+                self.size += len(resp.content) - self.sizes.pop(key, 0)
+                self.sizes[key] = len(resp.content)
+                while self.size > self.max_size and self.sizes:
+                    self._remove(next(iter(self.sizes)))
+
+    def _remove(self, key: str) -> None:
+        """Delete a cached response, the caller holds ``self.lock``."""
+        self.size -= self.sizes.pop(key, 0)
+        for path in self._paths(key):
+            path.unlink(missing_ok=True)
+
+    def discard(self, url: str, params: dict | None = None) -> None:
+        """Drop the cached response of a request, e.g. one whose body does not parse."""
+        _, key = self._key(url, params)
+        with self.lock:
+            self._remove(key)
+
+    def _response(self, url: str, meta: dict, body: bytes) -> requests.Response:
+        resp = requests.Response()
+        resp.status_code = 200
+        resp.url = url
+        resp._content = body
+        resp.headers["X-From-Cache"] = "1"
+        if meta.get("content_type"):
+            resp.headers["Content-Type"] = meta["content_type"]
+        return resp
+
+    def get(self, url: str, params: dict | None = None, **kwargs) -> requests.Response:
+        url, key = self._key(url, params)
+        cached = self._load(key)
+        if cached is not None:
+            meta, body = cached
+            now = time.time()
+            if self.offline or now - meta["fetched_at"] < self.ttl:
+                self._touch(key, meta)
+                metrics.count("http_cache_hits")
+                return self._response(url, meta, body)
+        elif self.offline:
+            raise OfflineCacheMiss(f"{url} is not cached")
+
+        headers = dict(kwargs.pop("headers", None) or {})
+        if cached is not None:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+            elif not meta.get("etag"):
+                headers["If-Modified-Since"] = formatdate(meta["fetched_at"], usegmt=True)
+        resp = self.session.get(url, headers=headers, **kwargs)
+        if resp.status_code == 304 and cached is not None:
+            meta["fetched_at"] = time.time()
+            self._touch(key, meta)
+            return self._response(url, meta, body)
+        if resp.status_code == 200:
+            self._store(key, url, resp)
+        return resp
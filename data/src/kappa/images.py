@@ -0,0 +1,180 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator
+
+import orjson as json
+from PIL import Image
+from tqdm import tqdm
+
+from kappa.metadata import ImageGroups, get_direction_labels
+
+# Photo Sphere Viewer cubemap face names, by direction label.
+CUBEMAP_FACES = {
+    "up": "top",
+    "front": "front",
+    "right": "right",
+    "back": "back",
+    "left": "left",
+    "down": "bottom",
+}
+PANORAMA_CONFIG = "panorama.json"
+TILE_URL = "{level}/{face}/{col}_{row}.jpg"
+
+
+@dataclass
+class PyramidOptions:
+    tile_size: int = 512
+    preview_size: int = 256
+    quality: int = 85
+
+
+@dataclass
+class Panorama:
+    trajectory_id: int
+    name: str
+    # (label, raw image path) of every face.
+    faces: list[tuple[str, str]]
+
+    def output_dir(self, base_dir: Path) -> Path:
+        return base_dir / f"Trajektorie_{self.trajectory_id}" / Path(self.name).stem
+
+
+def pyramid_levels(face_size: int, tile_size: int) -> list[dict]:
+    """Levels from one tile per face up to full resolution, tile counts doubling.
+
+    Follows the ``levels`` option of the PSV cubemap tiles adapter.
+    """
+    nb_tiles = 1
+    while face_size // nb_tiles > tile_size:
+        nb_tiles *= 2
+    levels = []
+    while nb_tiles >= 1:
+        levels.append({"faceSize": face_size, "nbTiles": nb_tiles})
+        face_size //= 2
+        nb_tiles //= 2
+    return levels[::-1]
+
+
+def write_face_tiles(
+    face: Image.Image, face_name: str, levels: list[dict], output_dir: Path, quality: int
+) -> None:
+    """Tiles of every level, each level downscaled from the one above it."""
+    level_image = face
+    for level in reversed(range(len(levels))):
+        size, nb_tiles = levels[level]["faceSize"], levels[level]["nbTiles"]
+        if level_image.width != size:
+            level_image = level_image.resize((size, size), Image.Resampling.LANCZOS)
+        tile_size = size // nb_tiles
+        for col in range(nb_tiles):
+            for row in range(nb_tiles):
+                path = output_dir / TILE_URL.format(
+                    level=level, face=face_name, col=col, row=row
+                )
+                path.parent.mkdir(parents=True, exist_ok=True)
+                level_image.crop(
+                    (col * tile_size, row * tile_size, (col + 1) * tile_size, (row + 1) * tile_size)
+                ).save(path, quality=quality)
+
+
+def prepare_panorama(panorama: Panorama, base_dir: Path, options: PyramidOptions) -> Path:
+    """Write the tile pyramid and preview of every face, then the viewer config.
+
+    Faces are decoded one at a time. The config is written last and marks
+    the panorama as done.
+    """
+    output_dir = panorama.output_dir(base_dir)
+    levels = None
+    previews = {}
+    for label, path in panorama.faces:
+        face_name = CUBEMAP_FACES[label]
+        with Image.open(path) as image:
+            face = image.convert("RGB")
+        if levels is None:
+            levels = pyramid_levels(face.width, options.tile_size)
+        write_face_tiles(face, face_name, levels, output_dir, options.quality)
+
+        preview = output_dir / "preview" / f"{face_name}.jpg"
+        preview.parent.mkdir(parents=True, exist_ok=True)
+        face.thumbnail((options.preview_size, options.preview_size))
+        face.save(preview, quality=options.quality)
+        previews[face_name] = preview.relative_to(output_dir).as_posix()
+
+    config = {
+        "baseUrl": {"type": "separate", "paths": previews},
+        "levels": levels,
+        "tileUrl": TILE_URL,
+        "flipTopBottom": True,
+    }
+    config_path = output_dir / PANORAMA_CONFIG
+    tmp_path = config_path.with_suffix(".tmp")
+    tmp_path.write_bytes(json.dumps(config))
+    tmp_path.replace(config_path)
+    return output_dir
+
+
+def _prepare_panorama(job: tuple[Panorama, Path, PyramidOptions]) -> Path:
+    return prepare_panorama(*job)
+
+
+def iter_panoramas(groups: ImageGroups) -> Iterator[Panorama]:
+    faces = groups.faces
+    labels = get_direction_labels(faces["sensor_id"]).tolist()
+    paths = faces["path"].tolist()
+    first = groups.first
+    for i, (trajectory_id, name) in enumerate(
+        zip(first["trajectory_id"].tolist(), first["name"].tolist())
+    ):
+        start, end = groups.offsets[i], groups.offsets[i + 1]
+        yield Panorama(
+            trajectory_id=trajectory_id,
+            name=name,
+            faces=list(zip(labels[start:end], paths[start:end])),
+        )
+
+
+def prepare_panoramas(
+    groups: ImageGroups,
+    output_dir: Path,
+    options: PyramidOptions,
+    workers: int = 4,
+    force: bool = False,
+) -> int:
+    """Tile every panorama that has no viewer config yet, ``workers`` at a time.
+
+    At most ``2 * workers`` panoramas are queued, so memory stays bounded
+    by a few decoded faces per worker.
+    """
+    panoramas = [
+        panorama
+        for panorama in iter_panoramas(groups)
+        if force or not (panorama.output_dir(output_dir) / PANORAMA_CONFIG).exists()
+    ]
+    print(f"{len(panoramas)} of {len(groups)} panoramas to prepare")
+    failed = []
+
+    def finish(panorama, future):
+        try:
+            future.result()
+        except OSError as e:
+            print(f"Failed to prepare {panorama.name}: {e}")
+            failed.append(panorama)
+        progress.update()
+
+    with (
+        ProcessPoolExecutor(max_workers=workers) as executor,
+        tqdm(desc="Preparing panoramas...", total=len(panoramas)) as progress,
+    ):
+        pending = deque()
+        for panorama in panoramas:
+            pending.append(
+                (panorama, executor.submit(_prepare_panorama, (panorama, output_dir, options)))
+            )
+            if len(pending) >= 2 * workers:
+                finish(*pending.popleft())
+        while pending:
+            finish(*pending.popleft())
+    if failed:
+        raise RuntimeError(f"{len(failed)} panoramas failed to prepare")
+    return len(panoramas)
@@ -0,0 +1,246 @@
+import re
+import resource
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import laspy
+import orjson as json
+import pandas as pd
+from pydantic import BaseModel
+from tqdm import tqdm
+
+from kappa import metrics
+from kappa.paths import KappazunderPath
+
+SCAN_PATH = re.compile(r"Trajektorie_(?P<trajectory_id>\d+)/Sensor_(?P<sensor_id>\d+)/")
+COPC_MANIFEST = "copc_manifest.json"
+BOUNDS_COLUMNS = ["min_x", "min_y", "min_z", "max_x", "max_y", "max_z"]
+
+
+def read_scan_header(path: Path) -> dict:
+    """Point count and bounds from a LAS/LAZ header, points are not read."""
+    with laspy.open(path) as reader:
+        header = reader.header
+        mins, maxs = header.mins, header.maxs
+        return {
+            "point_count": header.point_count,
+            **dict(zip(BOUNDS_COLUMNS, [*mins.tolist(), *maxs.tolist()])),
+        }
+
+
+def read_scan_headers(paths: list[Path], workers: int = 16) -> pd.DataFrame:
+    """Headers of many scan files, read in threads, one row per path."""
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        headers = list(
+            tqdm(
+                executor.map(read_scan_header, paths),
+                desc="Reading scan headers...",
+                total=len(paths),
+                unit="file",
+            )
+        )
+    return pd.DataFrame(headers, columns=["point_count", *BOUNDS_COLUMNS]).astype(
+        {"point_count": "int64"}
+    )
+
+
+def scan_files(kappa_path: KappazunderPath) -> pd.DataFrame:
+    """Every scan file of an extract with its COPC sibling, see `read_scan_headers`
+    for their headers."""
+    paths = sorted(kappa_path.get_all_scans())
+    ids = [SCAN_PATH.search(path.as_posix()).groupdict() for path in paths]
+    copc_paths = [kappa_path.get_copc_scan(path) for path in paths]
+    scans = pd.DataFrame(
+        {
+            "trajectory_id": pd.Series([int(i["trajectory_id"]) for i in ids], dtype="int64"),
+            "sensor_id": pd.Series([int(i["sensor_id"]) for i in ids], dtype="int64"),
+            "name": pd.Series([path.name for path in paths], dtype="string[pyarrow]"),
+            "path": pd.Series([str(path) for path in paths], dtype="string[pyarrow]"),
+            "copc_path": pd.Series(
+                [str(path) if path.exists() else None for path in copc_paths],
+                dtype="string[pyarrow]",
+            ),
+        }
+    )
+    return scans
+
+
+class CopcScan(BaseModel):
+    path: str
+    copc_path: str
+    # Modification time of the COPC file the header values were read from.
+    copc_mtime: float
+    point_count: int
+    bounds: list[float]
+
+
+class CopcManifest(BaseModel):
+    """Every COPC file written by `kappa extract prepare-lidar`, by source path."""
+
+    scans: dict[str, CopcScan] = {}
+
+    @classmethod
+    def load(cls, path: Path) -> "CopcManifest":
+        if not path.exists():
+            return cls()
+        return cls.model_validate_json(path.read_bytes())
+
+    def save(self, path: Path) -> None:
+        # Sorted, the file does not depend on the order conversions finished in.
+        self.scans = dict(sorted(self.scans.items()))
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(self.model_dump_json(indent=2))
+        tmp_path.replace(path)
+
+
+def copc_output_path(
+    kappa_path: KappazunderPath, scan_path: Path, output_dir: Path | None = None
+) -> Path:
+    """COPC sibling of a scan, or the same relative path below ``output_dir``."""
+    copc_path = kappa_path.get_copc_scan(scan_path)
+    if output_dir is None:
+        return copc_path
+    return output_dir / copc_path.relative_to(kappa_path.scan_data_dir)
+
+
+def copc_manifest_path(kappa_path: KappazunderPath, output_dir: Path | None = None) -> Path:
+    """One manifest below ``output_dir``, otherwise one per extract next to its scans."""
+    return (output_dir or kappa_path.scan_data_dir) / COPC_MANIFEST
+
+
+def scan_targets(
+    kappa_paths: list[KappazunderPath], output_dir: Path | None = None
+) -> list[tuple[KappazunderPath, Path, Path]]:
+    """(extract, scan, output) of every scan of the extracts, in order.
+
+    Scans at the same place in more than one extract would share their
+    output below ``output_dir``, the one of the first extract is kept.
+    """
+    targets, seen, skipped = [], set(), 0
+    for kappa_path in kappa_paths:
+        for source in sorted(kappa_path.get_all_scans()):
+            target = copc_output_path(kappa_path, source, output_dir)
+            if target in seen:
+                skipped += 1
+                continue
+            seen.add(target)
+            targets.append((kappa_path, source, target))
+    if skipped:
+        print(f"Skipping {skipped} scans found in more than one extract")
+    return targets
+
+
+def load_manifests(
+    targets: list[tuple[KappazunderPath, Path, Path]], output_dir: Path | None = None
+) -> tuple[dict[Path, CopcManifest], dict[Path, Path]]:
+    """Manifests of the targets, without scans removed from the extracts, and
+    the manifest path of every scan."""
+    manifest_paths = {
+        source: copc_manifest_path(kappa_path, output_dir) for kappa_path, source, _ in targets
+    }
+    manifests = {}
+    for manifest_path in dict.fromkeys(manifest_paths.values()):
+        manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        manifest = CopcManifest.load(manifest_path)
+        sources = {str(source) for source, path in manifest_paths.items() if path == manifest_path}
+        manifest.scans = {path: scan for path, scan in manifest.scans.items() if path in sources}
+        manifests[manifest_path] = manifest
+    return manifests, manifest_paths
+
+
+def is_up_to_date(source: Path, target: Path) -> bool:
+    return target.exists() and target.stat().st_mtime >= source.stat().st_mtime
+
+
+def limit_memory(max_bytes: int | None) -> None:
+    """Process pool initializer, caps the address space of a worker."""
+    if max_bytes is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (max_bytes, max_bytes))
+
+
+def convert_to_copc(source: Path, target: Path) -> Path:
+    """Write ``source`` as a COPC file with PDAL, atomically."""
+    import pdal
+
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = target.with_name(target.name + ".tmp")
+    pipeline = pdal.Pipeline(
+        json.dumps(
+            [
+                {"type": "readers.las", "filename": str(source)},
+                {"type": "writers.copc", "filename": str(tmp_path)},
+            ]
+        ).decode()
+    )
+    pipeline.execute()
+    tmp_path.replace(target)
+    return target
+
+
+def copc_scan(source: Path, target: Path) -> CopcScan:
+    header = read_scan_header(target)
+    return CopcScan(
+        path=str(source),
+        copc_path=str(target),
+        copc_mtime=target.stat().st_mtime,
+        point_count=header["point_count"],
+        bounds=[header[column] for column in BOUNDS_COLUMNS],
+    )
+
+
+@metrics.timed(
+    "convert_scans", items=lambda manifests: sum(len(m.scans) for m in manifests.values())
+)
+def convert_scans(
+    kappa_paths: list[KappazunderPath],
+    output_dir: Path | None = None,
+    workers: int = 4,
+    max_memory: int | None = None,
+    force: bool = False,
+) -> dict[Path, CopcManifest]:
+    """Convert every scan of the extracts to COPC, skipping up to date outputs.
+
+    Scans of all extracts share one pool of ``workers`` processes, each file
+    is converted in its own worker and ``max_memory`` caps the bytes a
+    worker may allocate. Manifests, by path, are saved after every file, so
+    an interrupted run keeps what it converted.
+    """
+    targets = scan_targets(kappa_paths, output_dir)
+    manifests, manifest_paths = load_manifests(targets, output_dir)
+    jobs = []
+    for _, source, target in targets:
+        manifest = manifests[manifest_paths[source]]
+        if not force and is_up_to_date(source, target):
+            known = manifest.scans.get(str(source))
+            if known is None or known.copc_mtime != target.stat().st_mtime:
+                manifest.scans[str(source)] = copc_scan(source, target)
+        else:
+            jobs.append((source, target))
+    print(f"{len(jobs)} of {len(targets)} scans to convert")
+
+    failed = []
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=limit_memory, initargs=(max_memory,)
+    ) as executor:
+        futures = {
+            executor.submit(convert_to_copc, source, target): (source, target)
+            for source, target in jobs
+        }
+        for future in tqdm(
+            as_completed(futures), desc="Converting to COPC...", total=len(jobs), unit="file"
+        ):
+            source, target = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Failed to convert {source}: {e}")
+                failed.append(source)
+                continue
+            manifest_path = manifest_paths[source]
+            manifests[manifest_path].scans[str(source)] = copc_scan(source, target)
+            manifests[manifest_path].save(manifest_path)
+    for manifest_path, manifest in manifests.items():
+        manifest.save(manifest_path)
+    if failed:
+        raise RuntimeError(f"{len(failed)} scans failed to convert")
+    return manifests
@@ -0,0 +1,89 @@
+import hashlib
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+from pydantic import BaseModel
+
+from kappa.metadata import ImageGroups
+from kappa.models import TrajectoryMeta
+from kappa.stac_io import ExtentAccumulator
+
+MANIFEST_VERSION = 1
+
+
+class TrajectoryBuild(BaseModel):
+    image_meta_hash: str
+    trajectory_hash: str
+    items_file: str
+    item_count: int
+    bbox: list[float]
+    start: datetime | None
+    end: datetime | None
+
+    @property
+    def inputs(self) -> tuple[str, str]:
+        return self.image_meta_hash, self.trajectory_hash
+
+    def extent(self) -> ExtentAccumulator:
+        extent = ExtentAccumulator()
+        extent.bbox, extent.start, extent.end = list(self.bbox), self.start, self.end
+        return extent
+
+
+class BuildManifest(BaseModel):
+    """What `kappa stac images --incremental` built, per trajectory."""
+
+    version: int = MANIFEST_VERSION
+    params: dict = {}
+    trajectories: dict[int, TrajectoryBuild] = {}
+
+    @classmethod
+    def load(cls, path: Path) -> "BuildManifest":
+        if not path.exists():
+            return cls()
+        manifest = cls.model_validate_json(path.read_bytes())
+        if manifest.version != MANIFEST_VERSION:
+            return cls()
+        return manifest
+
+    def save(self, path: Path) -> None:
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(self.model_dump_json(indent=2))
+        tmp_path.replace(path)
+
+
+def hash_file(path: Path, block_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        while block := f.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def image_meta_hashes(raw_image_groups: ImageGroups) -> dict[int, str]:
+    """Hash of the image_meta.txt rows of every trajectory."""
+    faces = raw_image_groups.faces
+    # Paths are derived from the other columns and the extract location,
+    # which is part of the build parameters.
+    row_hashes = pd.util.hash_pandas_object(
+        faces.drop(columns="path"), index=False
+    ).to_numpy()
+    return {
+        int(trajectory_id): hashlib.sha256(row_hashes[rows].tobytes()).hexdigest()
+        for trajectory_id, rows in faces.groupby("trajectory_id").indices.items()
+    }
+
+
+def trajectory_inputs(
+    raw_image_groups: ImageGroups, trajectories: dict[int, TrajectoryMeta]
+) -> dict[int, tuple[str, str]]:
+    """(image_meta rows hash, trajectory file hash) of every imaged trajectory."""
+    inputs = {}
+    for trajectory_id, image_meta_hash in image_meta_hashes(raw_image_groups).items():
+        trajectory = trajectories.get(trajectory_id)
+        trajectory_hash = (
+            hash_file(trajectory.path) if trajectory and trajectory.path else ""
+        )
+        inputs[trajectory_id] = (image_meta_hash, trajectory_hash)
+    return inputs
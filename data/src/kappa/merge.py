@@ -0,0 +1,234 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from kappa.crs import reproject_gdf, trajectory_epsg
+from kappa.lidar import BOUNDS_COLUMNS, read_scan_headers, scan_files
+from kappa.metadata import (
+    ImageGroups,
+    extract_metadata,
+    extract_trajectory_metadata,
+    get_direction_labels,
+    read_scan_meta,
+)
+from kappa.paths import KappazunderPath, OnDuplicate
+
+IMAGE_KEY = ["TRAJECTORYID", "IMAGE_NAME"]
+SCAN_KEY = ["trajectory_id", "name"]
+
+
+def read_wfs_dump(path: Path) -> gpd.GeoDataFrame:
+    """Read a WFS dump written by `kappa wfs`, GeoJSON or GeoParquet."""
+    if path.is_dir() or path.suffix in (".parquet", ".geoparquet"):
+        return gpd.read_parquet(path)
+    return gpd.read_file(path)
+
+
+def image_group_columns(groups: ImageGroups, exists: pd.Series | None = None) -> pd.DataFrame:
+    """Front face orientation and every face path, one row per image group.
+
+    With ``exists`` per face, ``missing_faces`` counts the faces whose file
+    is not in the extract, it is NA where ``exists`` is.
+    """
+    faces = groups.faces
+    labels = get_direction_labels(faces["sensor_id"])
+    paths = (
+        pd.DataFrame(
+            {
+                "TRAJECTORYID": faces["trajectory_id"],
+                "IMAGE_NAME": faces["name"],
+                "label": "path_" + pd.Series(labels, index=faces.index),
+                "path": faces["path"],
+            }
+        )
+        .pivot(index=IMAGE_KEY, columns="label", values="path")
+        .rename_axis(columns=None)
+    )
+    front = faces.loc[labels == "front", ["trajectory_id", "name", "rx_rad", "ry_rad", "rz_rad"]]
+    orientation = front.rename(
+        columns={"trajectory_id": "TRAJECTORYID", "name": "IMAGE_NAME"}
+    ).set_index(IMAGE_KEY)
+    missing = pd.Series(
+        pd.NA if exists is None else (~exists.astype("boolean")).to_numpy(),
+        index=faces.index,
+        dtype="Int64",
+    )
+    missing_faces = missing.groupby(
+        [faces["trajectory_id"].rename("TRAJECTORYID"), faces["name"].rename("IMAGE_NAME")]
+    ).sum(min_count=1).rename("missing_faces")
+    return orientation.join([paths, missing_faces], how="outer").reset_index()
+
+
+def faces_exist(kappa_paths: list[KappazunderPath], paths: pd.Series) -> pd.Series | None:
+    """Whether every face file is in its extract, NA for extracts without a file index.
+
+    None when no extract has a file index.
+    """
+    exists = pd.Series(pd.NA, index=paths.index, dtype="boolean")
+    indexed = False
+    for kappa_path in kappa_paths:
+        index = kappa_path.file_index()
+        if index is None:
+            continue
+        indexed = True
+        in_extract = paths.str.startswith(f"{kappa_path.raw_images_dir}/").to_numpy(dtype=bool)
+        exists[in_extract] = index.exists(paths[in_extract]).to_numpy()
+    return exists if indexed else None
+
+
+def merge_images(
+    wfs_images: gpd.GeoDataFrame,
+    kappa_paths: list[KappazunderPath],
+    workers: int = 4,
+    on_duplicate: OnDuplicate = OnDuplicate.first,
+) -> gpd.GeoDataFrame:
+    """Left join extract image metadata onto WFS image points.
+
+    Extracts are read ``workers`` at a time by `extract_metadata`, which
+    also decides which of the image groups found in several extracts is used.
+    """
+    groups, _ = extract_metadata(kappa_paths, workers, on_duplicate=on_duplicate)
+    images = image_group_columns(groups, faces_exist(kappa_paths, groups.faces["path"]))
+
+    wfs_images = wfs_images.astype({"TRAJECTORYID": "int64", "IMAGE_NAME": "string[pyarrow]"})
+    images = images.astype({"TRAJECTORYID": "int64", "IMAGE_NAME": "string[pyarrow]"})
+    merged = wfs_images.merge(images, on=IMAGE_KEY, how="left", validate="many_to_one")
+    merged["has_images"] = merged["rx_rad"].notna()
+    incomplete = (merged["missing_faces"] > 0).sum()
+    if incomplete:
+        print(f"{incomplete} images have faces missing from their extract")
+    return merged
+
+
+def match_time_ranges(
+    trajectory_ids: np.ndarray,
+    epochs: np.ndarray,
+    range_trajectory_ids: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Pairs of (query, range) where the range of the same trajectory contains the epoch.
+
+    Ranges are indexed as one sorted array of trajectory offset start times and
+    looked up with a binary search, ranges of a trajectory must not overlap.
+    """
+    if not len(starts) or not len(epochs):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    codes, _ = pd.factorize(
+        np.concatenate([range_trajectory_ids, trajectory_ids]), sort=True
+    )
+    range_codes, query_codes = codes[: len(starts)], codes[len(starts) :]
+    span = max(np.max(ends, initial=0), np.max(epochs, initial=0)) + 1
+    range_keys = range_codes * span + starts
+    order = np.argsort(range_keys, kind="stable")
+    query_keys = query_codes * span + epochs
+    candidates = np.searchsorted(range_keys[order], query_keys, side="right") - 1
+    found = candidates >= 0
+    ranges = order[np.where(found, candidates, 0)]
+    found &= (range_codes[ranges] == query_codes) & (epochs <= ends[ranges])
+    return np.flatnonzero(found), ranges[found]
+
+
+def intersecting_scans(footprints: gpd.GeoDataFrame, scans: pd.DataFrame) -> pd.DataFrame:
+    """(footprint, scan) pairs whose footprint intersects the scan header bounds."""
+    pairs = []
+    for code in np.unique(scans["epsg"]):
+        subset = np.flatnonzero(scans["epsg"].to_numpy() == code)
+        bounds = scans[BOUNDS_COLUMNS].to_numpy()[subset]
+        tree = shapely.STRtree(shapely.box(bounds[:, 0], bounds[:, 1], bounds[:, 3], bounds[:, 4]))
+        geometry = reproject_gdf(footprints, int(code)).geometry.array
+        footprint_index, tree_index = tree.query(geometry, predicate="intersects")
+        pairs.append(pd.DataFrame({"footprint": footprint_index, "scan": subset[tree_index]}))
+    return pd.concat(pairs, ignore_index=True) if pairs else pd.DataFrame(
+        {"footprint": pd.Series(dtype="int64"), "scan": pd.Series(dtype="int64")}
+    )
+
+
+def _extract_scans(kappa_path: KappazunderPath) -> tuple[pd.DataFrame, pd.DataFrame]:
+    files = scan_files(kappa_path)
+    files["epsg"] = trajectory_epsg(files["trajectory_id"], extract_trajectory_metadata(kappa_path))
+    return files, read_scan_meta(kappa_path)
+
+
+def extract_scans(
+    kappa_paths: list[KappazunderPath], workers: int = 16
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Scan files with headers and trajectory EPSG, and the scan_meta rows of those files.
+
+    Extracts are listed ``workers`` at a time, then the headers of the scans
+    kept from all of them are read by one pool of ``workers`` threads.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(kappa_paths)))) as executor:
+        results = list(executor.map(_extract_scans, kappa_paths))
+    scans = pd.concat([files for files, _ in results], ignore_index=True)
+    duplicated = scans.duplicated(SCAN_KEY)
+    if duplicated.any():
+        print(f"Skipping {duplicated.sum()} scans found in more than one extract")
+        scans = scans[~duplicated].reset_index(drop=True)
+    headers = read_scan_headers([Path(path) for path in scans["path"]], workers)
+    scans = pd.concat([scans, headers], axis=1)
+    scan_meta = (
+        pd.concat([scan_meta for _, scan_meta in results], ignore_index=True)
+        .drop_duplicates(SCAN_KEY)
+        .merge(scans[SCAN_KEY].reset_index(names="scan"), on=SCAN_KEY)
+    )
+    return scans, scan_meta
+
+
+def merge_lidar(
+    wfs_footprints: gpd.GeoDataFrame, kappa_paths: list[KappazunderPath], workers: int = 16
+) -> gpd.GeoDataFrame:
+    """Attach local scan files to WFS LiDAR footprints.
+
+    A scan belongs to a footprint when it has the footprint's scan name or its
+    ``scan_meta.txt`` time range contains the footprint's start epoch, and its
+    header bounds intersect the footprint.
+    """
+    scans, scan_meta = extract_scans(kappa_paths, workers)
+    footprints = wfs_footprints.reset_index(drop=True)
+    trajectory_ids = footprints["TRAJECTORYID"].to_numpy(dtype=np.int64)
+
+    by_name = (
+        pd.DataFrame(
+            {
+                "trajectory_id": trajectory_ids,
+                "name": footprints["SCANDATA_NAME"].astype("string[pyarrow]"),
+            }
+        )
+        .reset_index(names="footprint")
+        .merge(scans[SCAN_KEY].reset_index(names="scan"), on=SCAN_KEY)
+    )
+    footprint_index, range_index = match_time_ranges(
+        trajectory_ids,
+        footprints["EPOCH_START_S"].to_numpy(dtype=np.float64),
+        scan_meta["trajectory_id"].to_numpy(),
+        scan_meta["epoch_start_s"].to_numpy(),
+        scan_meta["epoch_end_s"].to_numpy(),
+    )
+    by_time = pd.DataFrame(
+        {"footprint": footprint_index, "scan": scan_meta["scan"].to_numpy()[range_index]}
+    )
+    candidates = pd.concat(
+        [by_name[["footprint", "scan"]], by_time], ignore_index=True
+    ).drop_duplicates()
+    pairs = candidates.merge(intersecting_scans(footprints, scans), on=["footprint", "scan"])
+
+    matched = scans.loc[pairs["scan"], ["path", "copc_path", "point_count"]].astype(object)
+    matched["bounds"] = scans[BOUNDS_COLUMNS].to_numpy()[pairs["scan"]].tolist()
+    matched.index = pairs["footprint"].to_numpy()
+    lists = matched.sort_values("path").groupby(level=0).agg(list)
+
+    merged = footprints.copy()
+    merged["scan_paths"] = lists["path"].reindex(merged.index)
+    merged["copc_paths"] = lists["copc_path"].reindex(merged.index)
+    merged["point_counts"] = lists["point_count"].reindex(merged.index)
+    merged["scan_bounds"] = lists["bounds"].reindex(merged.index)
+    merged["point_count"] = (
+        lists["point_count"].map(sum).reindex(merged.index).fillna(0).astype("int64")
+    )
+    merged["has_scans"] = merged["scan_paths"].notna()
+    return merged
@@ -0,0 +1,327 @@
+import filecmp
+import re
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Literal
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from kappa import metrics
+from kappa.models import RawImageMeta, TrajectoryMeta
+from kappa.paths import KappazunderPath, OnDuplicate
+
+DIRECTION_LABELS = np.array(["up", "front", "right", "back", "left", "down"])
+# Identifies an image group across extracts.
+IMAGE_GROUP_KEY = ["trajectory_id", "id"]
+
+IMAGE_META_DTYPES = {
+    "trajectory_id": "int64",
+    "sensor_id": "int64",
+    "image_id": "int64",
+    "epoch_s": "float64",
+    "image_name": "string[pyarrow]",
+    "x_m": "float64",
+    "y_m": "float64",
+    "z_m": "float64",
+    "rx_rad": "float64",
+    "ry_rad": "float64",
+    "rz_rad": "float64",
+}
+IMAGE_META_COLUMNS = {
+    "image_id": "id",
+    "image_name": "name",
+    "epoch_s": "gps_epoch_s",
+}
+# scan_meta.txt has one GPS time range per scan file, see "Scan-Metainformation"
+# in docs/Description_of_Geodata_Kappazunder_OGD_English.pdf. It is assumed
+# to be tab separated like image_meta.txt, the data file id is not used.
+SCAN_META_DTYPES = {
+    "trajectory_id": "int64",
+    "sensor_id": "int64",
+    "epoch_start_s": "float64",
+    "epoch_end_s": "float64",
+    "scandata_name": "string[pyarrow]",
+}
+SCAN_META_COLUMNS = {"scandata_name": "name"}
+# Columns of interior_orientation.txt, see "Interior orientation" in the docs.
+# Sizes of the sensor and its pixels are in mm, the image size in pixels.
+INTERIOR_ORIENTATION_DTYPES = {
+    "sensor_id": "int64",
+    "projection": "string[pyarrow]",
+    "c_mm": "float64",
+    "psu_mm": "float64",
+    "psv_mm": "float64",
+    "pixu": "int64",
+    "pixv": "int64",
+    "height_m": "float64",
+    "pitch_rad": "float64",
+}
+
+
+def get_direction_label(
+    sensor_id: int,
+) -> Literal["up", "front", "right", "back", "left", "down"]:
+    # Can also calculate it, given the trajectory and sensor angles
+    return str(DIRECTION_LABELS[sensor_id % 10])
+
+
+def get_direction_labels(sensor_ids: np.ndarray) -> np.ndarray:
+    return DIRECTION_LABELS[np.asarray(sensor_ids) % 10]
+
+
+def extract_trajectory_metadata(
+    kappa_path: KappazunderPath,
+) -> dict[int, TrajectoryMeta]:
+    meta_map = {}
+    for trajectory_path in kappa_path.trajectories_dir.iterdir():
+        match = re.search(
+            r"trajectory_(?P<id>\d+)_(?P<gps_week>\d+)_(?P<epsg>\d+)",
+            trajectory_path.name,
+        )
+        metadata = TrajectoryMeta(**match.groupdict(), path=trajectory_path)
+
+        meta_map[metadata.id] = metadata
+
+    return meta_map
+
+
+@dataclass
+class ImageGroups:
+    """Cubemap faces from ``image_meta.txt``, one row per face.
+
+    Faces are sorted by image id, the faces of the ``i``-th group are the rows
+    ``offsets[i]:offsets[i + 1]`` of ``faces``. A group is identified by
+    `IMAGE_GROUP_KEY`.
+    """
+
+    faces: pd.DataFrame
+    offsets: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def starts(self) -> np.ndarray:
+        return self.offsets[:-1]
+
+    @property
+    def sizes(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    @property
+    def first(self) -> pd.DataFrame:
+        """First face of every group, one row per group."""
+        return self.faces.iloc[self.starts].reset_index(drop=True)
+
+    def group(self, i: int) -> pd.DataFrame:
+        return self.faces.iloc[self.offsets[i] : self.offsets[i + 1]]
+
+    @classmethod
+    def from_faces(
+        cls, faces: pd.DataFrame, by: list[str] | None = None
+    ) -> "ImageGroups":
+        """Group faces by `IMAGE_GROUP_KEY`, ordering groups by ``by`` (default: id)."""
+        faces = faces.sort_values(by or ["id", "trajectory_id"], kind="stable", ignore_index=True)
+        ids = faces["id"].to_numpy()
+        trajectory_ids = faces["trajectory_id"].to_numpy()
+        boundaries = (
+            np.flatnonzero((ids[1:] != ids[:-1]) | (trajectory_ids[1:] != trajectory_ids[:-1])) + 1
+        )
+        offsets = np.concatenate([[0], boundaries, [len(ids)]]).astype(np.int64)
+        if not len(ids):
+            offsets = np.zeros(1, dtype=np.int64)
+        return cls(faces=faces, offsets=offsets)
+
+
+@metrics.timed("read_image_meta", items=len)
+def read_image_meta(
+    kappa_path: KappazunderPath, chunksize: int = 500_000
+) -> pd.DataFrame:
+    chunks = []
+    with tqdm(desc="Reading image metadata...", unit="rows") as progress:
+        for chunk in pd.read_csv(
+            kappa_path.image_metadata,
+            sep="\t",
+            usecols=list(IMAGE_META_DTYPES),
+            dtype=IMAGE_META_DTYPES,
+            chunksize=chunksize,
+        ):
+            chunk = chunk.rename(columns=IMAGE_META_COLUMNS)
+            chunk["path"] = kappa_path.get_raw_images(
+                chunk["trajectory_id"], chunk["sensor_id"], chunk["name"]
+            )
+            chunks.append(chunk)
+            progress.update(len(chunk))
+    if not chunks:
+        return pd.DataFrame(
+            {
+                IMAGE_META_COLUMNS.get(name, name): pd.Series(dtype=dtype)
+                for name, dtype in IMAGE_META_DTYPES.items()
+            }
+            | {"path": pd.Series(dtype="string[pyarrow]")}
+        )
+    return pd.concat(chunks, ignore_index=True)
+
+
+def read_scan_meta(kappa_path: KappazunderPath) -> pd.DataFrame:
+    """GPS time range of every scan file, empty without ``scan_meta.txt``."""
+    if not kappa_path.scan_metadata.exists():
+        return pd.DataFrame(
+            {
+                SCAN_META_COLUMNS.get(name, name): pd.Series(dtype=dtype)
+                for name, dtype in SCAN_META_DTYPES.items()
+            }
+        )
+    return pd.read_csv(
+        kappa_path.scan_metadata,
+        sep="\t",
+        usecols=list(SCAN_META_DTYPES),
+        dtype=SCAN_META_DTYPES,
+    ).rename(columns=SCAN_META_COLUMNS)
+
+
+def read_interior_orientation(kappa_path: KappazunderPath) -> pd.DataFrame:
+    """Camera model of every image sensor, indexed by sensor id.
+
+    Column names in the file are not documented, so columns are read by
+    position and a header line is skipped if there is one.
+    """
+    with kappa_path.interior_orientation.open() as f:
+        has_header = not f.readline().split()[0].isdigit()
+    return pd.read_csv(
+        kappa_path.interior_orientation,
+        sep=r"\s+",
+        header=None,
+        skiprows=1 if has_header else 0,
+        names=list(INTERIOR_ORIENTATION_DTYPES),
+        usecols=range(len(INTERIOR_ORIENTATION_DTYPES)),
+        dtype=INTERIOR_ORIENTATION_DTYPES,
+    ).set_index("sensor_id")
+
+
+@metrics.timed("validate_image_groups")
+def validate_image_groups(groups: ImageGroups) -> None:
+    """Check image groups against the `RawImageMeta` schema, column-wise."""
+    faces = groups.faces
+    missing = set(RawImageMeta.model_fields) - set(faces.columns)
+    if missing:
+        raise ValueError(f"Image metadata is missing columns: {sorted(missing)}")
+    nulls = faces.columns[faces.isna().any()].tolist()
+    if nulls:
+        raise ValueError(f"Image metadata has empty values in columns: {nulls}")
+    if len(faces):
+        RawImageMeta.model_validate(faces.iloc[0].to_dict())
+
+    invalid_sensors = faces["sensor_id"] % 10 >= len(DIRECTION_LABELS)
+    if invalid_sensors.any():
+        sensor_ids = faces.loc[invalid_sensors, "sensor_id"].unique().tolist()
+        raise ValueError(f"Unknown cubemap sensors: {sensor_ids}")
+
+    duplicated = faces.duplicated([*IMAGE_GROUP_KEY, "sensor_id"])
+    if duplicated.any():
+        keys = faces.loc[duplicated, IMAGE_GROUP_KEY].drop_duplicates()
+        ids = [image_group_id(*key) for key in keys.itertuples(index=False)]
+        raise ValueError(f"Image groups {ids[:10]} have duplicated faces")
+
+
+def extract_image_metadata(
+    kappa_path: KappazunderPath, validate: bool = False
+) -> ImageGroups:
+    groups = ImageGroups.from_faces(read_image_meta(kappa_path))
+    if validate:
+        validate_image_groups(groups)
+    return groups
+
+
+def _read_extract(
+    args: tuple[KappazunderPath, bool],
+) -> tuple[pd.DataFrame, dict[int, TrajectoryMeta]]:
+    kappa_path, validate = args
+    return (
+        extract_image_metadata(kappa_path, validate=validate).faces,
+        extract_trajectory_metadata(kappa_path),
+    )
+
+
+def image_group_id(trajectory_id: int, image_id: int) -> str:
+    """Id of an image group, e.g. of its STAC item, unique across trajectories."""
+    return f"{trajectory_id}_{image_id}"
+
+
+def group_hashes(faces: pd.DataFrame) -> pd.Series:
+    """Hash of the faces of every group by `IMAGE_GROUP_KEY`, ignoring face order and paths."""
+    hashes = pd.util.hash_pandas_object(faces.drop(columns="path"), index=False)
+    return hashes.groupby([faces[column] for column in IMAGE_GROUP_KEY]).sum()
+
+
+def same_trajectory(a: TrajectoryMeta, b: TrajectoryMeta) -> bool:
+    if (a.epsg, a.gps_week) != (b.epsg, b.gps_week):
+        return False
+    return a.path is None or b.path is None or filecmp.cmp(a.path, b.path, shallow=False)
+
+
+@metrics.timed("read_extracts")
+def extract_metadata(
+    kappa_paths: list[KappazunderPath],
+    workers: int = 4,
+    validate: bool = False,
+    on_duplicate: OnDuplicate = OnDuplicate.first,
+) -> tuple[ImageGroups, dict[int, TrajectoryMeta]]:
+    """Image groups and trajectories of several extracts, read ``workers`` at a time.
+
+    An image group (by `IMAGE_GROUP_KEY`) or trajectory found in more than one
+    extract is taken from the first extract listing it, so the result only
+    depends on the order of ``kappa_paths``. Groups with identical faces and
+    trajectories with identical files are skipped silently, with
+    ``on_duplicate=error`` the others raise a ValueError instead.
+    """
+    args = [(kappa_path, validate) for kappa_path in kappa_paths]
+    if len(kappa_paths) == 1:
+        groups = extract_image_metadata(kappa_paths[0], validate=validate)
+        return groups, extract_trajectory_metadata(kappa_paths[0])
+    with ProcessPoolExecutor(max_workers=max(1, min(workers, len(args)))) as executor:
+        results = list(executor.map(_read_extract, args))
+
+    faces, trajectories = [], {}
+    seen = pd.Series(dtype=np.uint64)
+    identical_groups = conflicting_groups = conflicting_trajectories = 0
+    for kappa_path, (extract_faces, extract_trajectories) in zip(kappa_paths, results):
+        hashes = group_hashes(extract_faces)
+        known = hashes.index.isin(seen.index)
+        if known.any():
+            duplicates = hashes[known]
+            conflicting = duplicates.index[
+                duplicates.to_numpy() != seen.reindex(duplicates.index).to_numpy()
+            ]
+            if len(conflicting) and on_duplicate == OnDuplicate.error:
+                raise ValueError(
+                    f"Image groups {conflicting[:10].tolist()} (trajectory, id) of "
+                    f"{kappa_path.base_dir} differ from those in an earlier extract"
+                )
+            conflicting_groups += len(conflicting)
+            identical_groups += len(duplicates) - len(conflicting)
+            face_keys = pd.MultiIndex.from_frame(extract_faces[IMAGE_GROUP_KEY])
+            extract_faces = extract_faces[~face_keys.isin(duplicates.index)]
+        seen = pd.concat([seen, hashes[~known]])
+        faces.append(extract_faces)
+        for trajectory_id, trajectory in extract_trajectories.items():
+            known = trajectories.setdefault(trajectory_id, trajectory)
+            if known is not trajectory and not same_trajectory(known, trajectory):
+                if on_duplicate == OnDuplicate.error:
+                    raise ValueError(
+                        f"Trajectory {trajectory_id} of {kappa_path.base_dir} differs "
+                        "from the one in an earlier extract"
+                    )
+                conflicting_trajectories += 1
+    if identical_groups:
+        print(f"Skipping {identical_groups} image groups already read from an earlier extract")
+    if conflicting_groups:
+        print(f"Using the first of {conflicting_groups} image groups that differ between extracts")
+    if conflicting_trajectories:
+        print(
+            f"Using the first of {conflicting_trajectories} trajectories "
+            "that differ between extracts"
+        )
+    return ImageGroups.from_faces(pd.concat(faces, ignore_index=True)), trajectories
@@ -0,0 +1,356 @@
+import cProfile
+import functools
+import os
+import resource
+import signal
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from enum import Enum
+from pathlib import Path
+from typing import Any, Callable, Iterator
+from urllib.parse import urlsplit
+
+import orjson as json
+
+
+class Profiler(str, Enum):
+    cprofile = "cprofile"
+    sampling = "sampling"
+
+
+def peak_rss_mb() -> float:
+    """High water mark of this process' resident memory."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Kilobytes on Linux, bytes on macOS.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def reset_peak_rss() -> None:
+    """Reset the high water mark to the current resident memory (Linux only)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def io_bytes() -> tuple[int, int]:
+    """Bytes this process and its finished children read from and wrote to storage."""
+    try:
+        with open("/proc/self/io") as f:
+            io = dict(line.split(": ") for line in f.read().splitlines())
+        return int(io["read_bytes"]), int(io["write_bytes"])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+
+def cpu_seconds() -> float:
+    """User and system time of this process and its finished children."""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+@dataclass
+class StageRecord:
+    name: str
+    items: int | None = None
+    counters: Counter = field(default_factory=Counter)
+    peak_rss_mb: float = 0.0
+    _start: tuple = ()
+
+    def start(self) -> None:
+        self._start = (time.perf_counter(), cpu_seconds(), *io_bytes())
+
+    def finish(self) -> dict:
+        wall = time.perf_counter() - self._start[0]
+        read, written = io_bytes()
+        record = {
+            "type": "stage",
+            "name": self.name,
+            "wall_s": wall,
+            "cpu_s": cpu_seconds() - self._start[1],
+            "peak_rss_mb": self.peak_rss_mb,
+            "bytes_read": read - self._start[2],
+            "bytes_written": written - self._start[3],
+            "items": self.items,
+            "items_per_s": self.items / wall if self.items is not None and wall > 0 else None,
+            # Largest finished worker process of the run so far.
+            "worker_peak_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+        }
+        return record | dict(self.counters)
+
+
+class _Untracked:
+    """Stand in for a `StageRecord` when metrics are off."""
+
+    items: int | None = None
+
+
+class SamplingProfiler:
+    """Samples the main thread's stack on CPU time, written as folded stacks.
+
+    The output is the input format of flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+
+    def _sample(self, signum, frame) -> None:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+            frame = frame.f_back
+        self.stacks[";".join(reversed(stack))] += 1
+
+    def enable(self) -> None:
+        signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def disable(self) -> None:
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+
+    def dump_stats(self, path: str) -> None:
+        with open(path, "w") as f:
+            f.writelines(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class MetricsRecorder:
+    """Stage timings, memory, IO and HTTP requests of one CLI run.
+
+    Stages nest per thread, a stage is named by the path of stages it runs
+    in, stages of other threads run in those of the thread that created the
+    recorder. Every finished stage is appended to ``output`` as a JSON line,
+    followed by a summary of HTTP requests per host when the run ends.
+    """
+
+    def __init__(
+        self,
+        output: Path | None,
+        profile_stage: str | None = None,
+        profiler: Profiler = Profiler.cprofile,
+        profile_output: Path | None = None,
+    ):
+        self.output = output
+        self.profile_stage = profile_stage
+        self.profiler = profiler
+        self.profile_output = profile_output
+        self.local = threading.local()
+        self.main_stack = self.stack
+        # Running stages of all threads.
+        self.running: list[StageRecord] = []
+        self.lock = threading.Lock()
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.statuses: dict[str, Counter] = defaultdict(Counter)
+        if output is not None:
+            output.parent.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def stack(self) -> list[StageRecord]:
+        """Running stages of the calling thread, innermost last."""
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def _counted(self) -> list[StageRecord]:
+        """Running stages of the calling thread and of those it runs in."""
+        stack = self.stack
+        return stack if stack is self.main_stack else self.main_stack + stack
+
+    def write(self, record: dict) -> None:
+        if self.output is not None:
+            with self.output.open("ab") as f:
+                f.write(json.dumps(record) + b"\n")
+
+    def count(self, name: str, value: float = 1) -> None:
+        """Add to a counter of every stage the calling thread runs in."""
+        with self.lock:
+            for record in self._counted():
+                record.counters[name] += value
+
+    def record_request(self, url: str, status: int, seconds: float) -> None:
+        host = urlsplit(url).netloc
+        with self.lock:
+            self.latencies[host].append(seconds)
+            self.statuses[host][str(status)] += 1
+            for record in self._counted():
+                record.counters["http_requests"] += 1
+                record.counters["http_s"] += seconds
+
+    def _profiles(self, name: str) -> bool:
+        return self.profile_stage is not None and self.profile_stage in (
+            name,
+            name.rsplit("/", 1)[-1],
+        )
+
+    @contextmanager
+    def stage(self, name: str, items: int | None = None) -> Iterator[StageRecord]:
+        stack = self.stack
+        # The memory high water mark is reset for every stage, so parents
+        # take the peak of their children and of the time before them.
+        peak = peak_rss_mb()
+        with self.lock:
+            parents = stack or self.main_stack
+            parent = f"{parents[-1].name}/" if parents else ""
+            record = StageRecord(name=parent + name, items=items)
+            for running in self.running:
+                running.peak_rss_mb = max(running.peak_rss_mb, peak)
+            self.running.append(record)
+        stack.append(record)
+        reset_peak_rss()
+        profiler = None
+        if self._profiles(record.name):
+            profiler = cProfile.Profile() if self.profiler == Profiler.cprofile else SamplingProfiler()
+            profiler.enable()
+        record.start()
+        try:
+            yield record
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self._dump_profile(profiler, record.name)
+            record.peak_rss_mb = max(record.peak_rss_mb, peak_rss_mb())
+            stack.pop()
+            with self.lock:
+                self.running.remove(record)
+                for running in self.running:
+                    running.peak_rss_mb = max(running.peak_rss_mb, record.peak_rss_mb)
+            self.write(record.finish())
+
+    def _dump_profile(self, profiler, name: str) -> None:
+        path = self.profile_output
+        if path is None:
+            suffix = ".prof" if self.profiler == Profiler.cprofile else ".folded"
+            stem = name.replace("/", ".").replace(" ", "-")
+            base = self.output.parent if self.output is not None else Path(".")
+            path = base / f"{stem}-{time.strftime('%Y%m%dT%H%M%S')}{suffix}"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(str(path))
+        print(f"Profile of {name} written to {path}", file=sys.stderr)
+
+    def close(self) -> None:
+        import numpy as np
+
+        for host, latencies in self.latencies.items():
+            latencies = np.array(latencies)
+            self.write(
+                {
+                    "type": "http",
+                    "host": host,
+                    "requests": len(latencies),
+                    "statuses": dict(self.statuses[host]),
+                    "total_s": float(latencies.sum()),
+                    "mean_s": float(latencies.mean()),
+                    "p50_s": float(np.percentile(latencies, 50)),
+                    "p95_s": float(np.percentile(latencies, 95)),
+                    "max_s": float(latencies.max()),
+                }
+            )
+
+
+def command_path(ctx, args: list[str]) -> str:
+    """Subcommand names in ``args`` below ``ctx.command``, e.g. "extract merge-images"."""
+    names, command = [], ctx.command
+    for arg in args:
+        if not hasattr(command, "get_command"):
+            break
+        subcommand = command.get_command(ctx, arg)
+        if subcommand is not None:
+            names.append(arg)
+            command = subcommand
+    return " ".join(names) or "kappa"
+
+
+_recorder: MetricsRecorder | None = None
+
+
+def enable(recorder: MetricsRecorder) -> None:
+    global _recorder
+    _recorder = recorder
+
+
+def disable() -> None:
+    global _recorder
+    if _recorder is not None:
+        _recorder.close()
+    _recorder = None
+
+
+def _forget_recorder() -> None:
+    # Forked workers would write their stages and the HTTP summary into the
+    # parent's output, and may fork while another thread holds its lock.
+    global _recorder
+    _recorder = None
+
+
+os.register_at_fork(after_in_child=_forget_recorder)
+
+
+@contextmanager
+def stage(name: str, items: int | None = None) -> Iterator[StageRecord | _Untracked]:
+    """Measure the enclosed block as a stage, set ``.items`` for a throughput."""
+    if _recorder is None:
+        yield _Untracked()
+        return
+    with _recorder.stage(name, items) as record:
+        yield record
+
+
+def timed(name: str, items: Callable[[Any], int] | None = None):
+    """Decorator measuring every call as a stage, ``items`` counts the result."""
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name) as record:
+                result = function(*args, **kwargs)
+                if items is not None:
+                    record.items = items(result)
+                return result
+
+        return wrapper
+
+    return decorator
+
+
+def count(name: str, value: float = 1) -> None:
+    if _recorder is not None:
+        _recorder.count(name, value)
+
+
+def record_response(response, *args, **kwargs) -> None:
+    """`requests` response hook."""
+    if _recorder is not None:
+        _recorder.record_request(
+            response.url, response.status_code, response.elapsed.total_seconds()
+        )
+
+
+def instrument_boto_client(client) -> None:
+    """Record the API calls of a boto3 client, parts of multipart uploads included."""
+
+    def before(context, **kwargs):
+        context["metrics_start"] = time.perf_counter()
+
+    def after(http_response, context, **kwargs):
+        if _recorder is not None and "metrics_start" in context:
+            _recorder.record_request(
+                client.meta.endpoint_url,
+                http_response.status_code,
+                time.perf_counter() - context["metrics_start"],
+            )
+
+    client.meta.events.register("before-call", before)
+    client.meta.events.register("after-call", after)
@@ -20,4 +20,5 @@ class RawImageMeta(BaseModel):
 class TrajectoryMeta(BaseModel):
     id: int
     epsg: int
-    gps_week: int
\ No newline at end of file
+    gps_week: int
+    path: Path | None = None
\ No newline at end of file
@@ -0,0 +1,383 @@
+from bisect import bisect_left
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import orjson as json
+import typer
+
+from kappa.crs import WGS84, transform, trajectory_epsg
+from kappa.gpstime import gps_to_utc
+from kappa.images import CUBEMAP_FACES, PANORAMA_CONFIG
+from kappa.metadata import DIRECTION_LABELS, ImageGroups, extract_metadata, image_group_id
+from kappa.models import TrajectoryMeta
+from kappa.paths import OUTPUT_PATH, OnDuplicate, extract_paths
+from kappa.trajectory import euler_to_matrix
+
+INDEX_EPSG = 31256
+ARRAYS = ("points", "cell_offsets", "order", "rank", "by_id")
+# Bearing of the horizontal faces relative to the front face, clockwise.
+FACE_BEARINGS = {"front": 0.0, "right": 90.0, "back": 180.0, "left": 270.0}
+
+panoramas_cli = typer.Typer()
+
+
+@dataclass
+class PanoramaIndex:
+    """Grid of square cells over projected panorama positions.
+
+    ``points`` is sorted by cell, the points of cell ``i`` are the rows
+    ``cell_offsets[i]:cell_offsets[i + 1]``. ``order`` lists the rows by
+    trajectory and time, ``rank`` is the position of every row in it and
+    ``by_id`` lists the rows by trajectory and image id. Every array is saved as its
+    own ``.npy`` file, so a loaded index is memory mapped. The heading of a
+    panorama is the bearing of its front face, NaN without one.
+    """
+
+    points: np.ndarray
+    cell_offsets: np.ndarray
+    order: np.ndarray
+    rank: np.ndarray
+    by_id: np.ndarray
+    epsg: int
+    origin: tuple[float, float]
+    cell_size: float
+    shape: tuple[int, int]
+
+    @classmethod
+    def build(
+        cls,
+        groups: ImageGroups,
+        trajectories: dict[int, TrajectoryMeta],
+        epsg: int = INDEX_EPSG,
+        cell_size: float = 50.0,
+    ) -> "PanoramaIndex":
+        first = groups.first
+        x, y = first["x_m"].to_numpy(dtype=np.float64), first["y_m"].to_numpy(dtype=np.float64)
+        source_epsg = trajectory_epsg(first["trajectory_id"], trajectories)
+        for code in np.unique(source_epsg):
+            if code != epsg:
+                mask = source_epsg == code
+                x[mask], y[mask], _ = transform(x[mask], y[mask], np.zeros(mask.sum()), int(code), epsg)
+        weeks = first["trajectory_id"].map(
+            {trajectory.id: trajectory.gps_week for trajectory in trajectories.values()}
+        )
+        names = first["name"].to_numpy(dtype=object).astype(bytes)
+        heading = np.full(len(first), np.nan)
+        faces = groups.faces
+        front = (faces["sensor_id"].to_numpy() % 10) == list(DIRECTION_LABELS).index("front")
+        group_rows = np.repeat(np.arange(len(groups)), groups.sizes)
+        # Faces look along their negative z axis.
+        view = -euler_to_matrix(
+            faces["rx_rad"][front], faces["ry_rad"][front], faces["rz_rad"][front]
+        )[:, :, 2]
+        heading[group_rows[front]] = np.degrees(np.arctan2(view[:, 0], view[:, 1])) % 360
+
+        points = np.empty(
+            len(first),
+            dtype=[
+                ("x", "f8"),
+                ("y", "f8"),
+                ("z", "f4"),
+                ("id", "i8"),
+                ("trajectory_id", "i8"),
+                ("time_us", "i8"),
+                ("heading", "f4"),
+                ("name", names.dtype),
+            ],
+        )
+        points["x"], points["y"], points["z"] = x, y, first["z_m"].to_numpy()
+        points["id"] = first["id"].to_numpy()
+        points["trajectory_id"] = first["trajectory_id"].to_numpy()
+        points["time_us"] = gps_to_utc(weeks, first["gps_epoch_s"]).astype(np.int64)
+        points["heading"] = heading
+        points["name"] = names
+
+        origin = (float(x.min(initial=0)), float(y.min(initial=0)))
+        nx = int((x.max(initial=0) - origin[0]) // cell_size) + 1
+        ny = int((y.max(initial=0) - origin[1]) // cell_size) + 1
+        cells = ((y - origin[1]) // cell_size).astype(np.int64) * nx + (
+            (x - origin[0]) // cell_size
+        ).astype(np.int64)
+        by_cell = np.argsort(cells, kind="stable")
+        points = points[by_cell]
+        cell_offsets = np.searchsorted(cells[by_cell], np.arange(nx * ny + 1))
+
+        order = np.lexsort((points["time_us"], points["trajectory_id"]))
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        return cls(
+            points=points,
+            cell_offsets=cell_offsets,
+            order=order,
+            rank=rank,
+            by_id=np.lexsort((points["id"], points["trajectory_id"])),
+            epsg=epsg,
+            origin=origin,
+            cell_size=cell_size,
+            shape=(nx, ny),
+        )
+
+    def save(self, index_dir: Path) -> None:
+        index_dir.mkdir(parents=True, exist_ok=True)
+        for name in ARRAYS:
+            np.save(index_dir / f"{name}.npy", getattr(self, name))
+        (index_dir / "index.json").write_bytes(
+            json.dumps(
+                {
+                    "epsg": self.epsg,
+                    "origin": self.origin,
+                    "cell_size": self.cell_size,
+                    "shape": self.shape,
+                }
+            )
+        )
+
+    @classmethod
+    def load(cls, index_dir: Path) -> "PanoramaIndex":
+        meta = json.loads((index_dir / "index.json").read_bytes())
+        return cls(
+            **{name: np.load(index_dir / f"{name}.npy", mmap_mode="r") for name in ARRAYS},
+            epsg=meta["epsg"],
+            origin=tuple(meta["origin"]),
+            cell_size=meta["cell_size"],
+            shape=tuple(meta["shape"]),
+        )
+
+    def _ring_rows(self, cx: int, cy: int, radius: int) -> np.ndarray:
+        """Rows of the cells ``radius`` cells away from cell (cx, cy)."""
+        nx, ny = self.shape
+        span = np.arange(-radius, radius + 1)
+        if radius == 0:
+            dx, dy = np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64)
+        else:
+            side = np.full(len(span), radius)
+            inner = span[1:-1]
+            dx = np.concatenate([span, span, -side[1:-1], side[1:-1]])
+            dy = np.concatenate([-side, side, inner, inner])
+        x, y = cx + dx, cy + dy
+        inside = (x >= 0) & (x < nx) & (y >= 0) & (y < ny)
+        cells = y[inside] * nx + x[inside]
+        starts, ends = self.cell_offsets[cells], self.cell_offsets[cells + 1]
+        sizes = ends - starts
+        if not sizes.sum():
+            return np.zeros(0, dtype=np.int64)
+        return np.repeat(starts - np.cumsum(sizes) + sizes, sizes) + np.arange(sizes.sum())
+
+    def nearest_rows(
+        self,
+        x: float,
+        y: float,
+        k: int = 1,
+        trajectory_id: int | None = None,
+        start: datetime | None = None,
+        end: datetime | None = None,
+        max_distance: float = 1000.0,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Rows and distances of the ``k`` nearest panoramas to projected (x, y).
+
+        Searches rings of cells outwards until no unseen cell can hold a
+        closer panorama.
+        """
+        cx = int((x - self.origin[0]) // self.cell_size)
+        cy = int((y - self.origin[1]) // self.cell_size)
+        rows, distances = [], []
+        found = np.zeros(0)
+        for radius in range(int(max_distance // self.cell_size) + 2):
+            ring = self._ring_rows(cx, cy, radius)
+            if len(ring):
+                points = self.points[ring]
+                keep = np.ones(len(ring), dtype=bool)
+                if trajectory_id is not None:
+                    keep &= points["trajectory_id"] == trajectory_id
+                if start is not None:
+                    keep &= points["time_us"] >= _time_us(start)
+                if end is not None:
+                    keep &= points["time_us"] <= _time_us(end)
+                rows.append(ring[keep])
+                distances.append(np.hypot(points["x"][keep] - x, points["y"][keep] - y))
+                found = np.concatenate(distances)
+            # Unseen cells are at least ``radius`` cells away.
+            if (found <= radius * self.cell_size).sum() >= k:
+                break
+        if not rows:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        rows, distances = np.concatenate(rows), found
+        best = np.argsort(distances, kind="stable")[:k]
+        best = best[distances[best] <= max_distance]
+        return rows[best], distances[best]
+
+    def nearest(
+        self,
+        lon: float,
+        lat: float,
+        k: int = 1,
+        base_url: str = "",
+        bearing: float | None = None,
+        **filters,
+    ) -> list[dict]:
+        """The ``k`` nearest panoramas to a WGS84 location.
+
+        With a ``bearing`` in degrees clockwise from north, every panorama
+        also gets the face looking closest to it and the yaw to look along it.
+        """
+        x, y, _ = transform(np.array([lon]), np.array([lat]), np.zeros(1), WGS84, self.epsg)
+        rows, distances = self.nearest_rows(float(x[0]), float(y[0]), k, **filters)
+        return [
+            {
+                **self.describe(row, base_url),
+                "distance_m": float(distance),
+                **({} if bearing is None else self.view(row, bearing)),
+            }
+            for row, distance in zip(rows.tolist(), distances.tolist())
+        ]
+
+    def view(self, row: int, bearing: float) -> dict:
+        """Face of a panorama looking closest to ``bearing`` and the yaw from its front face."""
+        heading = float(self.points["heading"][row])
+        if np.isnan(heading):
+            return {"view_face": None, "view_yaw_deg": None}
+        yaw = (bearing - heading) % 360
+        label = min(FACE_BEARINGS, key=lambda face: abs((yaw - FACE_BEARINGS[face] + 180) % 360 - 180))
+        return {"view_face": CUBEMAP_FACES[label], "view_yaw_deg": yaw}
+
+    def row_of(self, trajectory_id: int, image_id: int) -> int | None:
+        # Binary search over the memory mapped arrays, without sorting copies.
+        trajectory_ids, ids = self.points["trajectory_id"], self.points["id"]
+        i = bisect_left(
+            range(len(self.by_id)),
+            (trajectory_id, image_id),
+            key=lambda i: (trajectory_ids[self.by_id[i]], ids[self.by_id[i]]),
+        )
+        if i < len(self.by_id):
+            row = int(self.by_id[i])
+            if (trajectory_ids[row], ids[row]) == (trajectory_id, image_id):
+                return row
+        return None
+
+    def step(self, row: int, steps: int = 1) -> int | None:
+        """Row ``steps`` panoramas later (earlier when negative) on the same trajectory."""
+        position = int(self.rank[row]) + steps
+        if not 0 <= position < len(self.order):
+            return None
+        other = int(self.order[position])
+        if self.points["trajectory_id"][other] != self.points["trajectory_id"][row]:
+            return None
+        return other
+
+    def describe(self, row: int, base_url: str = "") -> dict:
+        """A panorama and the URLs of its prepared tiles and face previews."""
+        point = self.points[row]
+        x, y, z = transform(
+            np.array([point["x"]]), np.array([point["y"]]), np.array([point["z"]]), self.epsg
+        )
+        name = point["name"].decode()
+        folder = f"{base_url.rstrip('/')}/Trajektorie_{point['trajectory_id']}/{Path(name).stem}".lstrip("/")
+        return {
+            "id": image_group_id(int(point["trajectory_id"]), int(point["id"])),
+            "trajectory_id": int(point["trajectory_id"]),
+            "image_id": int(point["id"]),
+            "name": name,
+            "lon": float(x[0]),
+            "lat": float(y[0]),
+            "z": float(z[0]),
+            "heading_deg": None if np.isnan(point["heading"]) else float(point["heading"]),
+            "datetime": datetime.fromtimestamp(int(point["time_us"]) / 1e6, timezone.utc).isoformat(),
+            "panorama": f"{folder}/{PANORAMA_CONFIG}",
+            "faces": {face: f"{folder}/preview/{face}.jpg" for face in CUBEMAP_FACES.values()},
+        }
+
+
+def _time_us(value: datetime) -> int:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() * 1_000_000)
+
+
+def index_handler(index: PanoramaIndex, base_url: str) -> type[BaseHTTPRequestHandler]:
+    """Serves ``/nearest?lon=&lat=[&k=&bearing=&trajectory_id=&start=&end=&max_distance=]``
+    and ``/panoramas/<trajectory_id>_<image_id>[/next|/previous]`` as JSON."""
+
+    class IndexHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            parts = url.path.strip("/").split("/")
+            try:
+                if parts == ["nearest"]:
+                    body = index.nearest(
+                        float(query["lon"]),
+                        float(query["lat"]),
+                        k=int(query.get("k", 1)),
+                        base_url=base_url,
+                        bearing=float(query["bearing"]) if "bearing" in query else None,
+                        trajectory_id=int(query["trajectory_id"]) if "trajectory_id" in query else None,
+                        start=datetime.fromisoformat(query["start"]) if "start" in query else None,
+                        end=datetime.fromisoformat(query["end"]) if "end" in query else None,
+                        max_distance=float(query.get("max_distance", 1000)),
+                    )
+                elif parts[0] == "panoramas" and len(parts) in (2, 3):
+                    trajectory_id, image_id = map(int, parts[1].split("_"))
+                    row = index.row_of(trajectory_id, image_id)
+                    if row is not None and len(parts) == 3:
+                        steps = {"next": 1, "previous": -1}[parts[2]]
+                        row = index.step(row, steps)
+                    if row is None:
+                        return self.reply(404, {"error": "No such panorama"})
+                    body = index.describe(row, base_url)
+                else:
+                    return self.reply(404, {"error": "Not found"})
+            except (KeyError, ValueError) as e:
+                return self.reply(400, {"error": f"Bad request: {e}"})
+            self.reply(200, body)
+
+        def reply(self, status: int, body) -> None:
+            data = json.dumps(body)
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("Access-Control-Allow-Origin", "*")
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return IndexHandler
+
+
+@panoramas_cli.command(name="build-index")
+def build_index(
+    extract_path: list[Path],
+    index_dir: Path = OUTPUT_PATH / "panorama-index",
+    epsg: int = typer.Option(INDEX_EPSG, help="Projected CRS the index is built in."),
+    cell_size: float = typer.Option(50.0, help="Grid cell size in CRS units."),
+    workers: int = typer.Option(4, help="Extracts read at the same time."),
+    on_duplicate: OnDuplicate = typer.Option(
+        OnDuplicate.first,
+        help="Keep the first of image groups or trajectories found in several extracts, or fail.",
+    ),
+):
+    """Index panorama positions of one or more data extracts for nearest lookups."""
+    groups, trajectories = extract_metadata(
+        extract_paths(extract_path), workers, on_duplicate=on_duplicate
+    )
+    index = PanoramaIndex.build(groups, trajectories, epsg=epsg, cell_size=cell_size)
+    index.save(index_dir)
+    print(f"Indexed {len(index.points)} panoramas in {index_dir}")
+
+
+@panoramas_cli.command()
+def serve(
+    index_dir: Path = OUTPUT_PATH / "panorama-index",
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    base_url: str = typer.Option("", help="Where `extract prepare-images` output is hosted."),
+):
+    """Serve nearest panorama lookups over HTTP."""
+    server = ThreadingHTTPServer((host, port), index_handler(PanoramaIndex.load(index_dir), base_url))
+    print(f"Serving {index_dir} on http://{host}:{port}")
+    server.serve_forever()
@@ -1,8 +1,24 @@
+import os
 from dataclasses import dataclass
+from enum import Enum
 from pathlib import Path
-from typing import Generator, Iterable
+from typing import TYPE_CHECKING, Generator, Iterable
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+    from kappa.fileindex import FileIndex
 
 OUTPUT_PATH = Path("./output/")
+COPC_SUFFIX = ".copc.laz"
+FILE_INDEX_NAME = ".kappa-files.sqlite"
+
+
+class OnDuplicate(str, Enum):
+    """What to do with data found in more than one extract."""
+
+    first = "first"
+    error = "error"
 
 
 @dataclass
@@ -13,24 +29,88 @@ class KappazunderPath:
     def image_metadata(self) -> Path:
         return self.base_dir / "Bild-Meta" / "image_meta.txt"
     
+    @property
+    def interior_orientation(self) -> Path:
+        return self.base_dir / "Bild-Meta" / "interior_orientation.txt"
+
+    @property
+    def raw_images_dir(self) -> Path:
+        return self.base_dir / "Bild-Rohdaten"
+
     @property
     def scan_data_dir(self) -> Path:
         return self.base_dir / 'Scan-Punktwolken'
 
+    @property
+    def scan_metadata(self) -> Path:
+        return self.base_dir / "Scan-Meta" / "scan_meta.txt"
+
     @property
     def trajectories_dir(self) -> Path:
         return self.base_dir / "Verortung" / "Trajektorien"
-        
+
+    @property
+    def file_index_path(self) -> Path:
+        return self.base_dir / FILE_INDEX_NAME
+
+    def file_index(self) -> "FileIndex | None":
+        """Index of the extract files, None until `kappa extract index` built one."""
+        from kappa.fileindex import FileIndex
+
+        if not self.file_index_path.exists():
+            return None
+        return FileIndex(self.base_dir, self.file_index_path)
+
     def get_all_scans(self) -> Generator[Path, None, None]:
-        return self.scan_data_dir.glob('Trajektorie_*/Sensor_*/*.laz')
+        index = self.file_index()
+        if index is not None:
+            return (path for path in index.paths("scan"))
+        return (
+            path
+            for path in self.scan_data_dir.glob('Trajektorie_*/Sensor_*/*.laz')
+            if not path.name.endswith(COPC_SUFFIX)
+        )
+
+    @staticmethod
+    def get_copc_scan(scan_path: Path) -> Path:
+        return scan_path.with_name(scan_path.name.removesuffix(".laz") + COPC_SUFFIX)
+
+    def exists(self, paths: Iterable[str | Path]) -> "pd.Series":
+        """Whether every path exists, answered by the file index if there is one."""
+        import pandas as pd
+
+        index = self.file_index()
+        if index is not None:
+            return index.exists(paths)
+        return pd.Series([os.path.exists(path) for path in paths], dtype=bool)
 
     def get_raw_image(
         self, trajectory_id: str, sensor_id: str, image_name: str
     ) -> Path:
         return (
-            self.base_dir
-            / "Bild-Rohdaten"
+            self.raw_images_dir
             / f"Trajektorie_{trajectory_id}"
             / f"Sensor_{sensor_id}"
             / image_name
         )
+
+    def get_raw_images(
+        self,
+        trajectory_ids: "pd.Series",
+        sensor_ids: "pd.Series",
+        image_names: "pd.Series",
+    ) -> "pd.Series":
+        """Same as `get_raw_image`, but builds string paths for whole columns."""
+        return (
+            f"{self.raw_images_dir}/Trajektorie_"
+            + trajectory_ids.astype("string[pyarrow]")
+            + "/Sensor_"
+            + sensor_ids.astype("string[pyarrow]")
+            + "/"
+            + image_names.astype("string[pyarrow]")
+        )
+
+
+def extract_paths(data_dirs: Iterable[Path]) -> list[KappazunderPath]:
+    """Extracts in the order given, the first one wins where they overlap."""
+    return [KappazunderPath(data_dir) for data_dir in dict.fromkeys(data_dirs)]
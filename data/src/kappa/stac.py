@@ -1,184 +1,375 @@
-import csv
-import re
-from collections import defaultdict
-from datetime import datetime, timezone
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from enum import Enum
+from itertools import groupby
 from pathlib import Path
-from typing import Literal
+from string import Formatter
+from typing import Iterable, Iterator
 
 import geopandas as gpd
+import numpy as np
+import orjson as json
 import pandas as pd
-import pyproj
+import pyarrow as pa
+import pyarrow.compute as pc
 import pystac
 import typer
-from astropy.time import Time
 from tqdm import tqdm
 
-from kappa.models import RawImageMeta, TrajectoryMeta
-from kappa.paths import KappazunderPath
+from kappa import metrics
+from kappa.crs import reproject_positions
+from kappa.gpstime import gps_to_utc, to_datetimes
+from kappa.manifest import BuildManifest, TrajectoryBuild, trajectory_inputs
+from kappa.metadata import (
+    DIRECTION_LABELS,
+    ImageGroups,
+    extract_metadata,
+    get_direction_labels,
+    image_group_id,
+)
+from kappa.models import TrajectoryMeta
+from kappa.paths import OUTPUT_PATH, KappazunderPath, OnDuplicate, extract_paths
+from kappa.stac_io import (
+    ITEMS_FILE,
+    ExtentAccumulator,
+    OutputFormat,
+    add_items_asset,
+    item_writer,
+)
 
-stac_cli = typer.Typer(help="Prepare STAC catalog [WIP].")
+stac_cli = typer.Typer()
 
 
-def get_direction_label(
-    sensor_id: int,
-) -> Literal["up", "front", "right", "back", "left", "down"]:
-    # Can also calculate it, given the trajectory and sensor angles
-    last_digit = sensor_id % 10
-    MAPPING = {
-        0: "up",
-        1: "front",
-        2: "right",
-        3: "back",
-        4: "left",
-        5: "down",
-    }
-    return MAPPING[last_digit]
+def gps_weeks(trajectories: dict[int, TrajectoryMeta]) -> dict[int, int]:
+    return {trajectory.id: trajectory.gps_week for trajectory in trajectories.values()}
 
 
-def extract_trajectory_metadata(
-    kappa_path: KappazunderPath,
-) -> dict[int, TrajectoryMeta]:
-    meta_map = {}
-    for trajectory_path in kappa_path.trajectories_dir.iterdir():
-        match = re.search(
-            r"trajectory_(?P<id>\d+)_(?P<gps_week>\d+)_(?P<epsg>\d+)",
-            trajectory_path.name,
-        )
-        metadata = TrajectoryMeta(**match.groupdict())
-
-        meta_map[metadata.id] = metadata
-
-    return meta_map
-
-
-def extract_image_metadata(kappa_path: KappazunderPath) -> dict[int, RawImageMeta]:
-    grouped_images = defaultdict(list)
-    image_meta_file = kappa_path.image_metadata
-    with image_meta_file.open("r") as csvfile:
-        reader = csv.DictReader(csvfile, delimiter="\t")
-        for row in tqdm(reader, desc="Reading image metadata..."):
-            raw_image = RawImageMeta(
-                **row,
-                id=row["image_id"],
-                name=row["image_name"],
-                gps_epoch_s=row["epoch_s"],
-                path=kappa_path.get_raw_image(
-                    row["trajectory_id"],
-                    row["sensor_id"],
-                    row["image_name"],
-                ),
-            )
-            grouped_images[raw_image.id].append(raw_image)
-    return grouped_images
+def face_columns(groups: ImageGroups) -> pd.DataFrame:
+    """Faces of every group as ``<label>_<field>`` columns in `DIRECTION_LABELS`
+    order, null where a group has no such face.
 
+    Built from the face columns without Python objects. Sensor ids are nullable
+    int32, rotations float32, and image names categoricals sharing one set of
+    categories, as a group's faces share its name.
+    """
+    faces = groups.faces
+    slot = faces["sensor_id"].to_numpy() % 10
+    rows = np.repeat(np.arange(len(groups)), groups.sizes)
+    valid = np.zeros((len(groups), len(DIRECTION_LABELS)), dtype=bool)
+    valid[rows, slot] = True
 
-def skip_keys(d: dict, keys: list) -> dict:
-    return {
-        k: v
-        for k, v in d.items()
-        if k not in keys
-    }
+    def slots(values: np.ndarray, fill) -> np.ndarray:
+        table = np.full(valid.shape, fill, dtype=np.asarray(fill).dtype)
+        table[rows, slot] = values
+        return table
 
-def flatten_image_group(group: list[RawImageMeta]) -> dict:
-    image = group[0]
-    return {
-        **skip_keys(image.model_dump(), ["label", "path", "rx_rad", "ry_rad", "rz_rad", "name"]),
-        "images": [
-            {
-                "label": get_direction_label(image.sensor_id),
-                "href": str(image.path),
-                "rx_rad": image.rx_rad,
-                "ry_rad": image.ry_rad,
-                "rz_rad": image.rz_rad,
-            }
-            for image in group
-        ]
+    sensor_ids = slots(faces["sensor_id"].to_numpy(), np.int32(0))
+    name_codes, names = pd.factorize(faces["name"])
+    name_codes = slots(name_codes, np.int32(-1))
+    names = pd.Index(names).astype(str)
+    rotations = {
+        name: slots(faces[name].to_numpy(), np.float32(np.nan))
+        for name in ("rx_rad", "ry_rad", "rz_rad")
     }
-    
-    
-def images_gdf(kappa_path: KappazunderPath):
-    image_groups = extract_image_metadata(kappa_path)
-    trajectories = extract_trajectory_metadata(kappa_path)
-    trajectory = next(iter(trajectories.values()))
-    df = pd.DataFrame.from_records(map(flatten_image_group, image_groups.values()))
-    gdf = gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(df.x_m, df.y_m, df.z_m), crs=f"epsg:{trajectory.epsg}").to_crs("epsg:4326")
+    columns = {}
+    for i, label in enumerate(DIRECTION_LABELS):
+        columns[f"{label}_sensor_id"] = pd.arrays.IntegerArray(sensor_ids[:, i], ~valid[:, i])
+        columns[f"{label}_name"] = pd.Categorical.from_codes(name_codes[:, i], categories=names)
+        for name, values in rotations.items():
+            columns[f"{label}_{name}"] = values[:, i]
+    return pd.DataFrame(columns)
+
+
+def images_gdf(*kappa_paths: KappazunderPath, workers: int = 4) -> gpd.GeoDataFrame:
+    """One row per image group with its faces as `face_columns`.
+
+    Columns are numpy, nullable or categorical types that convert to Arrow
+    without Python objects, so ``to_parquet`` writes GeoParquet that
+    ``read_parquet`` reads back as is. Face paths are not stored, `image_hrefs`
+    builds them from `IMAGE_HREF_TEMPLATE`, the ``extract`` column is the
+    categorical image directory of each group.
+    """
+    kappa_paths = list(kappa_paths)
+    image_groups, trajectories = extract_metadata(kappa_paths, workers)
+    first = image_groups.first
+    df = pd.DataFrame(
+        {
+            "trajectory_id": first["trajectory_id"].to_numpy(dtype=np.int32),
+            "sensor_id": first["sensor_id"].to_numpy(dtype=np.int32),
+            "id": first["id"].to_numpy(),
+            "gps_epoch_s": first["gps_epoch_s"].to_numpy(),
+            "x_m": first["x_m"].to_numpy(),
+            "y_m": first["y_m"].to_numpy(),
+            "z_m": first["z_m"].to_numpy(),
+        }
+    )
+    image_dirs = [str(kappa_path.raw_images_dir) for kappa_path in kappa_paths]
+    extract = np.zeros(len(df), dtype=np.int8)
+    for code, image_dir in enumerate(image_dirs):
+        extract[first["path"].str.startswith(f"{image_dir}/").to_numpy()] = code
+    df["extract"] = pd.Categorical.from_codes(extract, categories=image_dirs)
+    df = pd.concat([df, face_columns(image_groups)], axis=1)
+
+    positions = reproject_positions(df, trajectories)
+    df["datetime"] = gps_to_utc(
+        df["trajectory_id"].map(gps_weeks(trajectories)), df["gps_epoch_s"]
+    )
+    df["datetime"] = df["datetime"].dt.tz_localize("UTC")
+    gdf = gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(positions.lon, positions.lat, positions.z), crs="epsg:4326")
     return gdf
 
 
+# Same layout as `KappazunderPath.get_raw_image`, below the ``extract`` directory.
+IMAGE_HREF_TEMPLATE = "{extract}/Trajektorie_{trajectory_id}/Sensor_{sensor_id}/{name}"
 
 
-def gps_time_to_datetime(gps_week: int, gps_seconds: float) -> datetime:
-    SECONDS_IN_WEEK = 604800
-    time = Time(SECONDS_IN_WEEK * gps_week + gps_seconds, format="gps")
-    return time.datetime.replace(tzinfo=timezone.utc)
+def image_hrefs(gdf: pd.DataFrame) -> pd.DataFrame:
+    """Face paths of `images_gdf` rows from `IMAGE_HREF_TEMPLATE`, one column per
+    label in `DIRECTION_LABELS`, null for missing faces."""
+    hrefs = {}
+    for label in DIRECTION_LABELS:
+        fields = {
+            "extract": pa.array(gdf["extract"]),
+            "trajectory_id": pa.array(gdf["trajectory_id"].to_numpy()),
+            "sensor_id": pa.array(gdf[f"{label}_sensor_id"]),
+            "name": pa.array(gdf[f"{label}_name"]),
+        }
+        parts = []
+        for literal, field, _, _ in Formatter().parse(IMAGE_HREF_TEMPLATE):
+            parts.append(literal)
+            if field is not None:
+                parts.append(pc.cast(fields[field], pa.string()))
+        hrefs[label] = pd.arrays.ArrowExtensionArray(pc.binary_join_element_wise(*parts, ""))
+    return pd.DataFrame(hrefs, index=gdf.index)
 
 
-def create_stac_image_items(
-    raw_image_groups: dict[int, list[RawImageMeta]],
+ROTATION_SCHEMA = pa.struct([(name, pa.float64()) for name in ("rx_rad", "ry_rad", "rz_rad")])
+# Fields of image items that only some items have, every face asset may be missing.
+IMAGE_ITEM_SCHEMA = pa.schema(
+    [
+        (
+            "assets",
+            pa.struct(
+                [
+                    (
+                        f"{label} photo",
+                        pa.struct(
+                            [("href", pa.string()), ("title", pa.string()), ("type", pa.string())]
+                            + list(ROTATION_SCHEMA)
+                        ),
+                    )
+                    for label in DIRECTION_LABELS
+                ]
+            ),
+        ),
+        ("direction", ROTATION_SCHEMA),
+    ]
+)
+
+
+class Validation(str, Enum):
+    full = "full"
+    sample = "sample"
+    schema_once = "schema-once"
+
+
+# Signatures of items validated by this process, worker processes keep theirs
+# across chunks, so schema-once validates each structure once per worker.
+_validated_signatures: set[tuple] = set()
+
+
+def item_signature(item: pystac.Item) -> tuple:
+    """Everything the item JSON schemas depend on, except the values."""
+    return (
+        item.geometry["type"],
+        tuple(sorted(item.properties)),
+        tuple(sorted((key, tuple(sorted(asset.extra_fields))) for key, asset in item.assets.items())),
+        tuple(item.stac_extensions),
+    )
+
+
+def image_group_table(
+    raw_image_groups: ImageGroups,
     trajectories: dict[int, TrajectoryMeta],
+) -> pd.DataFrame:
+    """One row per image group with everything an item needs but its assets."""
+    first = raw_image_groups.first
+    positions = reproject_positions(first, trajectories)
+    weeks = first["trajectory_id"].map(gps_weeks(trajectories))
+    return pd.DataFrame(
+        {
+            "id": first["id"],
+            "trajectory_id": first["trajectory_id"],
+            "gps_week": weeks,
+            "gps_epoch_s": first["gps_epoch_s"],
+            "lon": positions.lon,
+            "lat": positions.lat,
+            "z": positions.z,
+            "datetime": gps_to_utc(weeks, first["gps_epoch_s"]),
+            "start": raw_image_groups.offsets[:-1],
+            "end": raw_image_groups.offsets[1:],
+        }
+    )
+
+
+def _create_items(
+    groups: pd.DataFrame,
+    faces: pd.DataFrame,
+    validation: Validation,
+    sample_every: int,
+    timings: dict[str, float] | None = None,
 ) -> list[pystac.Item]:
+    """Build items for ``groups``, whose start/end index into ``faces``.
+
+    Seconds spent validating are added to ``timings["validate_s"]``.
+    """
+    labels = get_direction_labels(faces["sensor_id"]).tolist()
+    hrefs = faces["path"].to_numpy(dtype=object)
+    rotations = faces[["rx_rad", "ry_rad", "rz_rad"]].to_numpy().tolist()
+    datetimes = to_datetimes(groups["datetime"].to_numpy())
+    validate_s = 0.0
+
     items = []
-    for group in tqdm(raw_image_groups.values(), desc="Processing image groups..."):
-        image = group[0]
-        trajectory = trajectories[image.trajectory_id]
-        proj = pyproj.Transformer.from_crs(trajectory.epsg, 4326, always_xy=True)
-        x, y, z = proj.transform(image.x_m, image.y_m, image.z_m)
+    for i, group in enumerate(
+        groups[["id", "trajectory_id", "gps_week", "gps_epoch_s", "lon", "lat", "z", "start", "end"]].itertuples(index=False)
+    ):
+        x, y, z = group.lon, group.lat, group.z
         item = pystac.Item(
-            id=str(image.id),
+            id=image_group_id(group.trajectory_id, group.id),
             bbox=[x, y, x, y],
             geometry={
                 "type": "Point",
                 "coordinates": [x, y, z],
             },
-            datetime=gps_time_to_datetime(trajectory.gps_week, image.gps_epoch_s),
+            datetime=datetimes[i],
             properties={
-                "trajectory_id": image.trajectory_id,
-                "gps_week": trajectory.gps_week,
-                "gps_epoch_s": image.gps_epoch_s,
+                "trajectory_id": group.trajectory_id,
+                "gps_week": group.gps_week,
+                "gps_epoch_s": group.gps_epoch_s,
             },
         )
         # proj_ext = ProjectionExtension.ext(item, add_if_missing=True)
         # proj_ext.epsg = trajectory.epsg
 
-        for image in group:
-            direction = get_direction_label(image.sensor_id)
+        for direction, href, (rx_rad, ry_rad, rz_rad) in zip(
+            labels[group.start : group.end],
+            hrefs[group.start : group.end],
+            rotations[group.start : group.end],
+        ):
             item.add_asset(
                 f"{direction} photo",
                 pystac.Asset(
-                    href=image.path,
+                    href=href,
                     title=f"{direction.capitalize()} photo",
                     media_type=pystac.MediaType.JPEG,
                     extra_fields={
-                        "rx_rad": image.rx_rad,
-                        "ry_rad": image.ry_rad,
-                        "rz_rad": image.rz_rad,
+                        "rx_rad": rx_rad,
+                        "ry_rad": ry_rad,
+                        "rz_rad": rz_rad,
                     },
                 ),
             )
         item.properties["direction"] = item.assets.get("front photo").extra_fields
-        item.validate()
+
+        validate_start = time.perf_counter()
+        match validation:
+            case Validation.full:
+                item.validate()
+            case Validation.sample if group.id % sample_every == 0:
+                item.validate()
+            case Validation.schema_once:
+                signature = item_signature(item)
+                if signature not in _validated_signatures:
+                    item.validate()
+                    _validated_signatures.add(signature)
+        validate_s += time.perf_counter() - validate_start
         items.append(item)
+    if timings is not None:
+        timings["validate_s"] = timings.get("validate_s", 0.0) + validate_s
     return items
 
 
-@stac_cli.command(name='images')
-def images(input_dir: Path, title: str = "Kappazunder data extract") -> None:
-    """Create STAC collection from Kappzunder images."""
-    print(f"Exists: {input_dir.exists()}")
-    kappa_path = KappazunderPath(input_dir)
-    trajectories = extract_trajectory_metadata(kappa_path)
-    raw_image_groups = extract_image_metadata(kappa_path)
-
-    items = create_stac_image_items(raw_image_groups, trajectories)
-    
-    spatial_extent = pystac.SpatialExtent([[-180.0, -90.0, 180.0, 90.0]])
-    temporal_extent = pystac.TemporalExtent([[datetime(1970, 1, 1), None]])
-    collection_extent = pystac.Extent(spatial_extent, temporal_extent)
+def _create_items_chunk(args: tuple) -> tuple[list[pystac.Item], dict[str, float]]:
+    timings = {}
+    return _create_items(*args, timings=timings), timings
+
+
+def _finish_chunk(
+    result: tuple[list[pystac.Item], dict[str, float]], progress: tqdm
+) -> list[pystac.Item]:
+    items, timings = result
+    for name, seconds in timings.items():
+        metrics.count(name, seconds)
+    metrics.count("stac_items", len(items))
+    progress.update(len(items))
+    return items
+
+
+def _chunk_image_groups(
+    table: pd.DataFrame, faces: pd.DataFrame, chunk_size: int
+) -> Iterator[tuple[pd.DataFrame, pd.DataFrame]]:
+    faces = faces[["sensor_id", "path", "rx_rad", "ry_rad", "rz_rad"]]
+    for chunk_start in range(0, len(table), chunk_size):
+        groups = table.iloc[chunk_start : chunk_start + chunk_size].copy()
+        face_start, face_end = groups["start"].iloc[0], groups["end"].iloc[-1]
+        groups["start"] -= face_start
+        groups["end"] -= face_start
+        yield groups, faces.iloc[face_start:face_end]
+
+
+def iter_stac_image_items(
+    raw_image_groups: ImageGroups,
+    trajectories: dict[int, TrajectoryMeta],
+    validation: Validation = Validation.full,
+    sample_every: int = 100,
+    workers: int = 1,
+    chunk_size: int = 5000,
+) -> Iterator[pystac.Item]:
+    """Yield items in image group order, built by ``workers`` processes."""
+    table = image_group_table(raw_image_groups, trajectories)
+    chunks = (
+        (groups, faces, validation, sample_every)
+        for groups, faces in _chunk_image_groups(
+            table, raw_image_groups.faces, chunk_size
+        )
+    )
+    with tqdm(desc="Processing image groups...", total=len(table)) as progress:
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                # Keep a bounded number of chunks in flight, so items are
+                # consumed about as fast as they are produced.
+                pending = deque()
+                for chunk in chunks:
+                    pending.append(executor.submit(_create_items_chunk, chunk))
+                    if len(pending) >= 2 * workers:
+                        yield from _finish_chunk(pending.popleft().result(), progress)
+                while pending:
+                    yield from _finish_chunk(pending.popleft().result(), progress)
+        else:
+            for chunk in chunks:
+                yield from _finish_chunk(_create_items_chunk(chunk), progress)
+
 
-    collection = pystac.Collection(
+def create_stac_image_items(
+    raw_image_groups: ImageGroups,
+    trajectories: dict[int, TrajectoryMeta],
+    validation: Validation = Validation.full,
+    workers: int = 1,
+) -> list[pystac.Item]:
+    return list(
+        iter_stac_image_items(
+            raw_image_groups, trajectories, validation=validation, workers=workers
+        )
+    )
+
+
+def image_collection(title: str, extent: pystac.Extent) -> pystac.Collection:
+    return pystac.Collection(
         id=title,
         title=title,
-        extent=collection_extent,
+        extent=extent,
         license="CC-BY-4.0",
         description="Kappazunder image panorama data. Source: https://www.data.gv.at/katalog/dataset/566c8d52-b6f8-48b9-921e-856ba5be392d#additional-info",
         providers=[
@@ -192,11 +383,248 @@ def images(input_dir: Path, title: str = "Kappazunder data extract") -> None:
             ),
         ],
     )
-    
+
+
+@metrics.timed("write_stac_items")
+def write_stac_image_items(
+    items: Iterable[pystac.Item],
+    title: str,
+    output_dir: Path,
+    output_format: OutputFormat,
+    row_group_size: int = 10000,
+) -> pystac.Collection:
+    """Stream items to a single NDJSON/stac-geoparquet file next to the collection."""
+    output_dir.mkdir(parents=True, exist_ok=True)
+    extent = ExtentAccumulator()
+    writer = item_writer(
+        output_format,
+        output_dir / ITEMS_FILE[output_format],
+        title,
+        row_group_size,
+        IMAGE_ITEM_SCHEMA,
+    )
+    try:
+        for item in items:
+            extent.update(item)
+            writer.write(item)
+    finally:
+        writer.close()
+
+    collection = image_collection(title, extent.to_extent())
+    add_items_asset(collection, output_format)
+    collection.validate()
+    collection.save_object(
+        include_self_link=False, dest_href=str(output_dir / "collection.json")
+    )
+    return collection
+
+
+def update_stac_image_items(
+    kappa_paths: list[KappazunderPath],
+    raw_image_groups: ImageGroups,
+    trajectories: dict[int, TrajectoryMeta],
+    title: str,
+    output_dir: Path,
+    output_format: OutputFormat,
+    row_group_size: int = 10000,
+    **item_options,
+) -> pystac.Collection:
+    """Rebuild only the per-trajectory item files whose inputs changed.
+
+    Items of every trajectory go to ``items/<trajectory_id>.<format>``,
+    ``manifest.json`` records the inputs each file was built from.
+    """
+    items_dir = output_dir / "items"
+    items_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = output_dir / "manifest.json"
+    manifest = BuildManifest.load(manifest_path)
+    params = {
+        "title": title,
+        "extracts": [str(kappa_path.base_dir.absolute()) for kappa_path in kappa_paths],
+        "output_format": output_format.value,
+    }
+    if manifest.params != params:
+        for path in items_dir.iterdir():
+            path.unlink()
+        manifest = BuildManifest(params=params)
+
+    inputs = trajectory_inputs(raw_image_groups, trajectories)
+    for trajectory_id in set(manifest.trajectories) - set(inputs):
+        build = manifest.trajectories.pop(trajectory_id)
+        (output_dir / build.items_file).unlink(missing_ok=True)
+    changed = [
+        trajectory_id
+        for trajectory_id, trajectory_inputs_ in inputs.items()
+        if trajectory_id not in manifest.trajectories
+        or manifest.trajectories[trajectory_id].inputs != trajectory_inputs_
+    ]
+    print(f"Rebuilding {len(changed)} of {len(inputs)} trajectories")
+
+    faces = raw_image_groups.faces
+    changed_groups = ImageGroups.from_faces(
+        faces[faces["trajectory_id"].isin(changed)], by=["trajectory_id", "id"]
+    )
+    items = iter_stac_image_items(changed_groups, trajectories, **item_options)
+    suffix = Path(ITEMS_FILE[output_format]).suffix
+    for trajectory_id, trajectory_items in groupby(
+        items, key=lambda item: item.properties["trajectory_id"]
+    ):
+        items_file = f"items/{trajectory_id}{suffix}"
+        extent = ExtentAccumulator()
+        item_count = 0
+        writer = item_writer(
+            output_format,
+            output_dir / items_file,
+            title,
+            row_group_size,
+            IMAGE_ITEM_SCHEMA,
+            collection_href="../collection.json",
+        )
+        try:
+            for item in trajectory_items:
+                extent.update(item)
+                writer.write(item)
+                item_count += 1
+        finally:
+            writer.close()
+        image_meta_hash, trajectory_hash = inputs[trajectory_id]
+        manifest.trajectories[trajectory_id] = TrajectoryBuild(
+            image_meta_hash=image_meta_hash,
+            trajectory_hash=trajectory_hash,
+            items_file=items_file,
+            item_count=item_count,
+            bbox=extent.bbox,
+            start=extent.start,
+            end=extent.end,
+        )
+        # Saved per trajectory, so an interrupted run keeps what it finished.
+        manifest.save(manifest_path)
+    manifest.save(manifest_path)
+
+    extent = ExtentAccumulator()
+    for build in manifest.trajectories.values():
+        extent.merge(build.extent())
+    collection = image_collection(title, extent.to_extent())
+    add_items_asset(collection, output_format, href="./items/")
+    collection.validate()
+    collection.save_object(
+        include_self_link=False, dest_href=str(output_dir / "collection.json")
+    )
+    return collection
+
+
+@stac_cli.command(name='images')
+def images(
+    input_dir: list[Path],
+    title: str = "Kappazunder data extract",
+    validate_metadata: bool = typer.Option(
+        False, help="Check image_meta.txt against the image metadata schema."
+    ),
+    workers: int = typer.Option(
+        1, help="Processes reading extracts and building STAC items, over all extracts."
+    ),
+    on_duplicate: OnDuplicate = typer.Option(
+        OnDuplicate.first,
+        help="Keep the first of image groups or trajectories found in several extracts, or fail.",
+    ),
+    validation: Validation = typer.Option(
+        Validation.full,
+        help="Validate every item, a sample of 1 in --sample-every items, "
+        "or once per distinct item structure.",
+    ),
+    sample_every: int = typer.Option(100, min=1, help="Sampling rate of sample validation."),
+    output_format: OutputFormat = typer.Option(
+        OutputFormat.json,
+        help="One JSON file per item, or items streamed into a single NDJSON/stac-geoparquet file.",
+    ),
+    output_dir: Path = OUTPUT_PATH / "stac" / "images",
+    row_group_size: int = typer.Option(10000, help="Items per stac-geoparquet row group."),
+    incremental: bool = typer.Option(
+        False,
+        help="Write items per trajectory and rebuild only trajectories "
+        "whose image metadata or trajectory file changed since the last build.",
+    ),
+) -> None:
+    """Create one STAC collection from the images of one or more extracts."""
+    kappa_paths = extract_paths(input_dir)
+    raw_image_groups, trajectories = extract_metadata(
+        kappa_paths, workers, validate=validate_metadata, on_duplicate=on_duplicate
+    )
+    for kappa_path in kappa_paths:
+        index = kappa_path.file_index()
+        if index is None:
+            continue
+        paths = raw_image_groups.faces["path"]
+        paths = paths[paths.str.startswith(f"{kappa_path.raw_images_dir}/")]
+        missing = int((~index.exists(paths)).sum())
+        if missing:
+            print(f"{missing} of {len(paths)} image faces are missing from {kappa_path.base_dir}")
+
+    item_options = dict(
+        validation=validation, sample_every=sample_every, workers=workers
+    )
+    if incremental:
+        if output_format == OutputFormat.json:
+            raise typer.BadParameter(
+                "Incremental builds need --output-format ndjson or geoparquet",
+                param_hint="--incremental",
+            )
+        update_stac_image_items(
+            kappa_paths,
+            raw_image_groups,
+            trajectories,
+            title,
+            output_dir,
+            output_format,
+            row_group_size,
+            **item_options,
+        )
+        return
+
+    items = iter_stac_image_items(raw_image_groups, trajectories, **item_options)
+    if output_format != OutputFormat.json:
+        write_stac_image_items(items, title, output_dir, output_format, row_group_size)
+        return
+
+    spatial_extent = pystac.SpatialExtent([[-180.0, -90.0, 180.0, 90.0]])
+    temporal_extent = pystac.TemporalExtent([[datetime(1970, 1, 1), None]])
+    collection_extent = pystac.Extent(spatial_extent, temporal_extent)
+
+    collection = image_collection(title, collection_extent)
 
     collection.add_items(tqdm(items, desc="Constructing STAC collection..."))
     collection.update_extent_from_items()
-    collection.normalize_hrefs('./output/stac/images')
-    collection.validate_all()
+    collection.normalize_hrefs(str(output_dir))
+    collection.validate()
     
     collection.save(catalog_type=pystac.CatalogType.SELF_CONTAINED)
+
+
+@stac_cli.command(name="index")
+def index(
+    stac_dir: Path = typer.Argument(
+        OUTPUT_PATH / "stac" / "images", help="Output of `kappa stac images`, any format."
+    ),
+    index_path: Path = OUTPUT_PATH / "stac" / "items.sqlite",
+):
+    """Load generated STAC items into a SQLite index for bbox, time and trajectory search."""
+    from kappa.stac_index import build_stac_index
+
+    count = build_stac_index(stac_dir, index_path)
+    print(f"Indexed {count} items in {index_path}")
+
+
+@stac_cli.command()
+def serve(
+    index_path: Path = OUTPUT_PATH / "stac" / "items.sqlite",
+    host: str = "127.0.0.1",
+    port: int = 8000,
+):
+    """Serve STAC API item search from an index built by `kappa stac index`."""
+    from http.server import ThreadingHTTPServer
+
+    from kappa.stac_index import StacIndex, stac_api_handler
+
+    server = ThreadingHTTPServer((host, port), stac_api_handler(StacIndex(index_path)))
+    print(f"Serving {index_path} on http://{host}:{port}/search")
+    server.serve_forever()
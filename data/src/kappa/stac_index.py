@@ -0,0 +1,362 @@
+import sqlite3
+from contextlib import closing
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler
+from itertools import islice
+from pathlib import Path
+from typing import Iterator
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import orjson as json
+from tqdm import tqdm
+
+from kappa import metrics
+from kappa.stac_io import read_geoparquet_items
+
+STAC_INDEX_VERSION = 1
+STAC_API_VERSION = "1.0.0"
+CONFORMANCE = [
+    "https://api.stacspec.org/v1.0.0/core",
+    "https://api.stacspec.org/v1.0.0/item-search",
+]
+MAX_LIMIT = 10_000
+
+# Bounding boxes are kept next to the item as well, the R-tree stores them
+# rounded outwards to 32 bit floats and only narrows down the candidates.
+SCHEMA = """
+CREATE TABLE items (
+    rowid INTEGER PRIMARY KEY,
+    id TEXT NOT NULL,
+    collection TEXT,
+    trajectory_id INTEGER,
+    datetime_us INTEGER,
+    xmin REAL NOT NULL,
+    ymin REAL NOT NULL,
+    xmax REAL NOT NULL,
+    ymax REAL NOT NULL,
+    item BLOB NOT NULL
+);
+CREATE UNIQUE INDEX items_id ON items (collection, id);
+CREATE VIRTUAL TABLE items_bbox USING rtree(id, xmin, xmax, ymin, ymax);
+"""
+# Created after loading, which is faster than updating them row by row.
+INDEXES = """
+INSERT INTO items_bbox SELECT rowid, xmin, xmax, ymin, ymax FROM items;
+CREATE INDEX items_trajectory ON items (trajectory_id, datetime_us);
+CREATE INDEX items_datetime ON items (datetime_us);
+"""
+
+
+def _time_us(value: str) -> int:
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp() * 1_000_000)
+
+
+def datetime_range(value: str | None) -> tuple[int | None, int | None]:
+    """Microsecond bounds of a STAC datetime, an instant or an interval with open ends."""
+    if not value:
+        return None, None
+    start, _, end = value.partition("/") if "/" in value else (value, "", value)
+    return (
+        _time_us(start) if start not in ("", "..") else None,
+        _time_us(end) if end not in ("", "..") else None,
+    )
+
+
+def iter_item_records(stac_dir: Path) -> Iterator[dict]:
+    """Items written by `kappa stac images`, in any of its output formats."""
+    for path in sorted(stac_dir.rglob("*")):
+        match path.suffix:
+            case ".ndjson":
+                with path.open("rb") as f:
+                    yield from (json.loads(line) for line in f if line.strip())
+            case ".parquet":
+                yield from read_geoparquet_items(path)
+            case ".json":
+                record = json.loads(path.read_bytes())
+                if isinstance(record, dict) and record.get("type") == "Feature":
+                    yield record
+
+
+def _item_row(record: dict) -> tuple:
+    properties = record.get("properties", {})
+    bbox = record["bbox"]
+    return (
+        record["id"],
+        record.get("collection"),
+        properties.get("trajectory_id"),
+        _time_us(properties["datetime"]) if properties.get("datetime") else None,
+        bbox[0],
+        bbox[1],
+        bbox[-2],
+        bbox[-1],
+        json.dumps(record),
+    )
+
+
+def _check_duplicates(db: sqlite3.Connection, rows: list[tuple]) -> None:
+    """Raise ValueError for items whose id is taken by an item with other content.
+
+    The same item in more than one file, e.g. left over from an earlier
+    build in another format, is indexed once.
+    """
+    for item_id, collection, *_, item in rows:
+        (indexed,) = db.execute(
+            "SELECT item FROM items WHERE collection IS ? AND id = ?", (collection, item_id)
+        ).fetchone()
+        if indexed != item and json.dumps(
+            json.loads(indexed), option=json.OPT_SORT_KEYS
+        ) != json.dumps(json.loads(item), option=json.OPT_SORT_KEYS):
+            raise ValueError(f"Different items of collection {collection} share the id {item_id}")
+
+
+@metrics.timed("stac_index_build", items=lambda count: count)
+def build_stac_index(stac_dir: Path, index_path: Path, batch_size: int = 10_000) -> int:
+    """Load every item below ``stac_dir`` into a new index, returns the item count.
+
+    The index is written next to ``index_path`` and moved into place when
+    complete, a running server keeps answering from the previous one.
+    """
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = index_path.with_suffix(".tmp")
+    tmp_path.unlink(missing_ok=True)
+    with closing(sqlite3.connect(tmp_path)) as db:
+        db.execute(f"PRAGMA user_version = {STAC_INDEX_VERSION}")
+        db.executescript(SCHEMA)
+        records = tqdm(iter_item_records(stac_dir), desc="Indexing STAC items...", unit="items")
+        while batch := list(islice(records, batch_size)):
+            rows = list(map(_item_row, batch))
+            changes = db.total_changes
+            db.executemany(
+                "INSERT OR IGNORE INTO items "
+                "(id, collection, trajectory_id, datetime_us, xmin, ymin, xmax, ymax, item) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            if db.total_changes - changes < len(rows):
+                _check_duplicates(db, rows)
+        db.executescript(INDEXES)
+        db.commit()
+        count = db.execute("SELECT count(*) FROM items").fetchone()[0]
+    tmp_path.replace(index_path)
+    return count
+
+
+@dataclass
+class SearchPage:
+    # Items as stored, encoded JSON.
+    features: list[bytes]
+    # Pass as ``token`` to get the next page, None on the last one.
+    next_token: str | None
+
+
+class StacIndex:
+    """Search over an index written by `build_stac_index`.
+
+    Results are in the order items were indexed and paged by the last
+    returned row, so later pages are as fast as the first.
+    """
+
+    def __init__(self, path: Path):
+        if not path.exists():
+            raise FileNotFoundError(f"No STAC index at {path}, run `kappa stac index` first")
+        self.path = path
+
+    def connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        if db.execute("PRAGMA user_version").fetchone()[0] != STAC_INDEX_VERSION:
+            db.close()
+            raise ValueError(f"{self.path} was built by another version, rebuild it")
+        return db
+
+    def query(
+        self,
+        bbox: list[float] | None = None,
+        datetime: str | None = None,
+        trajectory_ids: list[int] | None = None,
+        ids: list[str] | None = None,
+        collections: list[str] | None = None,
+        limit: int = 10,
+        token: str | None = None,
+    ) -> SearchPage:
+        """Items matching every given filter, ``bbox`` in WGS84 as in STAC API item search."""
+        where, params = [], []
+        if bbox is not None:
+            if len(bbox) not in (4, 6):
+                raise ValueError("bbox needs 4 or 6 numbers")
+            # Heights of 3D boxes are ignored.
+            xmin, ymin, xmax, ymax = bbox[:2] + bbox[-3:-1] if len(bbox) == 6 else bbox
+            where.append(
+                "rowid IN (SELECT id FROM items_bbox"
+                " WHERE xmin <= ? AND xmax >= ? AND ymin <= ? AND ymax >= ?)"
+            )
+            where.append("xmin <= ? AND xmax >= ? AND ymin <= ? AND ymax >= ?")
+            params += [xmax, xmin, ymax, ymin] * 2
+        start, end = datetime_range(datetime)
+        if start is not None:
+            where.append("datetime_us >= ?")
+            params.append(start)
+        if end is not None:
+            where.append("datetime_us <= ?")
+            params.append(end)
+        for column, values in (
+            ("trajectory_id", trajectory_ids),
+            ("id", ids),
+            ("collection", collections),
+        ):
+            if values:
+                where.append(f"{column} IN ({', '.join('?' * len(values))})")
+                params += values
+        if token:
+            where.append("rowid > ?")
+            params.append(int(token))
+        limit = max(1, min(limit, MAX_LIMIT))
+        with closing(self.connect()) as db:
+            rows = db.execute(
+                f"SELECT rowid, item FROM items WHERE {' AND '.join(where) or '1'}"
+                " ORDER BY rowid LIMIT ?",
+                [*params, limit + 1],
+            ).fetchall()
+        next_token = str(rows[limit - 1][0]) if len(rows) > limit else None
+        return SearchPage([item for _, item in rows[:limit]], next_token)
+
+    def search(self, **filters) -> tuple[list[dict], str | None]:
+        """Same as `query`, with decoded items."""
+        page = self.query(**filters)
+        return [json.loads(item) for item in page.features], page.next_token
+
+
+def _split(value: str | None) -> list[str] | None:
+    return value.split(",") if value else None
+
+
+def search_params(query: dict[str, str]) -> dict:
+    """`StacIndex.query` arguments from GET /search parameters."""
+    trajectory_ids = _split(query.get("trajectory_id"))
+    bbox = _split(query.get("bbox"))
+    return {
+        "bbox": [float(value) for value in bbox] if bbox else None,
+        "datetime": query.get("datetime"),
+        "trajectory_ids": [int(value) for value in trajectory_ids] if trajectory_ids else None,
+        "ids": _split(query.get("ids")),
+        "collections": _split(query.get("collections")),
+        "limit": int(query.get("limit", 10)),
+        "token": query.get("token"),
+    }
+
+
+def search_body_params(body: dict) -> dict:
+    """`StacIndex.query` arguments from a POST /search body."""
+    trajectory_ids = body.get("trajectory_id")
+    if isinstance(trajectory_ids, int):
+        trajectory_ids = [trajectory_ids]
+    return {
+        "bbox": body.get("bbox"),
+        "datetime": body.get("datetime"),
+        "trajectory_ids": trajectory_ids,
+        "ids": body.get("ids"),
+        "collections": body.get("collections"),
+        "limit": int(body.get("limit", 10)),
+        "token": body.get("token"),
+    }
+
+
+def stac_api_handler(index: StacIndex) -> type[BaseHTTPRequestHandler]:
+    """Serves a STAC API landing page, ``/conformance`` and item search at ``/search``.
+
+    Besides the standard parameters, search takes ``trajectory_id``, one id or
+    a comma separated list.
+    """
+
+    class StacApiHandler(BaseHTTPRequestHandler):
+        def base_url(self) -> str:
+            return f"http://{self.headers.get('Host', 'localhost')}"
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            match url.path.rstrip("/"):
+                case "":
+                    return self.reply(200, self.landing_page())
+                case "/conformance":
+                    return self.reply(200, {"conformsTo": CONFORMANCE})
+                case "/search":
+                    query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                    return self.search(query, search_params)
+            self.reply(404, {"code": "NotFound", "description": "Not found"})
+
+        def do_POST(self):
+            if urlsplit(self.path).path.rstrip("/") != "/search":
+                return self.reply(404, {"code": "NotFound", "description": "Not found"})
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            except json.JSONDecodeError as e:
+                return self.reply(400, {"code": "BadRequest", "description": str(e)})
+            if not isinstance(body, dict):
+                return self.reply(
+                    400, {"code": "BadRequest", "description": "Search body must be a JSON object"}
+                )
+            self.search(body, search_body_params, post=True)
+
+        def search(self, request: dict, params, post: bool = False) -> None:
+            try:
+                page = index.query(**params(request))
+            except (KeyError, TypeError, ValueError) as e:
+                return self.reply(400, {"code": "BadRequest", "description": f"Bad request: {e}"})
+            links = [{"rel": "root", "href": f"{self.base_url()}/", "type": "application/json"}]
+            if page.next_token is not None:
+                next_request = {**request, "token": page.next_token}
+                link = {"rel": "next", "type": "application/geo+json"}
+                if post:
+                    link |= {"href": f"{self.base_url()}/search", "method": "POST", "body": next_request}
+                else:
+                    link["href"] = f"{self.base_url()}/search?{urlencode(next_request)}"
+                links.append(link)
+            # Stored items are passed through without decoding them.
+            body = b"".join(
+                [
+                    b'{"type":"FeatureCollection","features":[',
+                    b",".join(page.features),
+                    b'],"numberReturned":',
+                    str(len(page.features)).encode(),
+                    b',"links":',
+                    json.dumps(links),
+                    b"}",
+                ]
+            )
+            self.send(200, body, "application/geo+json")
+
+        def landing_page(self) -> dict:
+            base_url = self.base_url()
+            return {
+                "type": "Catalog",
+                "id": "kappa",
+                "stac_version": STAC_API_VERSION,
+                "description": "Kappazunder STAC items",
+                "conformsTo": CONFORMANCE,
+                "links": [
+                    {"rel": "self", "href": f"{base_url}/", "type": "application/json"},
+                    {"rel": "root", "href": f"{base_url}/", "type": "application/json"},
+                    {"rel": "conformance", "href": f"{base_url}/conformance", "type": "application/json"},
+                    {"rel": "search", "href": f"{base_url}/search", "type": "application/geo+json", "method": "GET"},
+                    {"rel": "search", "href": f"{base_url}/search", "type": "application/geo+json", "method": "POST"},
+                ],
+            }
+
+        def reply(self, status: int, body) -> None:
+            self.send(status, json.dumps(body), "application/json")
+
+        def send(self, status: int, data: bytes, content_type: str) -> None:
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("Access-Control-Allow-Origin", "*")
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StacApiHandler
@@ -0,0 +1,280 @@
+from datetime import datetime
+from enum import Enum
+from pathlib import Path
+from typing import Iterator
+
+import orjson as json
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pystac
+import shapely
+from shapely.geometry import mapping, shape
+
+STAC_GEOPARQUET_VERSION = "1.0.0"
+
+
+class OutputFormat(str, Enum):
+    json = "json"
+    ndjson = "ndjson"
+    geoparquet = "geoparquet"
+
+
+ITEMS_FILE = {
+    OutputFormat.ndjson: "items.ndjson",
+    OutputFormat.geoparquet: "items.parquet",
+}
+ITEMS_MEDIA_TYPE = {
+    OutputFormat.ndjson: "application/x-ndjson",
+    OutputFormat.geoparquet: "application/vnd.apache.parquet",
+}
+
+
+class ExtentAccumulator:
+    """Collection extent, updated one item at a time."""
+
+    def __init__(self):
+        self.bbox = [float("inf"), float("inf"), float("-inf"), float("-inf")]
+        self.start: datetime | None = None
+        self.end: datetime | None = None
+
+    def update(self, item: pystac.Item) -> None:
+        xmin, ymin, xmax, ymax = item.bbox[0], item.bbox[1], item.bbox[-2], item.bbox[-1]
+        self.bbox = [
+            min(self.bbox[0], xmin),
+            min(self.bbox[1], ymin),
+            max(self.bbox[2], xmax),
+            max(self.bbox[3], ymax),
+        ]
+        if self.start is None or item.datetime < self.start:
+            self.start = item.datetime
+        if self.end is None or item.datetime > self.end:
+            self.end = item.datetime
+
+    def merge(self, other: "ExtentAccumulator") -> None:
+        self.bbox = [
+            min(self.bbox[0], other.bbox[0]),
+            min(self.bbox[1], other.bbox[1]),
+            max(self.bbox[2], other.bbox[2]),
+            max(self.bbox[3], other.bbox[3]),
+        ]
+        for value in (other.start, other.end):
+            if value is None:
+                continue
+            if self.start is None or value < self.start:
+                self.start = value
+            if self.end is None or value > self.end:
+                self.end = value
+
+    def to_extent(self) -> pystac.Extent:
+        bbox = self.bbox if self.start is not None else [-180.0, -90.0, 180.0, 90.0]
+        return pystac.Extent(
+            pystac.SpatialExtent([bbox]),
+            pystac.TemporalExtent([[self.start, self.end]]),
+        )
+
+
+def item_record(
+    item: pystac.Item, collection_id: str, collection_href: str = "./collection.json"
+) -> dict:
+    """Item dict linking to its collection at ``collection_href``, relative to the items file."""
+    item.collection_id = collection_id
+    record = item.to_dict(include_self_link=False, transform_hrefs=False)
+    record["links"] = [
+        {"rel": "collection", "href": collection_href, "type": "application/json"}
+    ]
+    return record
+
+
+def geo_metadata(column: str, geometry_types: set[str], crs: dict | None = None) -> dict:
+    """GeoParquet file metadata of a single WKB geometry column, OGC:CRS84 without ``crs``."""
+    metadata = {"encoding": "WKB", "geometry_types": sorted(geometry_types)}
+    if crs is not None:
+        metadata["crs"] = crs
+    return {"version": "1.1.0", "primary_column": column, "columns": {column: metadata}}
+
+
+class NdjsonItemWriter:
+    def __init__(self, path: Path, collection_id: str, collection_href: str = "./collection.json"):
+        self.collection_id = collection_id
+        self.collection_href = collection_href
+        self.file = path.open("wb")
+
+    def write(self, item: pystac.Item) -> None:
+        self.file.write(json.dumps(item_record(item, self.collection_id, self.collection_href)))
+        self.file.write(b"\n")
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class GeoParquetItemWriter:
+    """Items as stac-geoparquet, ``row_group_size`` items per row group.
+
+    The file schema is fixed by the first row group, merged with ``schema``,
+    which should list fields only some items have, like optional assets.
+    A later row group with fields outside the file schema raises ValueError.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        collection_id: str,
+        row_group_size: int = 10000,
+        schema: pa.Schema | None = None,
+        collection_href: str = "./collection.json",
+    ):
+        self.path = path
+        self.collection_id = collection_id
+        self.collection_href = collection_href
+        self.row_group_size = row_group_size
+        self.known_schema = schema
+        self.rows: list[dict] = []
+        self.geometry_types: set[str] = set()
+        self.schema: pa.Schema | None = None
+        self.writer: pq.ParquetWriter | None = None
+
+    def write(self, item: pystac.Item) -> None:
+        record = item_record(item, self.collection_id, self.collection_href)
+        properties = record.pop("properties")
+        properties["datetime"] = item.datetime
+        geometry = shape(record["geometry"])
+        self.geometry_types.add(geometry.geom_type + (" Z" if geometry.has_z else ""))
+        bbox = record["bbox"]
+        self.rows.append(
+            {
+                **record,
+                **properties,
+                "geometry": geometry,
+                "bbox": {
+                    "xmin": bbox[0],
+                    "ymin": bbox[1],
+                    "xmax": bbox[-2],
+                    "ymax": bbox[-1],
+                },
+            }
+        )
+        if len(self.rows) >= self.row_group_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.rows:
+            return
+        geometries = shapely.to_wkb([row.pop("geometry") for row in self.rows])
+        for row, geometry in zip(self.rows, geometries):
+            row["geometry"] = geometry
+        table = pa.Table.from_pylist(self.rows)
+        if self.schema is None:
+            schemas = [table.schema, self.known_schema] if self.known_schema else [table.schema]
+            self.schema = _fill_null_types(unify_schemas(schemas))
+            self.writer = pq.ParquetWriter(self.path, self.schema)
+        if table.schema != self.schema:
+            try:
+                fits = unify_schemas([self.schema, table.schema]) == self.schema
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                fits = False
+            if not fits:
+                raise ValueError(
+                    f"Items of {self.path} do not fit the schema of its first "
+                    f"{self.row_group_size} items:\n{table.schema}"
+                )
+            table = pa.Table.from_pylist(self.rows, schema=self.schema)
+        self.writer.write_table(table, row_group_size=self.row_group_size)
+        self.rows = []
+
+    def close(self) -> None:
+        self.flush()
+        if self.writer is None:
+            return
+        self.writer.add_key_value_metadata(
+            {
+                "geo": json.dumps(geo_metadata("geometry", self.geometry_types)),
+                "stac-geoparquet": json.dumps({"version": STAC_GEOPARQUET_VERSION}),
+            }
+        )
+        self.writer.close()
+
+
+ITEM_KEYS = {
+    "type",
+    "stac_version",
+    "stac_extensions",
+    "id",
+    "geometry",
+    "bbox",
+    "links",
+    "assets",
+    "collection",
+}
+
+
+def _drop_nulls(value):
+    """Struct columns give every row every field, absent ones as null."""
+    if isinstance(value, dict):
+        return {key: _drop_nulls(v) for key, v in value.items() if v is not None}
+    if isinstance(value, list):
+        return [_drop_nulls(v) for v in value]
+    return value
+
+
+def read_geoparquet_items(path: Path, batch_size: int = 10000) -> Iterator[dict]:
+    """Item dicts back from a file written by `GeoParquetItemWriter`."""
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+        rows = batch.to_pylist()
+        geometries = shapely.from_wkb([row["geometry"] for row in rows])
+        for row, geometry in zip(rows, geometries):
+            bbox = row.pop("bbox")
+            record = {key: row.pop(key) for key in ITEM_KEYS & row.keys()}
+            record["geometry"] = mapping(geometry)
+            record["bbox"] = [bbox["xmin"], bbox["ymin"], bbox["xmax"], bbox["ymax"]]
+            if isinstance(row.get("datetime"), datetime):
+                row["datetime"] = row["datetime"].isoformat().replace("+00:00", "Z")
+            record["properties"] = _drop_nulls(row)
+            record["assets"] = _drop_nulls(record.get("assets") or {})
+            yield record
+
+
+def unify_schemas(schemas: list[pa.Schema]) -> pa.Schema:
+    """Fields of all schemas, struct fields merged and null columns typed by the others."""
+    return pa.unify_schemas(schemas, promote_options="permissive")
+
+
+def _fill_null_types(schema: pa.Schema) -> pa.Schema:
+    """Type columns that were empty in the first row group as strings."""
+    for i, field in enumerate(schema):
+        if pa.types.is_null(field.type):
+            schema = schema.set(i, field.with_type(pa.string()))
+        elif pa.types.is_list(field.type) and pa.types.is_null(field.type.value_type):
+            schema = schema.set(i, field.with_type(pa.list_(pa.string())))
+    return schema
+
+
+def item_writer(
+    output_format: OutputFormat,
+    path: Path,
+    collection_id: str,
+    row_group_size: int = 10000,
+    schema: pa.Schema | None = None,
+    collection_href: str = "./collection.json",
+) -> NdjsonItemWriter | GeoParquetItemWriter:
+    match output_format:
+        case OutputFormat.ndjson:
+            return NdjsonItemWriter(path, collection_id, collection_href)
+        case OutputFormat.geoparquet:
+            return GeoParquetItemWriter(
+                path, collection_id, row_group_size, schema, collection_href
+            )
+    raise ValueError(f"{output_format.value} output is not streamed")
+
+
+def add_items_asset(
+    collection: pystac.Collection, output_format: OutputFormat, href: str | None = None
+) -> None:
+    collection.add_asset(
+        "items",
+        pystac.Asset(
+            href=href or f"./{ITEMS_FILE[output_format]}",
+            media_type=ITEMS_MEDIA_TYPE[output_format],
+            roles=["collection-mirror"],
+            title="Collection items",
+        ),
+    )
@@ -0,0 +1,264 @@
+import io
+import shutil
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+import laspy
+import numpy as np
+import orjson as json
+import pandas as pd
+from PIL import Image
+from tqdm import tqdm
+
+from kappa.metadata import DIRECTION_LABELS, IMAGE_META_DTYPES
+from kappa.paths import KappazunderPath
+from kappa.trajectory import TRAJECTORY_COLUMNS, Trajectory, euler_to_matrix, matrix_to_euler
+
+SYNTHETIC_CONFIG = "synthetic.json"
+# Roughly the extent of Vienna in EPSG:31256.
+BOUNDS = (-10_000.0, 335_000.0, 8_000.0, 350_000.0)
+FIRST_TRAJECTORY_ID = 16642
+FIRST_IMAGE_ID = 1_000_000
+CAMERA_SENSOR_IDS = 110030 + np.arange(len(DIRECTION_LABELS))
+SCAN_SENSOR_ID = 11003
+# Face orientation relative to the platform, by direction label. Faces look
+# along their negative z axis, the platform's y axis points forward.
+FACE_ANGLES = {
+    "up": (np.pi, 0.0, 0.0),
+    "front": (np.pi / 2, 0.0, 0.0),
+    "right": (np.pi / 2, 0.0, np.pi / 2),
+    "back": (np.pi / 2, 0.0, np.pi),
+    "left": (np.pi / 2, 0.0, 3 * np.pi / 2),
+    "down": (0.0, 0.0, 0.0),
+}
+# Distinct per face, so colorized points show which face they came from.
+FACE_COLORS = {
+    "up": (135, 190, 235),
+    "front": (200, 80, 60),
+    "right": (80, 160, 70),
+    "back": (210, 190, 60),
+    "left": (140, 90, 180),
+    "down": (70, 70, 70),
+}
+
+
+@dataclass
+class SyntheticOptions:
+    images: int = 10_000
+    trajectories: int = 4
+    scans_per_trajectory: int = 2
+    points_per_scan: int = 100_000
+    # Edge of the written JPEG faces in pixels, no faces are written when 0.
+    face_size: int = 64
+    image_interval_s: float = 0.5
+    trajectory_rate_hz: float = 10.0
+    speed_m_s: float = 8.0
+    gps_week: int = 2111
+    epsg: int = 31256
+    seed: int = 0
+
+
+def image_name(image_id: int) -> str:
+    """Image names like the delivered ones, e.g. WE1JWVM8.jpg."""
+    return f"WE{np.base_repr(image_id, 36)}.jpg"
+
+
+def fold(values: np.ndarray, low: float, high: float) -> np.ndarray:
+    """Reflect values into [low, high], keeping long walks inside the bounds."""
+    width = high - low
+    return low + width - np.abs(np.mod(values - low, 2 * width) - width)
+
+
+def synthetic_trajectory(
+    rng: np.random.Generator, start_epoch: float, duration_s: float, options: SyntheticOptions
+) -> np.ndarray:
+    """Samples of a smooth random drive, columns as in `TRAJECTORY_COLUMNS`."""
+    n = max(int(duration_s * options.trajectory_rate_hz), 2)
+    dt = duration_s / (n - 1)
+    epochs = start_epoch + dt * np.arange(n)
+    heading = rng.uniform(0, 2 * np.pi) + np.cumsum(rng.normal(0, 0.05 * np.sqrt(dt), n))
+    step = options.speed_m_s * dt
+    min_x, min_y, max_x, max_y = BOUNDS
+    x = fold(rng.uniform(min_x, max_x) + np.cumsum(step * np.sin(heading)), min_x, max_x)
+    y = fold(rng.uniform(min_y, max_y) + np.cumsum(step * np.cos(heading)), min_y, max_y)
+    z = 170 + np.cumsum(rng.normal(0, 0.01, n))
+    rx, ry = rng.normal(0, 0.01, (2, n))
+    deviations = np.tile([0.02, 0.02, 0.03, 0.0005, 0.0005, 0.001], (n, 1))
+    return np.column_stack(
+        [epochs, x, y, z, rx, ry, np.mod(heading, 2 * np.pi), deviations]
+    )
+
+
+def face_jpegs(size: int) -> dict[str, bytes]:
+    """One encoded JPEG per direction label, reused for every group."""
+    jpegs = {}
+    ramp = np.linspace(0.6, 1.0, size)[:, None, None]
+    for label, color in FACE_COLORS.items():
+        pixels = (ramp * np.array(color)[None, None]).astype(np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(np.broadcast_to(pixels, (size, size, 3)).copy()).save(buffer, "JPEG")
+        jpegs[label] = buffer.getvalue()
+    return jpegs
+
+
+def image_faces(
+    trajectory_id: int, trajectory: Trajectory, first_id: int, count: int, options: SyntheticOptions
+) -> pd.DataFrame:
+    """Six ``image_meta.txt`` rows per group, positions and attitudes from the trajectory."""
+    epochs = trajectory.epochs[0] + options.image_interval_s * (np.arange(count) + 0.5)
+    poses = trajectory.interpolate(epochs)
+    body = poses.matrices()
+    faces = []
+    for sensor_id, label in zip(CAMERA_SENSOR_IDS, DIRECTION_LABELS):
+        rx, ry, rz = matrix_to_euler(body @ euler_to_matrix(*FACE_ANGLES[label]))
+        faces.append(
+            pd.DataFrame(
+                {
+                    "trajectory_id": trajectory_id,
+                    "sensor_id": sensor_id,
+                    "image_id": first_id + np.arange(count),
+                    "epoch_s": epochs,
+                    "x_m": poses.positions[:, 0],
+                    "y_m": poses.positions[:, 1],
+                    "z_m": poses.positions[:, 2],
+                    "rx_rad": rx,
+                    "ry_rad": ry,
+                    "rz_rad": rz,
+                }
+            )
+        )
+    faces = pd.concat(faces).sort_values(["image_id", "sensor_id"], kind="stable")
+    faces["image_name"] = [image_name(i) for i in faces["image_id"]]
+    return faces[list(IMAGE_META_DTYPES)]
+
+
+def write_scan(
+    path: Path,
+    trajectory_id: int,
+    trajectory: Trajectory,
+    start: float,
+    end: float,
+    options: SyntheticOptions,
+    rng: np.random.Generator,
+) -> None:
+    """Points scattered around the platform between two epochs, LAS 1.4 PDRF 7."""
+    n = options.points_per_scan
+    epochs = np.sort(rng.uniform(start, end, n))
+    poses = trajectory.interpolate(epochs)
+    directions = rng.normal(size=(n, 3))
+    directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+    points = poses.positions + directions * rng.uniform(2, 30, (n, 1))
+    header = laspy.LasHeader(point_format=7, version="1.4")
+    header.scales = [0.001, 0.001, 0.001]
+    header.offsets = np.floor(points.min(axis=0))
+    las = laspy.LasData(header)
+    las.x, las.y, las.z = points.T
+    las.gps_time = epochs
+    las.point_source_id = np.full(n, trajectory_id, dtype=np.uint16)
+    las.intensity = rng.integers(0, 2**16, n, dtype=np.uint16)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    las.write(path)
+
+
+def generate_extract(base_dir: Path, options: SyntheticOptions) -> KappazunderPath:
+    """Write a Kappazunder shaped extract with ``options.images`` image groups.
+
+    Images are spread evenly over the trajectories, every trajectory has
+    ``options.scans_per_trajectory`` scan files splitting its time range.
+    """
+    rng = np.random.default_rng(options.seed)
+    kappa_path = KappazunderPath(base_dir)
+    for directory in [
+        kappa_path.image_metadata.parent,
+        kappa_path.trajectories_dir,
+        kappa_path.scan_metadata.parent,
+    ]:
+        directory.mkdir(parents=True, exist_ok=True)
+    jpegs = face_jpegs(options.face_size) if options.face_size else None
+    counts = np.diff(np.linspace(0, options.images, options.trajectories + 1).astype(int))
+    image_meta, scan_meta = [], []
+    first_id = FIRST_IMAGE_ID
+    for t, count in enumerate(tqdm(counts, desc="Generating trajectories...", unit="trajectory")):
+        trajectory_id = FIRST_TRAJECTORY_ID + t
+        start_epoch = 100_000.0 + 3_600.0 * t
+        samples = synthetic_trajectory(
+            rng, start_epoch, max(count, 1) * options.image_interval_s, options
+        )
+        pd.DataFrame(samples, columns=TRAJECTORY_COLUMNS).to_csv(
+            kappa_path.trajectories_dir
+            / f"trajectory_{trajectory_id}_{options.gps_week}_{options.epsg}.txt",
+            sep=" ",
+            index=False,
+            float_format="%.6f",
+        )
+        trajectory = Trajectory.from_samples(samples)
+        faces = image_faces(trajectory_id, trajectory, first_id, count, options)
+        image_meta.append(faces)
+        first_id += count
+        if jpegs is not None:
+            for sensor_id, label in zip(CAMERA_SENSOR_IDS, DIRECTION_LABELS):
+                sensor_dir = (
+                    kappa_path.raw_images_dir / f"Trajektorie_{trajectory_id}" / f"Sensor_{sensor_id}"
+                )
+                sensor_dir.mkdir(parents=True, exist_ok=True)
+                for name in faces["image_name"].unique():
+                    (sensor_dir / name).write_bytes(jpegs[label])
+        bounds = np.linspace(
+            trajectory.epochs[0], trajectory.epochs[-1], options.scans_per_trajectory + 1
+        )
+        for s in range(options.scans_per_trajectory):
+            data_file_id = t * options.scans_per_trajectory + s
+            name = f"scandata_{data_file_id}.laz"
+            scan_dir = (
+                kappa_path.scan_data_dir / f"Trajektorie_{trajectory_id}" / f"Sensor_{SCAN_SENSOR_ID}"
+            )
+            write_scan(
+                scan_dir / name,
+                trajectory_id,
+                trajectory,
+                bounds[s],
+                bounds[s + 1],
+                options,
+                rng,
+            )
+            scan_meta.append(
+                (trajectory_id, SCAN_SENSOR_ID, data_file_id, bounds[s], bounds[s + 1], name)
+            )
+
+    pd.concat(image_meta).to_csv(kappa_path.image_metadata, sep="\t", index=False)
+    pd.DataFrame(
+        scan_meta,
+        columns=[
+            "trajectory_id",
+            "sensor_id",
+            "data_file_id",
+            "epoch_start_s",
+            "epoch_end_s",
+            "scandata_name",
+        ],
+    ).to_csv(kappa_path.scan_metadata, sep="\t", index=False)
+    # 90 degree field of view, pixel sizes are made up.
+    pixel_mm, pixels = 0.005, options.face_size or 2048
+    kappa_path.interior_orientation.write_text(
+        "".join(
+            f"{sensor_id}\tp\t{pixel_mm * pixels / 2}\t{pixel_mm}\t{pixel_mm}"
+            f"\t{pixels}\t{pixels}\t2.5\t0.0\n"
+            for sensor_id in CAMERA_SENSOR_IDS
+        )
+    )
+    (kappa_path.image_metadata.parent / "multisys.txt").write_text(
+        f"1\tm\t{CAMERA_SENSOR_IDS[1]}\t" + "\t".join(map(str, CAMERA_SENSOR_IDS)) + "\n"
+    )
+    (base_dir / SYNTHETIC_CONFIG).write_bytes(json.dumps(asdict(options)))
+    return kappa_path
+
+
+def ensure_extract(base_dir: Path, options: SyntheticOptions) -> KappazunderPath:
+    """Reuse an extract generated with the same options, or generate it."""
+    config = base_dir / SYNTHETIC_CONFIG
+    if config.exists():
+        if json.loads(config.read_bytes()) == asdict(options):
+            return KappazunderPath(base_dir)
+        # Only ever delete what was generated.
+        shutil.rmtree(base_dir)
+    return generate_extract(base_dir, options)
@@ -0,0 +1,361 @@
+import gzip
+import hashlib
+import mmap
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import geopandas as gpd
+import mapbox_vector_tile
+import numpy as np
+import orjson as json
+import pandas as pd
+import typer
+from pmtiles.tile import (
+    Compression,
+    TileType,
+    deserialize_directory,
+    deserialize_header,
+    zxy_to_tileid,
+)
+from pmtiles.writer import Writer
+from tqdm import tqdm
+
+from kappa.merge import read_wfs_dump
+from kappa.paths import OUTPUT_PATH
+
+EXTENT = 4096
+LAYER_NAME = "images_merged"
+DEFAULT_PROPERTIES = ["has_images", "TRAJECTORYID", "IMAGE_NAME"]
+
+tiles_cli = typer.Typer()
+
+
+def mercator_fractions(lon: np.ndarray, lat: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Web Mercator position as a fraction of the world, y growing southwards."""
+    lat = np.radians(np.clip(lat, -85.0511, 85.0511))
+    x = (np.asarray(lon) + 180.0) / 360.0
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / np.pi) / 2.0
+    return x, y
+
+
+def zoom_positions(fx: np.ndarray, fy: np.ndarray, zoom: int) -> pd.DataFrame:
+    """Tile and integer position within the tile of every point at ``zoom``."""
+    n = 2**zoom
+    wx, wy = fx * n * EXTENT, fy * n * EXTENT
+    tile_x = np.clip(np.floor(wx / EXTENT), 0, n - 1).astype(np.int64)
+    tile_y = np.clip(np.floor(wy / EXTENT), 0, n - 1).astype(np.int64)
+    return pd.DataFrame(
+        {
+            "tile_x": tile_x,
+            "tile_y": tile_y,
+            "px": np.rint(wx - tile_x * EXTENT).astype(np.int64),
+            "py": np.rint(wy - tile_y * EXTENT).astype(np.int64),
+        }
+    )
+
+
+def thin_points(positions: pd.DataFrame, priority: np.ndarray, cell: int) -> np.ndarray:
+    """Row numbers of one point per ``cell`` x ``cell`` pixels, preferring high priority."""
+    order = np.lexsort((np.arange(len(positions)), -priority))
+    cells = pd.DataFrame(
+        {
+            "tile_x": positions["tile_x"].to_numpy()[order],
+            "tile_y": positions["tile_y"].to_numpy()[order],
+            "cx": positions["px"].to_numpy()[order] // cell,
+            "cy": positions["py"].to_numpy()[order] // cell,
+        }
+    )
+    return np.sort(order[~cells.duplicated().to_numpy()])
+
+
+def buffer_points(positions: pd.DataFrame, zoom: int, buffer: int) -> pd.DataFrame:
+    """Also place points within ``buffer`` pixels of an edge in the neighbouring tile.
+
+    Keeps circles drawn around such points whole. The row number of the
+    source point is kept in ``row``.
+    """
+    n = 2**zoom
+    positions = positions.assign(row=np.arange(len(positions)))
+    px, py = positions["px"].to_numpy(), positions["py"].to_numpy()
+    shifted = [positions]
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            if dx == dy == 0:
+                continue
+            mask = np.ones(len(positions), dtype=bool)
+            for d, p in ((dx, px), (dy, py)):
+                if d == -1:
+                    mask &= p < buffer
+                elif d == 1:
+                    mask &= p >= EXTENT - buffer
+            neighbours = positions[mask].assign(
+                tile_x=lambda df: df["tile_x"] + dx,
+                tile_y=lambda df: df["tile_y"] + dy,
+                px=lambda df: df["px"] - dx * EXTENT,
+                py=lambda df: df["py"] - dy * EXTENT,
+            )
+            inside = neighbours["tile_x"].between(0, n - 1) & neighbours["tile_y"].between(0, n - 1)
+            shifted.append(neighbours[inside])
+    return pd.concat(shifted, ignore_index=True).sort_values(
+        ["tile_x", "tile_y", "row"], ignore_index=True
+    )
+
+
+def tile_hashes(points: pd.DataFrame, columns: list[str]) -> pd.DataFrame:
+    """One content hash per tile of the points sorted by tile."""
+    row_hashes = pd.util.hash_pandas_object(points[columns], index=False).to_numpy()
+    keys = points[["tile_x", "tile_y"]].to_numpy()
+    starts = np.flatnonzero(np.r_[True, np.any(keys[1:] != keys[:-1], axis=1)])
+    counts = np.diff(np.r_[starts, len(points)]).astype(np.uint64)
+    with np.errstate(over="ignore"):
+        hashes = np.add.reduceat(row_hashes, starts) + counts * np.uint64(0x9E3779B97F4A7C15)
+    return pd.DataFrame(
+        {
+            "tile_x": keys[starts, 0],
+            "tile_y": keys[starts, 1],
+            "start": starts,
+            "end": np.r_[starts[1:], len(points)],
+            "hash": hashes,
+        }
+    )
+
+
+def encode_tiles(job: tuple[str, list[str], pd.DataFrame]) -> list[tuple[int, int, bytes]]:
+    """Gzipped MVT of every tile of a partition."""
+    layer_name, properties, points = job
+    tiles = []
+    for (tile_x, tile_y), tile in points.groupby(["tile_x", "tile_y"], sort=False):
+        records = tile[properties].astype(object).where(tile[properties].notna(), None)
+        features = [
+            {
+                "geometry": f"POINT({px} {py})",
+                "properties": {
+                    key: value for key, value in zip(properties, values) if value is not None
+                },
+            }
+            for px, py, values in zip(
+                tile["px"].tolist(), tile["py"].tolist(), records.itertuples(index=False)
+            )
+        ]
+        data = mapbox_vector_tile.encode(
+            [{"name": layer_name, "features": features}],
+            default_options={"extents": EXTENT, "y_coord_down": True},
+        )
+        tiles.append((int(tile_x), int(tile_y), gzip.compress(data, mtime=0)))
+    return tiles
+
+
+def archive_entries(get_bytes) -> pd.DataFrame:
+    """Tile id, offset and length of every tile in a PMTiles archive, without its data."""
+    header = deserialize_header(get_bytes(0, 127))
+    entries = []
+
+    def walk(offset: int, length: int) -> None:
+        for entry in deserialize_directory(get_bytes(offset, length)):
+            if entry.run_length == 0:
+                walk(header["leaf_directory_offset"] + entry.offset, entry.length)
+            else:
+                for i in range(entry.run_length):
+                    entries.append(
+                        (entry.tile_id + i, header["tile_data_offset"] + entry.offset, entry.length)
+                    )
+
+    walk(header["root_offset"], header["root_length"])
+    return pd.DataFrame(entries, columns=["tile_id", "offset", "length"]).set_index("tile_id")
+
+
+def hashes_path(output: Path) -> Path:
+    return output.with_name(output.name + ".hashes.parquet")
+
+
+def build_pmtiles(
+    points: gpd.GeoDataFrame,
+    output: Path,
+    min_zoom: int = 8,
+    max_zoom: int = 16,
+    properties: list[str] = DEFAULT_PROPERTIES,
+    thin_cell: int = 32,
+    buffer: int = 128,
+    partition_depth: int = 3,
+    workers: int = 4,
+    layer_name: str = LAYER_NAME,
+) -> tuple[int, int]:
+    """Write points as a PMTiles archive of vector tiles, one layer.
+
+    Below ``max_zoom`` only one point per ``thin_cell`` pixels is kept,
+    points with images first. Tiles are encoded in parallel, a task per
+    partition of ``4**partition_depth`` tiles. Tiles whose content hash
+    is unchanged since the last build are copied from the previous
+    archive. Returns (encoded, reused) tile counts.
+    """
+    points = points.to_crs(4326).reset_index(drop=True)
+    if not len(points):
+        raise ValueError("No points to tile")
+    properties = [column for column in properties if column in points.columns]
+    attributes = points[properties].reset_index(drop=True)
+    lon, lat = points.geometry.x.to_numpy(), points.geometry.y.to_numpy()
+    fx, fy = mercator_fractions(lon, lat)
+    priority = (
+        points["has_images"].fillna(False).to_numpy(dtype=np.int64)
+        if "has_images" in points.columns
+        else np.zeros(len(points), dtype=np.int64)
+    )
+    params = {
+        "layer": layer_name,
+        "properties": properties,
+        "extent": EXTENT,
+        "thin_cell": thin_cell,
+        "buffer": buffer,
+        # Thinning depends on max_zoom, min_zoom bounds the tiles kept.
+        "min_zoom": min_zoom,
+        "max_zoom": max_zoom,
+    }
+    params_hash = hashlib.sha256(json.dumps(params)).hexdigest()
+
+    # Tiles of the previous build, reused when their hash is unchanged.
+    old_file = previous = None
+    old_tiles = pd.DataFrame(
+        {
+            "hash": pd.Series(dtype="uint64"),
+            "offset": pd.Series(dtype="int64"),
+            "length": pd.Series(dtype="int64"),
+        }
+    )
+    if output.exists() and hashes_path(output).exists():
+        table = pd.read_parquet(hashes_path(output))
+        if len(table) and (table["params_hash"] == params_hash).all():
+            old_file = output.open("rb")
+            previous = mmap.mmap(old_file.fileno(), 0, access=mmap.ACCESS_READ)
+            old_tiles = table.set_index("tile_id")[["hash"]].join(
+                archive_entries(lambda offset, length: previous[offset : offset + length]),
+                how="inner",
+            )
+
+    tmp_output = output.with_name(output.name + ".tmp")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    encoded = reused = 0
+    hashes = []
+    with tmp_output.open("wb") as f, ProcessPoolExecutor(max_workers=workers) as executor:
+        writer = Writer(f)
+        for zoom in tqdm(range(min_zoom, max_zoom + 1), desc="Building tiles...", unit="zoom"):
+            positions = zoom_positions(fx, fy, zoom)
+            rows = (
+                thin_points(positions, priority, thin_cell)
+                if zoom < max_zoom
+                else np.arange(len(positions))
+            )
+            tile_points = buffer_points(positions.iloc[rows].reset_index(drop=True), zoom, buffer)
+            tile_points = pd.concat(
+                [
+                    tile_points,
+                    attributes.iloc[rows[tile_points["row"].to_numpy()]].reset_index(drop=True),
+                ],
+                axis=1,
+            )
+            tiles = tile_hashes(tile_points, ["px", "py", *properties])
+            tiles["tile_id"] = [
+                zxy_to_tileid(zoom, x, y)
+                for x, y in zip(tiles["tile_x"].tolist(), tiles["tile_y"].tolist())
+            ]
+            known = old_tiles.reindex(tiles["tile_id"])
+            unchanged = (known["hash"] == tiles["hash"].to_numpy()).to_numpy()
+
+            dirty = tiles[~unchanged]
+            row_numbers = np.concatenate(
+                [np.arange(start, end) for start, end in zip(dirty["start"], dirty["end"])]
+                or [np.zeros(0, dtype=np.int64)]
+            )
+            dirty_points = tile_points.iloc[row_numbers]
+            partitions = dirty_points.groupby(
+                [
+                    dirty_points["tile_x"] // 2**partition_depth,
+                    dirty_points["tile_y"] // 2**partition_depth,
+                ]
+            ).indices
+            jobs = (
+                (layer_name, properties, dirty_points.iloc[partition])
+                for partition in partitions.values()
+            )
+            data = {}
+            for partition_tiles in executor.map(encode_tiles, jobs):
+                for tile_x, tile_y, tile in partition_tiles:
+                    data[zxy_to_tileid(zoom, tile_x, tile_y)] = tile
+            for tile_id, offset, length in zip(
+                tiles.loc[unchanged, "tile_id"].tolist(),
+                known.loc[unchanged, "offset"].astype("int64").tolist(),
+                known.loc[unchanged, "length"].astype("int64").tolist(),
+            ):
+                data[tile_id] = previous[offset : offset + length]
+            for tile_id in sorted(data):
+                writer.write_tile(tile_id, data[tile_id])
+            encoded += len(dirty)
+            reused += int(unchanged.sum())
+            hashes.append(tiles[["tile_id", "hash"]])
+
+        bounds = [lon.min(), lat.min(), lon.max(), lat.max()]
+        writer.finalize(
+            {
+                "tile_type": TileType.MVT,
+                "tile_compression": Compression.GZIP,
+                "min_lon_e7": int(bounds[0] * 1e7),
+                "min_lat_e7": int(bounds[1] * 1e7),
+                "max_lon_e7": int(bounds[2] * 1e7),
+                "max_lat_e7": int(bounds[3] * 1e7),
+                "center_zoom": min_zoom,
+                "center_lon_e7": int((bounds[0] + bounds[2]) / 2 * 1e7),
+                "center_lat_e7": int((bounds[1] + bounds[3]) / 2 * 1e7),
+            },
+            {
+                "name": layer_name,
+                "format": "pbf",
+                "vector_layers": [
+                    {
+                        "id": layer_name,
+                        "fields": {
+                            column: "Boolean"
+                            if pd.api.types.is_bool_dtype(attributes[column])
+                            else "Number"
+                            if pd.api.types.is_numeric_dtype(attributes[column])
+                            else "String"
+                            for column in properties
+                        },
+                        "minzoom": min_zoom,
+                        "maxzoom": max_zoom,
+                    }
+                ],
+            },
+        )
+    if previous is not None:
+        previous.close()
+        old_file.close()
+    tmp_output.replace(output)
+    pd.concat(hashes, ignore_index=True).assign(params_hash=params_hash).to_parquet(
+        hashes_path(output)
+    )
+    return encoded, reused
+
+
+@tiles_cli.command()
+def build(
+    merged_images: Path = typer.Argument(
+        OUTPUT_PATH / "parquet" / "images_merged.geoparquet",
+        help="Output of `kappa extract merge-images`.",
+    ),
+    output: Path = OUTPUT_PATH / "pmtiles" / f"{LAYER_NAME}.pmtiles",
+    min_zoom: int = 8,
+    max_zoom: int = 16,
+    properties: list[str] = typer.Option(DEFAULT_PROPERTIES, help="Attributes kept in tiles."),
+    thin_cell: int = typer.Option(32, help="Below max zoom, keep a point per cell of this many tile pixels."),
+    workers: int = typer.Option(4, help="Processes encoding tiles."),
+):
+    """Build a PMTiles archive of the merged image points, reusing unchanged tiles."""
+    encoded, reused = build_pmtiles(
+        read_wfs_dump(merged_images),
+        output,
+        min_zoom=min_zoom,
+        max_zoom=max_zoom,
+        properties=properties,
+        thin_cell=thin_cell,
+        workers=workers,
+    )
+    print(f"{encoded} tiles encoded, {reused} reused from the previous build")
@@ -0,0 +1,220 @@
+import io
+import zipfile
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+
+# Columns of a trajectory file, see "Data format of the trajectory" in
+# docs/Description_of_Geodata_Kappazunder_OGD_English.pdf.
+TRAJECTORY_COLUMNS = [
+    "epoch_s",
+    "x_m",
+    "y_m",
+    "z_m",
+    "rx_rad",
+    "ry_rad",
+    "rz_rad",
+    "sx_m",
+    "sy_m",
+    "sz_m",
+    "srx_rad",
+    "sry_rad",
+    "srz_rad",
+]
+
+
+def euler_to_matrix(rx: np.ndarray, ry: np.ndarray, rz: np.ndarray) -> np.ndarray:
+    """Body to global rotation matrices ``Rz @ Rx @ Ry``, shape (n, 3, 3).
+
+    Follows the Kappazunder parameterization, rz is the yaw clockwise from north.
+    """
+    rx, ry, rz = np.broadcast_arrays(*(np.asarray(a, dtype=np.float64) for a in (rx, ry, rz)))
+    cx, sx, cy, sy, cz, sz = np.cos(rx), np.sin(rx), np.cos(ry), np.sin(ry), np.cos(rz), np.sin(rz)
+    zero, one = np.zeros_like(rx), np.ones_like(rx)
+    rot_z = np.stack([cz, sz, zero, -sz, cz, zero, zero, zero, one], axis=-1).reshape(-1, 3, 3)
+    rot_x = np.stack([one, zero, zero, zero, cx, -sx, zero, sx, cx], axis=-1).reshape(-1, 3, 3)
+    rot_y = np.stack([cy, zero, sy, zero, one, zero, -sy, zero, cy], axis=-1).reshape(-1, 3, 3)
+    return rot_z @ rot_x @ rot_y
+
+
+def matrix_to_euler(matrices: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Inverse of `euler_to_matrix`, rx in [-pi/2, pi/2]."""
+    m = np.asarray(matrices, dtype=np.float64).reshape(-1, 3, 3)
+    rx = np.arcsin(np.clip(m[:, 2, 1], -1.0, 1.0))
+    ry = np.arctan2(-m[:, 2, 0], m[:, 2, 2])
+    rz = np.arctan2(m[:, 0, 1], m[:, 1, 1])
+    return rx, ry, rz
+
+
+def matrix_to_quaternion(matrices: np.ndarray) -> np.ndarray:
+    """Unit quaternions (w, x, y, z) of rotation matrices, shape (n, 4)."""
+    m = np.asarray(matrices, dtype=np.float64).reshape(-1, 3, 3)
+    m00, m01, m02 = m[:, 0, 0], m[:, 0, 1], m[:, 0, 2]
+    m10, m11, m12 = m[:, 1, 0], m[:, 1, 1], m[:, 1, 2]
+    m20, m21, m22 = m[:, 2, 0], m[:, 2, 1], m[:, 2, 2]
+    # Each row derives the quaternion from a different largest component,
+    # the numerically stable one is picked per matrix.
+    candidates = np.stack(
+        [
+            np.stack([1 + m00 + m11 + m22, m21 - m12, m02 - m20, m10 - m01], axis=-1),
+            np.stack([m21 - m12, 1 + m00 - m11 - m22, m01 + m10, m02 + m20], axis=-1),
+            np.stack([m02 - m20, m01 + m10, 1 - m00 + m11 - m22, m12 + m21], axis=-1),
+            np.stack([m10 - m01, m02 + m20, m12 + m21, 1 - m00 - m11 + m22], axis=-1),
+        ],
+        axis=1,
+    )
+    trace = m00 + m11 + m22
+    # 4w^2, 4x^2, 4y^2 and 4z^2.
+    squares = np.stack(
+        [1 + trace, 1 + 2 * m00 - trace, 1 + 2 * m11 - trace, 1 + 2 * m22 - trace], axis=-1
+    )
+    q = candidates[np.arange(len(m)), np.argmax(squares, axis=-1)]
+    q /= np.linalg.norm(q, axis=-1, keepdims=True)
+    return q * np.where(q[:, :1] < 0, -1.0, 1.0)
+
+
+def quaternion_to_matrix(q: np.ndarray) -> np.ndarray:
+    w, x, y, z = np.asarray(q, dtype=np.float64).reshape(-1, 4).T
+    return np.stack(
+        [
+            1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w),
+            2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w),
+            2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y),
+        ],
+        axis=-1,
+    ).reshape(-1, 3, 3)
+
+
+def slerp(q0: np.ndarray, q1: np.ndarray, t: np.ndarray) -> np.ndarray:
+    """Spherical linear interpolation between quaternion pairs, row by row."""
+    dot = np.sum(q0 * q1, axis=-1)
+    q1 = np.where(dot[:, None] < 0, -q1, q1)
+    dot = np.clip(np.abs(dot), 0.0, 1.0)
+    theta = np.arccos(dot)
+    sin_theta = np.sin(theta)
+    # Nearly identical rotations: fall back to a normalized lerp.
+    close = sin_theta < 1e-6
+    safe = np.where(close, 1.0, sin_theta)
+    s0 = np.where(close, 1 - t, np.sin((1 - t) * theta) / safe)
+    s1 = np.where(close, t, np.sin(t * theta) / safe)
+    q = s0[:, None] * q0 + s1[:, None] * q1
+    return q / np.linalg.norm(q, axis=-1, keepdims=True)
+
+
+@dataclass
+class Poses:
+    positions: np.ndarray
+    quaternions: np.ndarray
+
+    def matrices(self) -> np.ndarray:
+        return quaternion_to_matrix(self.quaternions)
+
+    def bearings(self) -> np.ndarray:
+        """Direction of travel, radians clockwise from north in [0, 2*pi)."""
+        # The platform's y axis points in the direction of travel, its global
+        # x (east) and y (north) components are the second matrix column.
+        w, x, y, z = self.quaternions.T
+        east, north = 2 * (x * y - z * w), 1 - 2 * (x * x + z * z)
+        return np.mod(np.arctan2(east, north), 2 * np.pi)
+
+
+@dataclass
+class Trajectory:
+    """Pose samples of a trajectory, sorted by GPS seconds of week."""
+
+    epochs: np.ndarray
+    positions: np.ndarray
+    quaternions: np.ndarray
+    # Standard deviations of x, y, z, rx, ry, rz.
+    deviations: np.ndarray
+
+    @classmethod
+    def from_samples(cls, samples: np.ndarray) -> "Trajectory":
+        samples = samples[np.argsort(samples[:, 0], kind="stable")]
+        return cls(
+            epochs=samples[:, 0].copy(),
+            positions=samples[:, 1:4].copy(),
+            quaternions=matrix_to_quaternion(
+                euler_to_matrix(samples[:, 4], samples[:, 5], samples[:, 6])
+            ),
+            deviations=samples[:, 7:13].astype(np.float32),
+        )
+
+    def __len__(self) -> int:
+        return len(self.epochs)
+
+    def interpolate(self, epochs: np.ndarray) -> Poses:
+        """Poses at GPS seconds of week, NaN outside the trajectory.
+
+        Positions are interpolated linearly, attitudes by quaternion slerp.
+        """
+        if len(self) < 2:
+            raise ValueError("Interpolation needs at least two pose samples")
+        epochs = np.asarray(epochs, dtype=np.float64)
+        # Sorted queries walk the samples in order, which is much faster
+        # for large unordered queries than jumping around in memory.
+        if len(epochs) > 1 and np.any(epochs[1:] < epochs[:-1]):
+            order = np.argsort(epochs)
+            poses = self.interpolate(epochs[order])
+            positions = np.empty_like(poses.positions)
+            quaternions = np.empty_like(poses.quaternions)
+            positions[order], quaternions[order] = poses.positions, poses.quaternions
+            return Poses(positions=positions, quaternions=quaternions)
+        right = np.clip(np.searchsorted(self.epochs, epochs, side="right"), 1, len(self) - 1)
+        left = right - 1
+        span = self.epochs[right] - self.epochs[left]
+        t = np.clip(
+            (epochs - self.epochs[left]) / np.where(span > 0, span, 1.0), 0.0, 1.0
+        )
+        positions = self.positions[left] + t[:, None] * (
+            self.positions[right] - self.positions[left]
+        )
+        quaternions = slerp(self.quaternions[left], self.quaternions[right], t)
+        outside = (epochs < self.epochs[0]) | (epochs > self.epochs[-1])
+        positions[outside] = np.nan
+        quaternions[outside] = np.nan
+        return Poses(positions=positions, quaternions=quaternions)
+
+
+@contextmanager
+def _open_trajectory(path: Path) -> Iterator[io.TextIOBase]:
+    """Trajectory text, read from the single member of delivered zip files."""
+    if path.suffix == ".zip":
+        with (
+            zipfile.ZipFile(path) as archive,
+            io.TextIOWrapper(archive.open(archive.namelist()[0])) as f,
+        ):
+            yield f
+    else:
+        with path.open() as f:
+            yield f
+
+
+def read_trajectory(path: Path, chunksize: int = 1_000_000) -> Trajectory:
+    """Read a whitespace separated trajectory file in chunks of ``chunksize`` rows."""
+    with _open_trajectory(path) as f:
+        first = f.readline()
+        try:
+            [float(value) for value in first.split()]
+            has_header = False
+        except ValueError:
+            has_header = True
+        f.seek(0)
+        chunks = [
+            chunk.to_numpy()
+            for chunk in pd.read_csv(
+                f,
+                sep=r"\s+",
+                header=None,
+                skiprows=1 if has_header else 0,
+                usecols=range(len(TRAJECTORY_COLUMNS)),
+                dtype=np.float64,
+                chunksize=chunksize,
+            )
+        ]
+    samples = np.concatenate(chunks) if chunks else np.zeros((0, len(TRAJECTORY_COLUMNS)))
+    return Trajectory.from_samples(samples)
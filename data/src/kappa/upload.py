@@ -0,0 +1,202 @@
+import hashlib
+import mimetypes
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable
+
+import boto3
+import orjson as json
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from tqdm import tqdm
+
+from kappa import metrics
+
+MB = 1024 * 1024
+CONTENT_TYPES = {
+    ".copc.laz": "application/vnd.laszip+copc",
+    ".laz": "application/vnd.laszip",
+    ".json": "application/json",
+}
+
+
+@dataclass
+class UploadOptions:
+    bucket: str
+    prefix: str = ""
+    # R2 or a local S3 compatible server, AWS when None.
+    endpoint_url: str | None = None
+    workers: int = 32
+    multipart_threshold: int = 64 * MB
+    multipart_chunksize: int = 16 * MB
+    # Parts of one multipart upload sent at the same time.
+    part_concurrency: int = 8
+    # Skip remote objects of the same size without comparing ETags.
+    size_only: bool = False
+
+
+def s3_client(endpoint_url: str | None = None, max_pool_connections: int = 32):
+    """S3 client safe to share between threads, with a connection per thread."""
+    client = boto3.session.Session().client(
+        "s3",
+        endpoint_url=endpoint_url,
+        config=Config(
+            max_pool_connections=max_pool_connections,
+            retries={"max_attempts": 10, "mode": "adaptive"},
+        ),
+    )
+    metrics.instrument_boto_client(client)
+    return client
+
+
+def content_type(path: Path) -> str:
+    for suffix, media_type in CONTENT_TYPES.items():
+        if path.name.endswith(suffix):
+            return media_type
+    return mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+
+
+def s3_etag(path: Path, multipart_threshold: int, multipart_chunksize: int) -> str:
+    """ETag S3 gives ``path`` when uploaded with the same multipart settings."""
+    size = path.stat().st_size
+    with path.open("rb") as f:
+        if size < multipart_threshold:
+            return hashlib.md5(f.read()).hexdigest()
+        digests = []
+        while chunk := f.read(multipart_chunksize):
+            digests.append(hashlib.md5(chunk).digest())
+    return f"{hashlib.md5(b''.join(digests)).hexdigest()}-{len(digests)}"
+
+
+def list_remote(client, bucket: str, prefix: str) -> dict[str, tuple[int, str]]:
+    """Size and ETag of every object below ``prefix``."""
+    remote = {}
+    paginator = client.get_paginator("list_objects_v2")
+    for page in tqdm(
+        paginator.paginate(Bucket=bucket, Prefix=prefix), desc="Listing bucket...", unit="page"
+    ):
+        for obj in page.get("Contents", []):
+            remote[obj["Key"]] = (obj["Size"], obj["ETag"].strip('"'))
+    return remote
+
+
+class UploadJournal:
+    """Append-only record of uploaded files, so an interrupted upload resumes."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.entries: dict[str, tuple[int, float]] = {}
+        if path.exists():
+            with path.open("rb") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Last line of a crashed run.
+                        continue
+                    self.entries[entry["key"]] = (entry["size"], entry["mtime"])
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = path.open("ab")
+        self.lock = threading.Lock()
+
+    def is_uploaded(self, key: str, size: int, mtime: float) -> bool:
+        return self.entries.get(key) == (size, mtime)
+
+    def record(self, key: str, size: int, mtime: float) -> None:
+        with self.lock:
+            self.entries[key] = (size, mtime)
+            self.file.write(json.dumps({"key": key, "size": size, "mtime": mtime}) + b"\n")
+            self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def upload_file(
+    client,
+    path: Path,
+    key: str,
+    options: UploadOptions,
+    transfer_config: TransferConfig,
+) -> None:
+    extra_args = {"ContentType": content_type(path)}
+    if path.stat().st_size < options.multipart_threshold:
+        with path.open("rb") as f:
+            client.put_object(Bucket=options.bucket, Key=key, Body=f, **extra_args)
+    else:
+        client.upload_file(
+            str(path), options.bucket, key, ExtraArgs=extra_args, Config=transfer_config
+        )
+
+
+@metrics.timed("upload_files", items=sum)
+def upload_files(
+    base_dir: Path,
+    paths: Iterable[Path],
+    options: UploadOptions,
+    journal_path: Path,
+) -> tuple[int, int]:
+    """Upload ``paths`` below ``options.prefix``, keyed by their path relative to ``base_dir``.
+
+    Small files are single PUTs and large files multipart uploads, both
+    spread over ``options.workers`` threads sharing one client. Files
+    already in the journal, or remote with the same size and ETag, are
+    skipped. Returns (uploaded, skipped).
+    """
+    # Every worker may run a multipart upload with part_concurrency threads of its own.
+    client = s3_client(
+        options.endpoint_url, max_pool_connections=options.workers * options.part_concurrency
+    )
+    transfer_config = TransferConfig(
+        multipart_threshold=options.multipart_threshold,
+        multipart_chunksize=options.multipart_chunksize,
+        max_concurrency=options.part_concurrency,
+    )
+    prefix = options.prefix.strip("/")
+    remote = list_remote(client, options.bucket, prefix)
+    journal = UploadJournal(journal_path)
+    uploaded = skipped = 0
+
+    def upload(path: Path, key: str, size: int, mtime: float) -> bool:
+        if key in remote and remote[key][0] == size:
+            if options.size_only or remote[key][1] == s3_etag(
+                path, options.multipart_threshold, options.multipart_chunksize
+            ):
+                journal.record(key, size, mtime)
+                return False
+        upload_file(client, path, key, options, transfer_config)
+        journal.record(key, size, mtime)
+        return True
+
+    def finish(future) -> None:
+        nonlocal uploaded, skipped
+        if future.result():
+            uploaded += 1
+        else:
+            skipped += 1
+        progress.update()
+
+    try:
+        with (
+            ThreadPoolExecutor(max_workers=options.workers) as executor,
+            tqdm(desc="Uploading...", unit="file") as progress,
+        ):
+            pending = deque()
+            for path in paths:
+                stat = path.stat()
+                key = "/".join(filter(None, [prefix, path.relative_to(base_dir).as_posix()]))
+                if journal.is_uploaded(key, stat.st_size, stat.st_mtime):
+                    skipped += 1
+                    progress.update()
+                    continue
+                pending.append(executor.submit(upload, path, key, stat.st_size, stat.st_mtime))
+                if len(pending) >= 4 * options.workers:
+                    finish(pending.popleft())
+            while pending:
+                finish(pending.popleft())
+    finally:
+        journal.close()
+    return uploaded, skipped
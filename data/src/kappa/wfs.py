@@ -1,21 +1,35 @@
-import math
-from typing import Literal
+import os
+import random
+import shutil
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterator
 
 import geopandas as gpd
 import orjson as json
 import pandas as pd
+import requests
 import typer
-from owslib.wfs import WebFeatureService
-from requests import Request
+from pydantic import BaseModel
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
 
+from kappa import metrics
+from kappa.crs import reproject_gdf
+from kappa.httpcache import CachedSession, CacheOptions
 from kappa.paths import OUTPUT_PATH
 from enum import Enum
 
 WFS_URL = "https://data.wien.gv.at/daten/geo?version=1.1.0&service=WFS"
+WFS_CRS = "epsg:31256"
 IMAGE_META_LAYER = "ogdwien:KAPPAZUNDERIMAGEPOGD"
+PANORAMA_LAYER = "ogdwien:KAPPAZUNDERPANOPOGD"
+LIDAR_LAYER = "ogdwien:KAPPAZUNDERLIDARFOGD"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
 
-wfs_cli = typer.Typer(help=f"Extract data from WFS server - {WFS_URL}")
+wfs_cli = typer.Typer()
 
 
 class FileFormat(str, Enum):
@@ -23,48 +37,328 @@ class FileFormat(str, Enum):
     geoparquet = "geoparquet"
 
 
+class DumpFormat(str, Enum):
+    geoparquet = "geoparquet"
+    geojsonseq = "geojsonseq"
+
+    @property
+    def suffix(self) -> str:
+        return {"geoparquet": "geoparquet", "geojsonseq": "geojsonl"}[self.value]
+
+
+class Layer(str, Enum):
+    images = "images"
+    panoramas = "panoramas"
+    lidar = "lidar"
+
+    @property
+    def layer_name(self) -> str:
+        return {
+            "images": IMAGE_META_LAYER,
+            "panoramas": PANORAMA_LAYER,
+            "lidar": LIDAR_LAYER,
+        }[self.value]
+
+
+def wfs_session(
+    pool_size: int = 8, cache: CacheOptions | None = None
+) -> requests.Session | CachedSession:
+    session = requests.Session()
+    session.hooks["response"].append(metrics.record_response)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if cache is not None and cache.cache_dir is not None:
+        return CachedSession(session, cache)
+    return session
+
+
+def page_params(layer_name: str, offset: int, batch_size: int) -> dict:
+    return dict(
+        service="WFS",
+        version="1.1.0",
+        request="GetFeature",
+        typeName=layer_name,
+        outputFormat="json",
+        maxFeatures=batch_size,
+        startIndex=offset,
+        sortby="OBJECTID",
+    )
+
+
+def get_json(
+    session: requests.Session | CachedSession,
+    url: str,
+    params: dict,
+    retries: int = 5,
+    backoff: float = 1.0,
+    timeout: float = 120,
+) -> dict:
+    """GET and parse a JSON response, retrying with exponential backoff."""
+    for attempt in range(retries + 1):
+        try:
+            resp = session.get(url, params=params, timeout=timeout)
+            if resp.status_code not in RETRY_STATUSES:
+                resp.raise_for_status()
+                try:
+                    return json.loads(resp.content)
+                except json.JSONDecodeError:
+                    # Do not serve a truncated body from the cache on the retry.
+                    if isinstance(session, CachedSession):
+                        session.discard(url, params)
+                    raise
+            error = requests.HTTPError(f"{resp.status_code} for {resp.url}", response=resp)
+        except (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+            json.JSONDecodeError,
+        ) as e:
+            error = e
+        if attempt == retries:
+            raise error
+        time.sleep(backoff * 2**attempt * (1 + random.random()))
+
+
+def features_to_gdf(data: dict) -> gpd.GeoDataFrame:
+    features = data["features"]
+    gdf = gpd.GeoDataFrame.from_features(features, crs=WFS_CRS)
+    gdf.insert(0, "id", [feature.get("id") for feature in features])
+    return gdf
+
+
+def get_feature_count(session: requests.Session | CachedSession, wfs_url: str, layer_name: str) -> int:
+    data = get_json(session, wfs_url, page_params(layer_name, 0, 1))
+    return data["totalFeatures"]
+
+
+def iter_pages(
+    session: requests.Session | CachedSession,
+    wfs_url: str,
+    layer_name: str,
+    offsets: list[int],
+    batch_size: int,
+    concurrency: int = 4,
+) -> Iterator[tuple[int, dict]]:
+    """Yield ``(offset, page)`` in offset order, ``concurrency`` pages in flight."""
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = deque()
+        for offset in offsets:
+            pending.append(
+                (
+                    offset,
+                    executor.submit(
+                        get_json, session, wfs_url, page_params(layer_name, offset, batch_size)
+                    ),
+                )
+            )
+            if len(pending) >= concurrency:
+                offset, future = pending.popleft()
+                yield offset, future.result()
+        while pending:
+            offset, future = pending.popleft()
+            yield offset, future.result()
+
+
+@metrics.timed("wfs_fetch", items=len)
 def get_all_features(
-    wfs_url: str, layer_name: str, batch_size: int = 50000
+    wfs_url: str,
+    layer_name: str,
+    batch_size: int = 50000,
+    concurrency: int = 4,
+    cache: CacheOptions | None = None,
 ) -> gpd.GeoDataFrame:
-    wfs = WebFeatureService(url=wfs_url, version="1.1.0", timeout=60)
-    resp = wfs.getfeature(layer_name, outputFormat="json", maxfeatures=1)
-    data = json.loads(resp.read())
-    total = data["totalFeatures"]
-
-    result = gpd.GeoDataFrame()
-
-    for offset in tqdm(
-        range(0, total, batch_size),
-        desc="Fetching data...",
-        total=math.ceil(total / batch_size),
-        unit="batch",
-    ):
-        params = dict(
-            service="WFS",
-            version="1.1.0",
-            request="GetFeature",
-            typeName=layer_name,
-            outputFormat="json",
-            maxFeatures=batch_size,
-            startIndex=offset,
-            sortby="OBJECTID",
+    session = wfs_session(pool_size=concurrency, cache=cache)
+    total = get_feature_count(session, wfs_url, layer_name)
+    offsets = list(range(0, total, batch_size))
+
+    # Pages are requested sorted by OBJECTID, so offset order is OBJECTID order.
+    pages = [
+        features_to_gdf(data)
+        for _, data in tqdm(
+            iter_pages(session, wfs_url, layer_name, offsets, batch_size, concurrency),
+            desc="Fetching data...",
+            total=len(offsets),
+            unit="batch",
+        )
+    ]
+    if not pages:
+        return gpd.GeoDataFrame(geometry=[], crs=WFS_CRS)
+    return pd.concat(pages, ignore_index=True)
+
+
+class DumpCheckpoint(BaseModel):
+    """Progress of a streamed dump, stored next to its output."""
+
+    layer: str
+    format: str
+    batch_size: int
+    total: int
+    completed: list[int] = []
+    # Size of a GeoJSON sequence output after the last completed page.
+    bytes_written: int = 0
+
+    @classmethod
+    def path_for(cls, output: Path) -> Path:
+        return output.with_name(output.name + ".checkpoint.json")
+
+    def save(self, path: Path) -> None:
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(self.model_dump_json())
+        tmp_path.replace(path)
+
+
+def dump_layer(
+    wfs_url: str,
+    layer: Layer,
+    output: Path,
+    format: DumpFormat,
+    batch_size: int = 50000,
+    concurrency: int = 4,
+    cache: CacheOptions | None = None,
+) -> None:
+    """Stream a layer to ``output`` page by page, resuming an interrupted dump.
+
+    GeoParquet output is a directory with one single row group file per page,
+    GeoJSON sequence output is a newline delimited file.
+    """
+    session = wfs_session(pool_size=concurrency, cache=cache)
+    total = get_feature_count(session, wfs_url, layer.layer_name)
+    checkpoint_path = DumpCheckpoint.path_for(output)
+    checkpoint = None
+    if checkpoint_path.exists():
+        checkpoint = DumpCheckpoint.model_validate_json(checkpoint_path.read_bytes())
+        if (
+            checkpoint.layer,
+            checkpoint.format,
+            checkpoint.batch_size,
+            checkpoint.total,
+        ) != (layer.layer_name, format.value, batch_size, total):
+            print("Layer, format, batch size or feature count changed, starting over")
+            checkpoint = None
+    if checkpoint is None:
+        checkpoint = DumpCheckpoint(
+            layer=layer.layer_name, format=format.value, batch_size=batch_size, total=total
         )
-        wfs_request_url = Request("GET", wfs_url, params=params).prepare().url
+        if output.is_dir():
+            shutil.rmtree(output)
+        output.unlink(missing_ok=True)
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    completed = set(checkpoint.completed)
+    offsets = [offset for offset in range(0, total, batch_size) if offset not in completed]
+    match format:
+        case DumpFormat.geoparquet:
+            output.mkdir(exist_ok=True)
+            sequence = None
+        case DumpFormat.geojsonseq:
+            sequence = output.open("ab")
+            # Drop whatever a crashed run wrote after its last checkpoint.
+            sequence.truncate(checkpoint.bytes_written)
+
+    try:
+        for offset, data in tqdm(
+            iter_pages(session, wfs_url, layer.layer_name, offsets, batch_size, concurrency),
+            desc=f"Dumping {layer.value}...",
+            total=len(offsets),
+            unit="batch",
+        ):
+            gdf = reproject_gdf(features_to_gdf(data))
+            if sequence is None:
+                part = output / f"part-{offset:010d}.parquet"
+                tmp_part = part.with_suffix(".tmp")
+                gdf.to_parquet(tmp_part)
+                tmp_part.replace(part)
+            else:
+                sequence.writelines(
+                    json.dumps(feature, option=json.OPT_SERIALIZE_NUMPY) + b"\n"
+                    for feature in gdf.iterfeatures(drop_id=True)
+                )
+                sequence.flush()
+                os.fsync(sequence.fileno())
+                checkpoint.bytes_written = sequence.tell()
+            checkpoint.completed.append(offset)
+            checkpoint.save(checkpoint_path)
+    finally:
+        if sequence is not None:
+            sequence.close()
+    checkpoint_path.unlink()
+
 
-        gdf = gpd.read_file(wfs_request_url).set_crs("epsg:31256")
-        result = pd.concat([result, gdf])
-    return result
+@wfs_cli.callback()
+def wfs_options(
+    ctx: typer.Context,
+    cache_dir: Path = typer.Option(
+        None, help="Cache WFS responses on disk, e.g. output/http-cache."
+    ),
+    cache_ttl: float = typer.Option(
+        24 * 3600, help="Seconds cached responses are used before revalidation."
+    ),
+    cache_max_size: int = typer.Option(
+        None, help="Evict least recently used responses above this many bytes."
+    ),
+    offline: bool = typer.Option(False, help="Serve only cached responses."),
+):
+    if offline and cache_dir is None:
+        raise typer.BadParameter("Offline mode needs --cache-dir", param_hint="--offline")
+    ctx.obj = CacheOptions(
+        cache_dir=cache_dir, ttl=cache_ttl, max_size=cache_max_size, offline=offline
+    )
 
 
 @wfs_cli.command()
-def dump_images(format: FileFormat = FileFormat.geojson):
+def dump(
+    ctx: typer.Context,
+    layer: Layer = typer.Option(Layer.images, help="Kappazunder layer to dump."),
+    format: DumpFormat = DumpFormat.geoparquet,
+    output: Path = typer.Option(
+        None, help="Defaults to output/parquet/<layer>.geoparquet or output/json/<layer>.geojsonl."
+    ),
+    wfs_url: str = WFS_URL,
+    batch_size: int = 50000,
+    concurrency: int = typer.Option(4, help="Pages fetched at the same time."),
+):
+    """Stream a layer from WFS server to disk page by page, resuming interrupted dumps."""
+    if output is None:
+        folder = "parquet" if format == DumpFormat.geoparquet else "json"
+        output = OUTPUT_PATH / folder / f"{layer.value}.{format.suffix}"
+    dump_layer(
+        wfs_url,
+        layer,
+        output,
+        format,
+        batch_size=batch_size,
+        concurrency=concurrency,
+        cache=ctx.obj,
+    )
+
+
+@wfs_cli.command()
+def dump_images(
+    ctx: typer.Context,
+    format: FileFormat = FileFormat.geojson,
+    wfs_url: str = WFS_URL,
+    batch_size: int = 50000,
+    concurrency: int = typer.Option(4, help="Pages fetched at the same time."),
+):
     """Generate dump of image metadata from WFS server."""
 
-    images_gdf = get_all_features(WFS_URL, IMAGE_META_LAYER).to_crs(4326)
+    images_gdf = reproject_gdf(
+        get_all_features(
+            wfs_url,
+            IMAGE_META_LAYER,
+            batch_size=batch_size,
+            concurrency=concurrency,
+            cache=ctx.obj,
+        )
+    )
     match format:
         case FileFormat.geojson:
             output_file = OUTPUT_PATH / "json" / "images.geojson"
-            output_file.unlink()
+            output_file.parent.mkdir(parents=True, exist_ok=True)
+            output_file.unlink(missing_ok=True)
             images_gdf.to_file(output_file, driver="geojson")
         case FileFormat.geoparquet:
-            images_gdf.to_parquet(OUTPUT_PATH / "parquet" / "images.geoparquet")
+            output_file = OUTPUT_PATH / "parquet" / "images.geoparquet"
+            output_file.parent.mkdir(parents=True, exist_ok=True)
+            images_gdf.to_parquet(output_file)
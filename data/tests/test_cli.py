@@ -0,0 +1,27 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from kappa.bench import STARTUP_BUDGETS, startup_seconds
+from kappa.cli import SUBCOMMANDS
+
+
+@pytest.mark.parametrize("command", list(STARTUP_BUDGETS))
+def test_help_is_within_startup_budget(command):
+    seconds, _ = startup_seconds(command.split(), runs=2)
+    assert seconds <= STARTUP_BUDGETS[command]
+
+
+@pytest.mark.parametrize("name", list(SUBCOMMANDS))
+def test_group_help_comes_from_subcommands(name):
+    result = subprocess.run(
+        [sys.executable, "-m", "kappa.cli", name, "--help"],
+        capture_output=True,
+        text=True,
+        check=True,
+        # Keep the help on one line.
+        env={**os.environ, "COLUMNS": "200"},
+    )
+    assert SUBCOMMANDS[name][1] in result.stdout
@@ -0,0 +1,59 @@
+from datetime import timezone
+
+import numpy as np
+import pytest
+from astropy.time import Time
+
+from kappa.gpstime import (
+    GPS_EPOCH,
+    LEAP_SECONDS,
+    SECONDS_IN_WEEK,
+    gps_time_to_datetime,
+    gps_to_utc,
+)
+
+
+def astropy_utc(gps_week: np.ndarray, gps_seconds: np.ndarray) -> np.ndarray:
+    utc = Time(SECONDS_IN_WEEK * gps_week + gps_seconds, format="gps").utc
+    return np.array(utc.to_datetime(), dtype="datetime64[us]")
+
+
+def leap_second_gps_times() -> np.ndarray:
+    """GPS seconds since the epoch around every leap second, but not on it.
+
+    astropy cannot represent 23:59:60 as a datetime.
+    """
+    times = []
+    for date, offset in LEAP_SECONDS:
+        # GPS time of the first UTC second after the leap second.
+        after = (np.datetime64(date, "s") - GPS_EPOCH.astype("datetime64[s]")).astype(np.int64) + offset
+        times += [after + delta for delta in (-2.5, -1.999999, 0.0, 0.000001, 0.5, 1.25)]
+    return np.array(times)
+
+
+@pytest.mark.parametrize(
+    "gps_total",
+    [
+        leap_second_gps_times(),
+        np.random.default_rng(0).uniform(0, 2_500 * SECONDS_IN_WEEK, 100_000).round(6),
+    ],
+    ids=["leap_seconds", "random"],
+)
+def test_gps_to_utc_matches_astropy(gps_total):
+    gps_week = (gps_total // SECONDS_IN_WEEK).astype(np.int64)
+    gps_seconds = gps_total - gps_week * SECONDS_IN_WEEK
+
+    np.testing.assert_array_equal(
+        gps_to_utc(gps_week, gps_seconds), astropy_utc(gps_week, gps_seconds)
+    )
+
+
+def test_gps_time_to_datetime_is_utc():
+    # 18 leap seconds since the GPS epoch, the old astropy path returned TAI,
+    # 19 s ahead of GPS and 37 s ahead of UTC.
+    utc = gps_time_to_datetime(2200, 86_418.25)
+
+    assert utc.tzinfo is timezone.utc
+    assert utc.isoformat() == "2022-03-07T00:00:00.250000+00:00"
+    tai = Time(2200 * SECONDS_IN_WEEK + 86_418.25, format="gps").datetime
+    assert (tai - utc.replace(tzinfo=None)).total_seconds() == 37
@@ -0,0 +1,117 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from kappa.httpcache import CachedSession, CacheOptions, OfflineCacheMiss
+
+
+class Origin:
+    """Local HTTP server answering ``/<name>`` with ``body`` and an ETag."""
+
+    def __init__(self):
+        self.body = b"x" * 100
+        self.etag = '"1"'
+        self.requests = []
+        origin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                origin.requests.append((self.path, self.headers.get("If-None-Match")))
+                if self.headers.get("If-None-Match") == origin.etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("ETag", origin.etag)
+                self.send_header("Content-Length", str(len(origin.body)))
+                self.end_headers()
+                self.wfile.write(origin.body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+
+@pytest.fixture
+def origin():
+    origin = Origin()
+    thread = threading.Thread(target=origin.server.serve_forever, daemon=True)
+    thread.start()
+    yield origin
+    origin.server.shutdown()
+    origin.server.server_close()
+
+
+def cached_session(tmp_path, **options) -> CachedSession:
+    return CachedSession(requests.Session(), CacheOptions(cache_dir=tmp_path, **options))
+
+
+def test_fresh_responses_are_served_from_cache(tmp_path, origin):
+    session = cached_session(tmp_path)
+    first = session.get(f"{origin.url}/a", params={"b": 1, "a": 2})
+    second = session.get(f"{origin.url}/a", params={"a": 2, "b": 1})
+
+    assert first.content == second.content == origin.body
+    assert "X-From-Cache" not in first.headers
+    assert second.headers["X-From-Cache"] == "1"
+    assert len(origin.requests) == 1
+
+
+def test_expired_responses_are_revalidated(tmp_path, origin):
+    session = cached_session(tmp_path, ttl=0.2)
+    session.get(f"{origin.url}/a")
+    time.sleep(0.3)
+
+    # Not modified: the cached body is served and fresh again.
+    assert session.get(f"{origin.url}/a").content == origin.body
+    assert origin.requests[-1] == ("/a", '"1"')
+    session.get(f"{origin.url}/a")
+    assert len(origin.requests) == 2
+
+    time.sleep(0.3)
+    origin.body, origin.etag = b"y" * 100, '"2"'
+    resp = session.get(f"{origin.url}/a")
+    assert resp.content == origin.body
+    assert session.get(f"{origin.url}/a").content == origin.body
+    assert len(origin.requests) == 3
+
+
+def test_least_recently_used_responses_are_evicted(tmp_path, origin):
+    session = cached_session(tmp_path, max_size=250)
+    for name in ["a", "b", "a", "c"]:
+        session.get(f"{origin.url}/{name}")
+
+    assert session.size == 200
+    assert sorted(path.stem for path in tmp_path.glob("*/*.body")) == sorted(session.sizes)
+    session.get(f"{origin.url}/a")
+    session.get(f"{origin.url}/b")
+    assert [path for path, _ in origin.requests] == ["/a", "/b", "/c", "/b"]
+
+    # A new session picks up the size of what is on disk.
+    assert cached_session(tmp_path, max_size=250).size == 200
+
+
+def test_offline_mode_serves_only_cached_responses(tmp_path, origin):
+    cached_session(tmp_path).get(f"{origin.url}/a")
+    session = cached_session(tmp_path, ttl=0, offline=True)
+
+    assert session.get(f"{origin.url}/a").content == origin.body
+    with pytest.raises(OfflineCacheMiss):
+        session.get(f"{origin.url}/b")
+    assert len(origin.requests) == 1
+
+
+def test_discarded_responses_are_fetched_again(tmp_path, origin):
+    session = cached_session(tmp_path, max_size=1000)
+    session.get(f"{origin.url}/a", params={"q": 1})
+    session.discard(f"{origin.url}/a", params={"q": 1})
+
+    assert session.size == 0
+    assert not list(tmp_path.glob("*/*"))
+    session.get(f"{origin.url}/a", params={"q": 1})
+    assert len(origin.requests) == 2
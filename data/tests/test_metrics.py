@@ -0,0 +1,46 @@
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+import orjson as json
+
+from kappa import metrics
+
+
+def read_records(path) -> list[dict]:
+    return [json.loads(line) for line in path.read_bytes().splitlines()]
+
+
+def has_recorder() -> bool:
+    return metrics._recorder is not None
+
+
+def test_stages_nest_per_thread(tmp_path):
+    metrics.enable(metrics.MetricsRecorder(tmp_path / "metrics.jsonl"))
+
+    def work(_):
+        with metrics.stage("work"):
+            with metrics.stage("inner"):
+                metrics.count("done")
+
+    try:
+        with metrics.stage("run"):
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                list(executor.map(work, range(8)))
+    finally:
+        metrics.disable()
+
+    records = read_records(tmp_path / "metrics.jsonl")
+    names = [record["name"] for record in records]
+    assert sorted(names) == ["run", *["run/work"] * 8, *["run/work/inner"] * 8]
+    assert records[-1]["done"] == 8
+    assert all(record["done"] == 1 for record in records[:-1])
+
+
+def test_forked_workers_do_not_inherit_the_recorder(tmp_path):
+    metrics.enable(metrics.MetricsRecorder(tmp_path / "metrics.jsonl"))
+    try:
+        with multiprocessing.get_context("fork").Pool(1) as pool:
+            assert not pool.apply(has_recorder)
+        assert has_recorder()
+    finally:
+        metrics.disable()
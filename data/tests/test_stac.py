@@ -0,0 +1,28 @@
+import geopandas as gpd
+import pandas as pd
+
+from kappa.stac import image_hrefs, images_gdf
+from kappa.synthetic import SyntheticOptions, generate_extract
+
+
+def test_images_gdf_round_trips_through_geoparquet(tmp_path):
+    kappa_path = generate_extract(
+        tmp_path / "extract",
+        SyntheticOptions(images=50, trajectories=2, points_per_scan=100, face_size=0),
+    )
+    gdf = images_gdf(kappa_path)
+    gdf.to_parquet(tmp_path / "images.parquet")
+
+    read_back = gpd.read_parquet(tmp_path / "images.parquet")
+    pd.testing.assert_frame_equal(read_back, gdf)
+    pd.testing.assert_frame_equal(
+        pd.read_parquet(tmp_path / "images.parquet").drop(columns="geometry"),
+        pd.DataFrame(gdf.drop(columns="geometry")),
+    )
+    hrefs = image_hrefs(read_back)
+    assert hrefs.notna().all().all()
+    assert hrefs["up"].iloc[0] == str(
+        kappa_path.get_raw_image(
+            gdf["trajectory_id"].iloc[0], gdf["up_sensor_id"].iloc[0], gdf["up_name"].iloc[0]
+        )
+    )
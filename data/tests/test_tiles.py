@@ -0,0 +1,77 @@
+import gzip
+
+import geopandas as gpd
+import mapbox_vector_tile
+import numpy as np
+import pandas as pd
+from pmtiles.reader import MmapSource, Reader, all_tiles
+
+from kappa.tiles import LAYER_NAME, build_pmtiles
+
+
+def image_points(count: int = 200, seed: int = 0) -> gpd.GeoDataFrame:
+    rng = np.random.default_rng(seed)
+    return gpd.GeoDataFrame(
+        {
+            "has_images": rng.random(count) < 0.5,
+            "TRAJECTORYID": np.repeat([16642, 16643], count // 2),
+            "IMAGE_NAME": [f"{i:06d}.jpg" for i in range(count)],
+        },
+        geometry=gpd.points_from_xy(
+            rng.uniform(16.30, 16.40, count), rng.uniform(48.18, 48.24, count)
+        ),
+        crs=4326,
+    )
+
+
+def read_archive(path) -> tuple[dict, dict[tuple[int, int, int], bytes]]:
+    with path.open("rb") as f:
+        get_bytes = MmapSource(f)
+        return Reader(get_bytes).header(), dict(all_tiles(get_bytes))
+
+
+def test_build_pmtiles_writes_readable_archive(tmp_path):
+    output = tmp_path / "images.pmtiles"
+
+    encoded, reused = build_pmtiles(image_points(), output, min_zoom=10, max_zoom=14, workers=1)
+
+    header, tiles = read_archive(output)
+    assert (encoded, reused) == (len(tiles), 0)
+    assert (header["min_zoom"], header["max_zoom"]) == (10, 14)
+    assert {z for z, _, _ in tiles} == set(range(10, 15))
+    assert not (tmp_path / "images.pmtiles.tmp").exists()
+    # Every point is in a tile at max zoom, buffered copies aside.
+    names = set()
+    for (z, _, _), data in tiles.items():
+        if z == 14:
+            layer = mapbox_vector_tile.decode(gzip.decompress(data))[LAYER_NAME]
+            names |= {feature["properties"]["IMAGE_NAME"] for feature in layer["features"]}
+    assert len(names) == 200
+
+
+def test_build_pmtiles_reuses_unchanged_tiles(tmp_path):
+    output = tmp_path / "images.pmtiles"
+    points = image_points()
+    build_pmtiles(points, output, min_zoom=10, max_zoom=14, workers=1)
+    _, before = read_archive(output)
+
+    assert build_pmtiles(points, output, min_zoom=10, max_zoom=14, workers=1) == (0, len(before))
+    _, after = read_archive(output)
+    assert after == before
+
+    changed = points.copy()
+    changed.loc[0, "IMAGE_NAME"] = "changed.jpg"
+    encoded, reused = build_pmtiles(changed, output, min_zoom=10, max_zoom=14, workers=1)
+    _, after = read_archive(output)
+    assert 0 < encoded < len(before)
+    assert encoded + reused == len(after)
+
+
+def test_build_pmtiles_rebuilds_on_new_zoom_range(tmp_path):
+    output = tmp_path / "images.pmtiles"
+    build_pmtiles(image_points(), output, min_zoom=10, max_zoom=14, workers=1)
+
+    encoded, reused = build_pmtiles(image_points(), output, min_zoom=10, max_zoom=13, workers=1)
+
+    assert reused == 0
+    assert pd.read_parquet(tmp_path / "images.pmtiles.hashes.parquet")["tile_id"].is_unique
@@ -0,0 +1,115 @@
+import os
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+from moto.server import ThreadedMotoServer
+
+from kappa import upload
+from kappa.upload import MB, UploadOptions, s3_etag, upload_files
+
+
+@pytest.fixture(scope="module")
+def endpoint_url():
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=0, verbose=False)
+    server.start()
+    host, port = server.get_host_and_port()
+    yield f"http://{host}:{port}"
+    server.stop()
+
+
+@pytest.fixture
+def bucket(endpoint_url, monkeypatch, request):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    name = request.node.name.replace("_", "-")
+    boto3.client("s3", endpoint_url=endpoint_url).create_bucket(Bucket=name)
+    return name
+
+
+def write_files(base_dir, sizes: dict[str, int]) -> list:
+    paths = []
+    for name, size in sizes.items():
+        path = base_dir / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(os.urandom(size))
+        paths.append(path)
+    return paths
+
+
+def remote_objects(endpoint_url, bucket) -> dict[str, tuple[int, str]]:
+    client = boto3.client("s3", endpoint_url=endpoint_url)
+    return upload.list_remote(client, bucket, "")
+
+
+def test_large_files_are_multipart_uploads(tmp_path, endpoint_url, bucket):
+    paths = write_files(tmp_path / "data", {"a.json": 100, "tiles/b.copc.laz": 11 * MB})
+    options = UploadOptions(
+        bucket,
+        "stac/",
+        endpoint_url,
+        workers=2,
+        multipart_threshold=5 * MB,
+        multipart_chunksize=5 * MB,
+    )
+
+    assert upload_files(tmp_path / "data", paths, options, tmp_path / "journal") == (2, 0)
+    remote = remote_objects(endpoint_url, bucket)
+    assert sorted(remote) == ["stac/a.json", "stac/tiles/b.copc.laz"]
+    assert remote["stac/tiles/b.copc.laz"] == (11 * MB, s3_etag(paths[1], 5 * MB, 5 * MB))
+    assert remote["stac/tiles/b.copc.laz"][1].endswith("-3")
+    head = boto3.client("s3", endpoint_url=endpoint_url).head_object(
+        Bucket=bucket, Key="stac/tiles/b.copc.laz"
+    )
+    assert head["ContentType"] == "application/vnd.laszip+copc"
+
+
+def test_unchanged_files_are_skipped(tmp_path, endpoint_url, bucket):
+    paths = write_files(tmp_path / "data", {"a.json": 100, "b.json": 200})
+    options = UploadOptions(bucket, endpoint_url=endpoint_url, workers=2)
+    journal = tmp_path / "journal"
+    upload_files(tmp_path / "data", paths, options, journal)
+
+    # Skipped by the journal, then by remote size and ETag once it is gone.
+    assert upload_files(tmp_path / "data", paths, options, journal) == (0, 2)
+    journal.unlink()
+    assert upload_files(tmp_path / "data", paths, options, journal) == (0, 2)
+
+    # Same size, other content.
+    paths[0].write_bytes(os.urandom(100))
+    journal.unlink()
+    assert upload_files(tmp_path / "data", paths, options, journal) == (1, 1)
+    options.size_only = True
+    paths[1].write_bytes(os.urandom(200))
+    journal.unlink()
+    assert upload_files(tmp_path / "data", paths, options, journal) == (0, 2)
+
+
+def test_missing_bucket_fails(tmp_path, endpoint_url, bucket):
+    paths = write_files(tmp_path / "data", {"a.json": 100})
+    options = UploadOptions(f"{bucket}-missing", endpoint_url=endpoint_url)
+
+    with pytest.raises(ClientError, match="NoSuchBucket"):
+        upload_files(tmp_path / "data", paths, options, tmp_path / "journal")
+
+
+def test_failed_upload_resumes_from_journal(tmp_path, endpoint_url, bucket, monkeypatch):
+    paths = write_files(tmp_path / "data", {f"{name}.json": 100 for name in "abcd"})
+    options = UploadOptions(bucket, endpoint_url=endpoint_url, workers=1)
+    upload_file = upload.upload_file
+
+    def failing_upload_file(client, path, key, *args):
+        if key == "c.json":
+            raise ClientError({"Error": {"Code": "InternalError"}}, "PutObject")
+        upload_file(client, path, key, *args)
+
+    monkeypatch.setattr(upload, "upload_file", failing_upload_file)
+    with pytest.raises(ClientError, match="InternalError"):
+        upload_files(tmp_path / "data", paths, options, tmp_path / "journal")
+    assert "c.json" not in remote_objects(endpoint_url, bucket)
+
+    monkeypatch.setattr(upload, "upload_file", upload_file)
+    done = len(remote_objects(endpoint_url, bucket))
+    assert upload_files(tmp_path / "data", paths, options, tmp_path / "journal") == (4 - done, done)
+    assert sorted(remote_objects(endpoint_url, bucket)) == [f"{name}.json" for name in "abcd"]
@@ -0,0 +1,89 @@
+import threading
+from http.server import ThreadingHTTPServer
+
+import geopandas as gpd
+import orjson as json
+import pandas as pd
+import pytest
+
+from kappa import wfs
+from kappa.bench import stub_wfs, stub_wfs_handler, wfs_features
+from kappa.httpcache import CacheOptions
+from kappa.metadata import extract_image_metadata
+from kappa.synthetic import SyntheticOptions, generate_extract
+from kappa.wfs import DumpFormat, Layer, dump_layer
+
+
+@pytest.fixture(scope="module")
+def features(tmp_path_factory):
+    kappa_path = generate_extract(
+        tmp_path_factory.mktemp("extract"),
+        SyntheticOptions(images=30, trajectories=2, points_per_scan=100, face_size=0),
+    )
+    return wfs_features(extract_image_metadata(kappa_path))
+
+
+def read_dump(output, format: DumpFormat) -> pd.DataFrame:
+    match format:
+        case DumpFormat.geoparquet:
+            parts = sorted(output.glob("part-*.parquet"))
+            return pd.concat(map(gpd.read_parquet, parts), ignore_index=True)
+        case DumpFormat.geojsonseq:
+            lines = output.read_bytes().splitlines()
+            return pd.DataFrame([json.loads(line)["properties"] for line in lines])
+
+
+@pytest.mark.parametrize("format", list(DumpFormat))
+def test_dump_pages_through_the_layer(tmp_path, features, format):
+    output = tmp_path / f"images.{format.suffix}"
+    with stub_wfs(features) as url:
+        dump_layer(url, Layer.images, output, format, batch_size=7, concurrency=2)
+
+    dumped = read_dump(output, format)
+    assert dumped["OBJECTID"].tolist() == list(range(1, len(features) + 1))
+    assert not wfs.DumpCheckpoint.path_for(output).exists()
+    if format == DumpFormat.geoparquet:
+        assert len(list(output.glob("part-*.parquet"))) == 5
+
+
+def test_dump_retries_failed_and_truncated_pages(tmp_path, features, monkeypatch):
+    monkeypatch.setattr(wfs.time, "sleep", lambda seconds: None)
+    failures = {"0": 503, "7": "truncated"}
+    requests = []
+
+    class FlakyHandler(stub_wfs_handler(features)):
+        def do_GET(self):
+            start = self.path.partition("startIndex=")[2].partition("&")[0]
+            requests.append(start)
+            failure = failures.pop(start, None) if "maxFeatures=7" in self.path else None
+            if failure == 503:
+                self.send_error(503)
+            elif failure == "truncated":
+                self.send_response(200)
+                self.send_header("Content-Length", "10")
+                self.end_headers()
+                self.wfile.write(b'{"type":"F')
+            else:
+                super().do_GET()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FlakyHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    output = tmp_path / "images.geojsonl"
+    try:
+        dump_layer(
+            f"http://127.0.0.1:{server.server_address[1]}/geo?service=WFS",
+            Layer.images,
+            output,
+            DumpFormat.geojsonseq,
+            batch_size=7,
+            # The truncated page must not be served from the cache on its retry.
+            cache=CacheOptions(cache_dir=tmp_path / "cache"),
+        )
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert not failures
+    assert requests.count("0") == 3 and requests.count("7") == 2
+    dumped = read_dump(output, DumpFormat.geojsonseq)
+    assert dumped["OBJECTID"].tolist() == list(range(1, len(features) + 1))